@@ -0,0 +1,560 @@
+import argparse
+import contextlib
+import functools
+import json
+import logging
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import reset_dbs
+from column_store import ColumnStore
+from vin_decoder import DECODER_PATH, VinDecoder
+from vehicle_store import VehicleStore
+
+# Share of generated VINs with no decoder entry; about what the checked-in vins.csv has
+UNMATCHED_FRACTION = 0.97
+
+# Rows generated and written to the feed CSV at a time
+GENERATE_CHUNK_ROWS = 1000000
+
+# Share of the feed replaced with new VINs for the incremental ingest run
+INCREMENTAL_CHANGE_FRACTION = 0.01
+
+# Times each headless query is run; the minimum and median are reported
+QUERY_REPEATS = 5
+
+# Load paths the benchmark knows, in the order they are run
+PIPELINE_PATHS = ['legacy', 'bulk', 'incremental']
+
+# reset_dbs functions timed as pipeline stages; nested calls are recorded under their caller
+PIPELINE_STAGES = [
+    'process_file', 'process_file_chunked', 'drop_column_in_files', 'import_to_db', 'import_feeds_in_parallel',
+    'create_merged_admin_table', 'create_merged_nonadmin_table', 'copy_data_to_target_database_with_surrogate_key',
+    'cleanup_databases', 'bulk_load', 'incremental_ingest', 'stage_vin_feed', 'upgrade_schema', 'create_indexes',
+    'rebuild_summaries',
+]
+
+# A slowdown beyond this ratio against the baseline is reported as a regression, unless it is
+# smaller than the minimum, which keeps timer noise on sub-millisecond queries out of the report
+REGRESSION_RATIO = 1.25
+REGRESSION_MIN_SECONDS = 0.005
+
+# Longest make_ui may take from import until the login window has been drawn
+STARTUP_BUDGET_SECONDS = 1.0
+
+# Modules make_ui must not import before the login window is shown
+STARTUP_DEFERRED_MODULES = ['pandas', 'numpy', 'matplotlib', 'vin_decoder', 'change_sets', 'column_store']
+
+# Run in a fresh interpreter to time make_ui's import and login window; prints a JSON result
+STARTUP_PROBE = '''
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+import make_ui
+imported = time.perf_counter() - start
+window_seconds = None
+try:
+    window = make_ui.create_login_window()
+    window.update()
+    window_seconds = time.perf_counter() - start
+    window.destroy()
+except Exception:  # No display to draw the window on
+    pass
+print(json.dumps({'import_seconds': imported, 'window_seconds': window_seconds,
+                  'loaded': [name for name in sys.argv[2:] if name in sys.modules]}))
+'''
+
+# Characters allowed in VINs, and the values and position weights of the check digit (ISO 3779)
+VIN_CHARACTERS = 'ABCDEFGHJKLMNPRSTUVWXYZ0123456789'
+VIN_LETTER_VALUES = dict(zip('ABCDEFGHJKLMNPRSTUVWXYZ', [1, 2, 3, 4, 5, 6, 7, 8, 1, 2, 3, 4, 5, 7, 9, 2, 3, 4, 5, 6, 7,
+                                                         8, 9]))
+VIN_WEIGHTS = np.array([8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2])
+
+
+def vin_value_table():
+    """Returns an array mapping each ASCII code to its check-digit value."""
+    values = np.zeros(256, dtype=np.int64)
+    for character, value in VIN_LETTER_VALUES.items():
+        values[ord(character)] = value
+    for digit in range(10):
+        values[ord(str(digit))] = digit
+    return values  # Some decoder prefixes use O, which VINs do not; it counts as zero
+
+
+VIN_VALUES = vin_value_table()
+
+# World manufacturer identifiers and feed make codes used for VINs that do not decode
+UNMATCHED_MAKES = {
+    '1FT': 'FORD', '1FA': 'FORD', '1GC': 'CHEV', '1G1': 'CHEV', '4T1': 'TOYT', '5TD': 'TOYT',
+    '1GT': 'GMC ', '1N4': 'NISS', '1HG': 'HOND', '2C3': 'DODG', '1C4': 'JEEP', '5UX': 'BMW ',
+}
+
+
+def vin_check_digits(vins):
+    """Returns the check digit of each 17-character VIN in a byte array of shape (n, 17)."""
+    remainders = (VIN_VALUES[vins] * VIN_WEIGHTS).sum(axis=1) % 11
+    return np.where(remainders == 10, ord('X'), ord('0') + remainders).astype(np.uint8)
+
+
+def random_characters(rng, count, width, alphabet=VIN_CHARACTERS):
+    """Returns a byte array of shape (count, width) of characters drawn from alphabet."""
+    letters = np.frombuffer(alphabet.encode('ascii'), dtype=np.uint8)
+    return letters[rng.integers(0, len(letters), size=(count, width))]
+
+
+def string_bytes(values, width):
+    """Returns fixed-width strings as a byte array of shape (n, width)."""
+    return np.frombuffer(np.asarray(values, dtype=f'S{width}').tobytes(), dtype=np.uint8).reshape(-1, width)
+
+
+def decoder_catalogue(decoder_path=DECODER_PATH):
+    """Returns the decoder rows that VINs are generated from and the set of their lookup keys."""
+    decoder = VinDecoder.load(decoder_path)
+    rows = decoder.rows
+    prefixes = rows.iloc[:, 0].astype(str).str[:8]
+    year_codes = rows.iloc[:, 1].astype(str).str[:1]
+    catalogue = pd.DataFrame({
+        'prefix': prefixes,
+        'year_code': year_codes,
+        'make': rows['Make'].astype(str).str.upper().str[:4].str.ljust(4),
+        'model': rows['Model-full'].astype(str).str.upper().str[:3],
+        'model_year': rows['Model Year'],
+    })
+    return catalogue, set(decoder.keys)
+
+
+def generate_vins(count, catalogue, decoder_keys, unmatched_fraction=UNMATCHED_FRACTION, rng=None):
+    """Returns a DataFrame of synthetic VINs in the vins.csv layout.
+
+    Matched VINs take their prefix and model-year code from a random decoder row; unmatched VINs
+    get a common manufacturer prefix whose key is not in the decoder. Every VIN has a valid check
+    digit and a random plant code and serial number.
+    """
+    rng = rng or np.random.default_rng()
+    unmatched = rng.random(count) < unmatched_fraction
+    matched_count = int((~unmatched).sum())
+    unmatched_count = count - matched_count
+
+    prefixes = np.empty((count, 8), dtype=np.uint8)
+    year_codes = np.empty((count, 1), dtype=np.uint8)
+    makes = np.empty(count, dtype=object)
+    models = np.empty(count, dtype=object)
+    model_years = np.empty(count, dtype=object)
+
+    sample = catalogue.iloc[rng.integers(0, len(catalogue), size=matched_count)]
+    prefixes[~unmatched] = string_bytes(sample['prefix'], 8)
+    year_codes[~unmatched] = string_bytes(sample['year_code'], 1)
+    makes[~unmatched] = sample['make'].to_numpy()
+    models[~unmatched] = sample['model'].to_numpy()
+    model_years[~unmatched] = sample['model_year'].to_numpy()
+
+    # Unmatched prefixes are redrawn until none of them happens to decode
+    wmis = np.array(list(UNMATCHED_MAKES))
+    chosen = wmis[rng.integers(0, len(wmis), size=unmatched_count)]
+    year_offsets = rng.integers(0, 30, size=unmatched_count)
+    year_letters = np.frombuffer(b'ABCDEFGHJKLMNPRSTVWXY123456789', dtype=np.uint8)
+    unmatched_prefixes = np.hstack([string_bytes(chosen, 3), random_characters(rng, unmatched_count, 5)])
+    unmatched_years = year_letters[year_offsets].reshape(-1, 1)
+    while unmatched_count:
+        keys = np.hstack([unmatched_prefixes, unmatched_years]).view('S9').ravel().astype(str)
+        clashes = np.isin(keys, list(decoder_keys)) if decoder_keys else np.zeros(len(keys), dtype=bool)
+        if not clashes.any():
+            break
+        unmatched_prefixes[clashes, 3:] = random_characters(rng, int(clashes.sum()), 5)
+    prefixes[unmatched] = unmatched_prefixes
+    year_codes[unmatched] = unmatched_years
+    makes[unmatched] = [UNMATCHED_MAKES[wmi] for wmi in chosen]
+    models[unmatched] = ''
+    model_years[unmatched] = 1980 + year_offsets
+
+    serials = np.hstack([random_characters(rng, count, 1), random_characters(rng, count, 6, '0123456789')])
+    vins = np.hstack([prefixes, np.zeros((count, 1), dtype=np.uint8), year_codes, serials])
+    vins[:, 8] = ord('0')
+    vins[:, 8] = vin_check_digits(vins)
+
+    return pd.DataFrame({
+        'VIN-NR': vins.view('S17').ravel().astype(str),
+        'MAKE-OF-CAR': makes,
+        'MODEL-Short': models,
+        'MODEL-YEAR': model_years,
+    })
+
+
+def write_vin_feed(path, rows, decoder_path=DECODER_PATH, unmatched_fraction=UNMATCHED_FRACTION, seed=0,
+                   chunk_rows=GENERATE_CHUNK_ROWS):
+    """Writes a synthetic VIN feed CSV of the given size, chunk by chunk, and returns its row count."""
+    catalogue, decoder_keys = decoder_catalogue(decoder_path)
+    rng = np.random.default_rng(seed)
+    written = 0
+    while written < rows:
+        count = min(chunk_rows, rows - written)
+        frame = generate_vins(count, catalogue, decoder_keys, unmatched_fraction, rng)
+        frame.to_csv(path, mode='w' if written == 0 else 'a', header=written == 0, index=False)
+        written += count
+    if rows == 0:
+        pd.DataFrame(columns=['VIN-NR', 'MAKE-OF-CAR', 'MODEL-Short', 'MODEL-YEAR']).to_csv(path, index=False)
+    return written
+
+
+def write_changed_feed(source_path, path, decoder_path=DECODER_PATH, change_fraction=INCREMENTAL_CHANGE_FRACTION,
+                       unmatched_fraction=UNMATCHED_FRACTION, seed=1):
+    """Writes a copy of a feed whose last change_fraction of rows are replaced with new VINs."""
+    feed = pd.read_csv(source_path, dtype={'VIN-NR': str})
+    changed = int(len(feed) * change_fraction)
+    if changed:
+        catalogue, decoder_keys = decoder_catalogue(decoder_path)
+        replacement = generate_vins(changed, catalogue, decoder_keys, unmatched_fraction, np.random.default_rng(seed))
+        feed = pd.concat([feed.iloc[:len(feed) - changed], replacement], ignore_index=True)
+    feed.to_csv(path, index=False)
+    return changed
+
+
+@contextlib.contextmanager
+def timed_stages(module, names, results, path_name):
+    """Wraps module functions so their calls are recorded in results as pipeline stages.
+
+    Repeated calls of a stage from the same caller add up into one result with a call count.
+    """
+    originals = {name: getattr(module, name) for name in names if hasattr(module, name)}
+    active = []
+    recorded = {}
+
+    def wrap(name, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            stage = '/'.join([path_name] + active + [name])
+            active.append(name)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                active.pop()
+                elapsed = time.perf_counter() - start
+                if stage in recorded:
+                    recorded[stage]['seconds'] += elapsed
+                    recorded[stage]['calls'] += 1
+                else:
+                    recorded[stage] = {'name': stage, 'kind': 'stage', 'seconds': elapsed, 'calls': 1}
+                    results.append(recorded[stage])
+        return timed
+
+    for name, function in originals.items():
+        setattr(module, name, wrap(name, function))
+    try:
+        yield
+    finally:
+        for name, function in originals.items():
+            setattr(module, name, function)
+
+
+def run_pipeline(path_name, feed_path, changed_feed_path, results):
+    """Runs one load path in the current directory, recording its stages and total time."""
+    start = time.perf_counter()
+    with timed_stages(reset_dbs, PIPELINE_STAGES, results, path_name):
+        if path_name == 'legacy':
+            shutil.copy(feed_path, 'vins.csv')
+            reset_dbs.main()
+            reset_dbs.copy_data_to_target_database_with_surrogate_key()
+            reset_dbs.cleanup_databases()
+        elif path_name == 'bulk':
+            reset_dbs.bulk_load([feed_path], 'data.db')
+        elif path_name == 'incremental':
+            reset_dbs.incremental_ingest(changed_feed_path, 'data.db')
+        else:
+            raise ValueError(f'Unknown pipeline path {path_name}')
+    results.append({'name': path_name, 'kind': 'pipeline', 'seconds': time.perf_counter() - start})
+
+
+def time_query(name, query, repeats):
+    """Runs a query repeats times and returns its timing result."""
+    timings = []
+    outcome = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        outcome = query()
+        timings.append(time.perf_counter() - start)
+    if isinstance(outcome, list):
+        rows = len(outcome)
+    elif isinstance(outcome, dict) and isinstance(outcome.get('rows'), int):
+        rows = outcome['rows']  # An export summary
+    else:
+        rows = None
+    return {
+        'name': f'query/{name}',
+        'kind': 'query',
+        'seconds': min(timings),
+        'seconds_median': statistics.median(timings),
+        'repeats': repeats,
+        'rows': rows,
+    }
+
+
+def distinct_values_scan(store, table_name):
+    """Lists every column's distinct values straight from the table, as the dialogs did before facets."""
+    cursor = store.cursor()
+    values = {}
+    for col in store.columns(table_name):
+        cursor.execute(f'SELECT DISTINCT "{col}" FROM {table_name} WHERE "{col}" IS NOT NULL')
+        values[col] = [row[0] for row in cursor.fetchall()]
+    return values
+
+
+def keyed_update(store, table_name, key):
+    """Rewrites one entry with its current values through the store's update path."""
+    entry = store.lookup(table_name, key)
+    store.update_entry(table_name, key, tuple(entry.values())[1:])
+    return entry
+
+
+def run_queries(database_path, work_directory, repeats=QUERY_REPEATS):
+    """Times the headless versions of the UI's queries against a loaded database."""
+    store = VehicleStore(database_path)
+    cursor = store.cursor()
+    cursor.execute('SELECT Make, COUNT(*) FROM merged_nonadmin GROUP BY Make ORDER BY 2 DESC LIMIT 1')
+    top_make = (cursor.fetchone() or (None,))[0]
+    cursor.execute('SELECT "MAKE-OF-CAR", COUNT(*) FROM unmerged_vins GROUP BY 1 ORDER BY 2 DESC LIMIT 1')
+    top_unmerged_make = (cursor.fetchone() or (None,))[0]
+    cursor.execute('SELECT Model_Year FROM merged_nonadmin GROUP BY Model_Year ORDER BY COUNT(*) DESC LIMIT 1')
+    top_year = (cursor.fetchone() or (None,))[0]
+    cursor.execute('SELECT "VIN-NR" FROM merged_admin ORDER BY Surrogate_Key DESC LIMIT 1')
+    admin_vin = (cursor.fetchone() or (None,))[0]
+    cursor.execute('SELECT "VIN-NR" FROM unmerged_vins ORDER BY rowid DESC LIMIT 1')
+    unmerged_vin = (cursor.fetchone() or (None,))[0]
+    cursor.execute('SELECT MAX(Surrogate_Key) FROM merged_nonadmin')
+    last_key = cursor.fetchone()[0] or 0
+    export_path = os.path.join(work_directory, 'benchmark_export.csv')
+
+    queries = {
+        'facets_merged_nonadmin': lambda: store.column_values('merged_nonadmin'),
+        'facets_unmerged_vins': lambda: store.column_values('unmerged_vins'),
+        'distinct_scan_merged_nonadmin': lambda: distinct_values_scan(store, 'merged_nonadmin'),
+        'distinct_scan_unmerged_vins': lambda: distinct_values_scan(store, 'unmerged_vins'),
+        'export_merged_nonadmin_by_make': lambda: store.export('merged_nonadmin', {'Make': top_make}, export_path),
+        'export_unmerged_vins_by_make':
+            lambda: store.export('unmerged_vins', {'MAKE-OF-CAR': top_unmerged_make}, export_path),
+        'graph_technology': lambda: store.counts('merged_nonadmin', 'Technology'),
+        'graph_make_for_year': lambda: store.counts('merged_nonadmin', 'Make', {'Model_Year': top_year}),
+        'graph_manufacturer': lambda: store.counts('merged_nonadmin', 'Vehicle_Manufacturer'),
+        'graph_unmerged_make': lambda: store.counts('unmerged_vins', 'MAKE-OF-CAR'),
+        'typeahead_unmerged_make': lambda: store.search_values('unmerged_vins', 'MAKE-OF-CAR', 'F'),
+        'page_first': lambda: store.query('merged_nonadmin', {}, 100)['rows'],
+        'page_last': lambda: store.query('merged_nonadmin', {}, 100, after=max(last_key - 100, 0))['rows'],
+        'page_sorted_by_make': lambda: store.query('merged_nonadmin', {}, 100, order_by='Make')['rows'],
+        'lookup_merged_admin': lambda: store.lookup('merged_admin', admin_vin),
+    }
+    # The column store's load is timed once; its counts are the graph queries above answered in memory
+    column_store = ColumnStore(store, 'merged_nonadmin')
+    load_result = time_query('column_store_load', lambda: column_store.counts('Technology'), 1)
+    queries.update({
+        'column_store_graph_technology': lambda: column_store.counts('Technology'),
+        'column_store_graph_make_for_year': lambda: column_store.counts('Make', {'Model_Year': top_year}),
+        'column_store_graph_manufacturer': lambda: column_store.counts('Vehicle_Manufacturer'),
+        'column_store_cross_filter': lambda: column_store.counts('Model_Year', {'Make': top_make,
+                                                                                'Vehicle_Category': 'Car'}),
+    })
+    if top_make is not None:
+        queries['search_name_top_make'] = lambda: store.search_names('merged_nonadmin', str(top_make))['rows']
+    if admin_vin is not None:
+        queries['search_vin_prefix'] = lambda: store.search_vins('merged_admin', admin_vin[:5])['rows']
+        queries['keyed_update_merged_admin'] = lambda: keyed_update(store, 'merged_admin', admin_vin)
+    if unmerged_vin is not None:
+        queries['keyed_update_unmerged_vins'] = lambda: keyed_update(store, 'unmerged_vins', unmerged_vin)
+
+    results = [load_result] + [time_query(name, query, repeats) for name, query in queries.items()]
+    store.connections.release()
+    return results
+
+
+def measure_startup(repeats=QUERY_REPEATS, budget_seconds=STARTUP_BUDGET_SECONDS):
+    """Times make_ui's startup in fresh interpreters and checks it against the budget.
+
+    Returns (results, problems); problems lists the budget overruns and the deferred modules
+    that were imported before the login window was drawn.
+    """
+    package_directory = os.path.dirname(os.path.abspath(__file__))
+    probes = []
+    with tempfile.TemporaryDirectory() as work_directory:  # make_ui writes app.log to its directory
+        for _ in range(repeats):
+            completed = subprocess.run([sys.executable, '-c', STARTUP_PROBE, package_directory,
+                                        *STARTUP_DEFERRED_MODULES],
+                                       capture_output=True, text=True, cwd=work_directory, check=True)
+            probes.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    results = []
+    for name, field in (('import_make_ui', 'import_seconds'), ('login_window', 'window_seconds')):
+        timings = [probe[field] for probe in probes if probe[field] is not None]
+        if timings:
+            results.append({'name': f'startup/{name}', 'kind': 'startup', 'seconds': min(timings),
+                            'seconds_median': statistics.median(timings), 'repeats': len(timings)})
+
+    problems = []
+    measured = results[-1]  # The login window when there is a display to draw it on, else the import
+    if measured['seconds_median'] > budget_seconds:
+        problems.append(f"{measured['name']} took {measured['seconds_median']:.3f}s, "
+                        f"over the {budget_seconds:.3f}s budget")
+    loaded = sorted({name for probe in probes for name in probe['loaded']})
+    if loaded:
+        problems.append(f"make_ui imported {', '.join(loaded)} before the login window")
+    return results, problems
+
+
+def environment_details():
+    """Returns the versions and revision the results were measured with."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run_benchmark(rows, paths=('bulk', 'incremental'), unmatched_fraction=UNMATCHED_FRACTION, seed=0,
+                  repeats=QUERY_REPEATS, decoder_path=DECODER_PATH, feed_path=None,
+                  change_fraction=INCREMENTAL_CHANGE_FRACTION):
+    """Generates a feed, runs the load paths and the headless queries, and returns the report."""
+    decoder_path = os.path.abspath(decoder_path)
+    unknown_paths = [path_name for path_name in paths if path_name not in PIPELINE_PATHS]
+    if unknown_paths:
+        raise ValueError(f'Unknown pipeline paths {unknown_paths} (use {", ".join(PIPELINE_PATHS)})')
+    if list(paths) == ['incremental']:
+        raise ValueError('The incremental path needs a database; run it after legacy or bulk')
+
+    report = {
+        'benchmark': 'vehicle_pipeline',
+        'started': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'environment': environment_details(),
+        'parameters': {'rows': rows, 'unmatched_fraction': unmatched_fraction, 'seed': seed,
+                       'paths': list(paths), 'repeats': repeats, 'change_fraction': change_fraction},
+        'results': [],
+    }
+    results = report['results']
+    original_directory = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as work_directory:
+        os.chdir(work_directory)
+        try:
+            # Each run gets a private working directory; the decoder cache is warmed outside the timing
+            shutil.copy(decoder_path, 'VIN_decoder.csv')
+            VinDecoder.load()
+
+            start = time.perf_counter()
+            if feed_path:
+                shutil.copy(os.path.join(original_directory, feed_path), 'feed.csv')
+                rows = sum(1 for _ in open('feed.csv')) - 1
+            else:
+                write_vin_feed('feed.csv', rows, 'VIN_decoder.csv', unmatched_fraction, seed)
+            results.append({'name': 'generate_feed', 'kind': 'setup', 'seconds': time.perf_counter() - start,
+                            'rows': rows})
+            if 'incremental' in paths:
+                start = time.perf_counter()
+                changed = write_changed_feed('feed.csv', 'changed_feed.csv', 'VIN_decoder.csv', change_fraction,
+                                             unmatched_fraction, seed + 1)
+                results.append({'name': 'generate_changed_feed', 'kind': 'setup',
+                                'seconds': time.perf_counter() - start, 'rows': changed})
+
+            for path_name in PIPELINE_PATHS:
+                if path_name in paths:
+                    print(f'Running the {path_name} load path on {rows} rows')
+                    run_pipeline(path_name, os.path.abspath('feed.csv'), os.path.abspath('changed_feed.csv'),
+                                 results)
+
+            print('Timing headless queries')
+            results.extend(run_queries(os.path.abspath('data.db'), work_directory, repeats))
+            report['database_bytes'] = os.path.getsize('data.db')
+
+            print('Timing make_ui startup')
+            startup_results, report['startup_problems'] = measure_startup(repeats)
+            results.extend(startup_results)
+        finally:
+            os.chdir(original_directory)
+    return report
+
+
+def compare_reports(baseline, current, ratio=REGRESSION_RATIO, min_seconds=REGRESSION_MIN_SECONDS):
+    """Returns [(name, baseline seconds, current seconds)] for results that got slower than ratio allows."""
+    baseline_seconds = {result['name']: result['seconds'] for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        before = baseline_seconds.get(result['name'])
+        if before and result['seconds'] > before * ratio and result['seconds'] - before > min_seconds:
+            regressions.append((result['name'], before, result['seconds']))
+    return regressions
+
+
+def print_report(report):
+    for result in report['results']:
+        rows = f" ({result['rows']} rows)" if result.get('rows') is not None else ''
+        print(f"{result['name']:<70} {result['seconds']:>10.4f}s{rows}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the ingest pipeline and the UI queries on synthetic VINs.')
+    parser.add_argument('--rows', type=int, default=100000, help='VINs to generate (default 100000)')
+    parser.add_argument('--unmatched-fraction', type=float, default=UNMATCHED_FRACTION,
+                        help=f'share of VINs that do not decode (default {UNMATCHED_FRACTION})')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the generated feed (default 0)')
+    parser.add_argument('--paths', nargs='+', default=['bulk', 'incremental'], choices=PIPELINE_PATHS,
+                        help='load paths to time (default bulk incremental)')
+    parser.add_argument('--repeats', type=int, default=QUERY_REPEATS,
+                        help=f'runs of each query (default {QUERY_REPEATS})')
+    parser.add_argument('--decoder', default=DECODER_PATH, help='decoder CSV (default VIN_decoder.csv)')
+    parser.add_argument('--feed', help='benchmark an existing VIN feed instead of generating one')
+    parser.add_argument('--generate', metavar='PATH', help='only write a synthetic feed of --rows VINs to PATH')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON report to write')
+    parser.add_argument('--history', default='benchmark_history.jsonl',
+                        help='JSON-lines file every report is appended to (default benchmark_history.jsonl)')
+    parser.add_argument('--compare', metavar='BASELINE', help='report results slower than a previous JSON report')
+    parser.add_argument('--startup', action='store_true',
+                        help='only check make_ui startup against its budget; exits with status 1 if over it')
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET_SECONDS,
+                        help=f'startup budget in seconds (default {STARTUP_BUDGET_SECONDS})')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.generate:
+        written = write_vin_feed(args.generate, args.rows, args.decoder, args.unmatched_fraction, args.seed)
+        print(f'Wrote {written} synthetic VINs to {args.generate}')
+        sys.exit(0)
+    if args.startup:
+        startup_results, problems = measure_startup(args.repeats, args.startup_budget)
+        print_report({'results': startup_results})
+        for problem in problems:
+            print(f'Startup check failed: {problem}')
+        sys.exit(1 if problems else 0)
+
+    report = run_benchmark(args.rows, args.paths, args.unmatched_fraction, args.seed, args.repeats, args.decoder,
+                           args.feed)
+    print_report(report)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    with open(args.history, 'a') as f:
+        f.write(json.dumps(report) + '\n')
+    logging.info(f"Benchmark of {report['parameters']} written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_reports(json.load(f), report)
+        for name, before, after in regressions:
+            print(f'Regression: {name} took {after:.4f}s, was {before:.4f}s ({after / before:.2f}x)')
+        sys.exit(1 if regressions else 0)
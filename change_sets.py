@@ -0,0 +1,254 @@
+import logging
+import sqlite3
+import time
+
+import pandas as pd
+
+from facets import refresh_unlisted_facets
+from key_allocator import reserve_surrogate_keys
+from query_builder import table_columns
+from vehicle_store import ENTRY_STATEMENTS
+
+# Operations a change set can contain, in the order they are applied
+CHANGE_OPERATIONS = ('remove', 'update', 'add')
+
+# Tables a change set can edit; merged_nonadmin is a view of merged_admin
+CHANGE_SET_TABLES = ['merged_admin', 'unmerged_vins']
+
+# Columns of the error report
+ERROR_REPORT_COLUMNS = ['row', 'operation', 'VIN-NR', 'error']
+
+
+def read_change_set(source):
+    """Returns a change set as a DataFrame, from a CSV path or an existing DataFrame.
+
+    The change set has an operation column (add, update or remove), a VIN-NR column and any of
+    the table's other columns. Blank cells are stored as NULL; columns left out of an update keep
+    their current values.
+    """
+    if isinstance(source, pd.DataFrame):
+        return source
+    return pd.read_csv(source, dtype=str, keep_default_na=False)
+
+
+def cell_value(value):
+    """Returns the value to store for a change-set cell; blank and missing cells become None."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, str):
+        return value.strip() or None
+    return value
+
+
+def integer_value(value):
+    """Returns a cell as an int, or raises ValueError if it is not a whole number."""
+    if value is None:
+        return None
+    number = float(value)
+    if not number.is_integer():
+        raise ValueError(f'{value} is not a whole number')
+    return int(number)
+
+
+def fetch_existing_rows(cursor, table_name, vins):
+    """Returns {VIN-NR: {column: value}} for the VINs that are already in the table."""
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS change_set_vins (vin TEXT PRIMARY KEY)')
+    cursor.execute('DELETE FROM change_set_vins')
+    cursor.executemany('INSERT OR IGNORE INTO change_set_vins (vin) VALUES (?)', [(vin,) for vin in vins])
+    cursor.execute(f'SELECT {table_name}.* FROM {table_name} JOIN change_set_vins ON {table_name}."VIN-NR" = vin')
+    columns = [description[0] for description in cursor.description]
+    existing = {}
+    for row in cursor.fetchall():
+        entry = dict(zip(columns, row))
+        existing[entry['VIN-NR']] = entry
+    cursor.execute('DROP TABLE change_set_vins')
+    return existing
+
+
+def validate_change_set(cursor, table_name, frame):
+    """Checks every operation in a change set against the table.
+
+    Returns (operations, errors): operations maps each operation to a list of complete rows
+    ({column: value}) ready to write, and errors lists one {'row', 'operation', 'VIN-NR', 'error'}
+    entry per rejected operation, numbering rows from 1.
+    """
+    if table_name not in CHANGE_SET_TABLES:
+        raise ValueError(f'Change sets cannot edit {table_name}')
+    column_types = dict(table_columns(cursor, table_name))
+    for required in ('operation', 'VIN-NR'):
+        if required not in frame.columns:
+            raise ValueError(f'Change set has no {required} column')
+    unknown_columns = [col for col in frame.columns if col != 'operation' and col not in column_types]
+    if unknown_columns:
+        raise ValueError(f'Unknown columns in change set for {table_name}: {unknown_columns}')
+
+    value_columns = [col for col in frame.columns if col not in ('operation', 'VIN-NR')]
+    integer_columns = {col for col, col_type in column_types.items() if 'INT' in col_type}
+    operations = {operation: [] for operation in CHANGE_OPERATIONS}
+    errors = []
+    parsed = []
+    seen_vins = set()
+
+    # Parse every row before touching the database, so the existing-row lookup is one query
+    for row_number, record in enumerate(frame.to_dict('records'), start=1):
+        operation = str(cell_value(record['operation']) or '').lower()
+        vin = cell_value(record['VIN-NR'])
+        vin = str(vin) if vin is not None else None
+        try:
+            if operation not in CHANGE_OPERATIONS:
+                raise ValueError(f"Unknown operation '{operation}' (use add, update or remove)")
+            if vin is None:
+                raise ValueError('VIN-NR is blank')
+            if vin in seen_vins:
+                raise ValueError('VIN-NR appears more than once in the change set')
+            values = {}
+            for col in value_columns:
+                value = cell_value(record[col])
+                values[col] = integer_value(value) if col in integer_columns else value
+        except ValueError as e:
+            errors.append({'row': row_number, 'operation': operation, 'VIN-NR': vin, 'error': str(e)})
+            continue
+        seen_vins.add(vin)
+        parsed.append((row_number, operation, vin, values))
+
+    existing = fetch_existing_rows(cursor, table_name, [vin for _, _, vin, _ in parsed])
+
+    for row_number, operation, vin, values in parsed:
+        error = None
+        if operation == 'add' and vin in existing:
+            error = 'VIN-NR is already in the table'
+        elif operation != 'add' and vin not in existing:
+            error = 'VIN-NR is not in the table'
+        if error:
+            errors.append({'row': row_number, 'operation': operation, 'VIN-NR': vin, 'error': error})
+            continue
+
+        if operation == 'add':
+            entry = {col: None for col in column_types}
+        else:
+            entry = dict(existing[vin])
+        if operation != 'remove':
+            entry.update(values)
+            entry['VIN-NR'] = vin
+        if table_name == 'merged_admin':
+            # merged_admin keys are allocated by the sequence and are what merged_nonadmin shows
+            entry['Surrogate_Key'] = existing[vin]['Surrogate_Key'] if vin in existing else None
+        operations[operation].append((row_number, entry))
+
+    if table_name == 'unmerged_vins':
+        errors.extend(check_unmerged_keys(cursor, operations))
+
+    errors.sort(key=lambda error: error['row'])
+    return operations, errors
+
+
+def check_unmerged_keys(cursor, operations):
+    """Rejects unmerged_vins adds and updates whose Surrogate_Key another entry already has."""
+    claimed = {}
+    errors = []
+    for operation in ('update', 'add'):
+        kept = []
+        for row_number, entry in operations[operation]:
+            key = entry['Surrogate_Key']
+            if key is not None:
+                cursor.execute('SELECT "VIN-NR" FROM unmerged_vins WHERE Surrogate_Key = ?', (key,))
+                owner = cursor.fetchone()
+                if claimed.get(key, entry['VIN-NR']) != entry['VIN-NR'] or (owner and owner[0] != entry['VIN-NR']):
+                    errors.append({'row': row_number, 'operation': operation, 'VIN-NR': entry['VIN-NR'],
+                                   'error': f'Surrogate_Key {key} belongs to another entry'})
+                    continue
+                claimed[key] = entry['VIN-NR']
+            kept.append((row_number, entry))
+        operations[operation] = kept
+    return errors
+
+
+def apply_change_set(store, table_name, source, strict=False):
+    """Validates a change set and applies its valid operations to the table in one transaction.
+
+    Removes, updates and adds are each written with executemany; merged_nonadmin is a view of
+    merged_admin, so it needs no writes of its own. With strict set, any rejected row means
+    nothing is applied. Returns counts of the applied operations and the per-row error report.
+    """
+    start = time.perf_counter()
+    frame = read_change_set(source)
+    cursor = store.cursor()
+    conn = cursor.connection
+
+    # Hold the write lock from validation to commit, so the checks still hold when the rows are written
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        operations, errors = validate_change_set(cursor, table_name, frame)
+        if strict and errors:
+            conn.rollback()
+            operations = {operation: [] for operation in CHANGE_OPERATIONS}
+        elif table_name == 'merged_admin':
+            write_merged_admin_changes(cursor, operations)
+            conn.commit()
+        else:
+            write_unmerged_changes(cursor, operations)
+            conn.commit()
+    except (sqlite3.Error, ValueError):
+        conn.rollback()
+        raise
+    if operations['remove'] or operations['update']:
+        refresh_unlisted_facets(conn)  # Removed values may bring a high-cardinality column back under the limit
+    if any(operations.values()):
+        store.notify_changes(table_name)
+
+    report = {
+        'added': len(operations['add']),
+        'updated': len(operations['update']),
+        'removed': len(operations['remove']),
+        'errors': errors,
+        'seconds': time.perf_counter() - start,
+    }
+    logging.info(f"Applied change set to {table_name}: {report['added']} added, {report['updated']} updated, "
+                 f"{report['removed']} removed, {len(errors)} rejected in {report['seconds']:.2f}s")
+    return report
+
+
+def write_merged_admin_changes(cursor, operations):
+    decoded_columns = [col for col, _ in table_columns(cursor, 'merged_admin')
+                       if col not in ('VIN-NR', 'Surrogate_Key')]
+
+    removed = [entry for _, entry in operations['remove']]
+    cursor.executemany(ENTRY_STATEMENTS['delete_merged_admin'], [(entry['VIN-NR'],) for entry in removed])
+
+    updated = [entry for _, entry in operations['update']]
+    cursor.executemany(ENTRY_STATEMENTS['update_merged_admin'],
+                       [tuple(entry[col] for col in decoded_columns) + (entry['Surrogate_Key'], entry['VIN-NR'])
+                        for entry in updated])
+
+    added = [entry for _, entry in operations['add']]
+    if added:
+        first_key = reserve_surrogate_keys(cursor, len(added))
+        for offset, entry in enumerate(added):
+            entry['Surrogate_Key'] = first_key + offset
+        cursor.executemany(ENTRY_STATEMENTS['insert_merged_admin'],
+                           [(entry['VIN-NR'],) + tuple(entry[col] for col in decoded_columns) + (entry['Surrogate_Key'],)
+                            for entry in added])
+
+
+def write_unmerged_changes(cursor, operations):
+    value_columns = [col for col, _ in table_columns(cursor, 'unmerged_vins') if col != 'VIN-NR']
+
+    cursor.executemany(ENTRY_STATEMENTS['delete_unmerged_vins'],
+                       [(entry['VIN-NR'],) for _, entry in operations['remove']])
+    cursor.executemany(ENTRY_STATEMENTS['update_unmerged_vins'],
+                       [tuple(entry[col] for col in value_columns) + (entry['VIN-NR'],)
+                        for _, entry in operations['update']])
+
+    added = [entry for _, entry in operations['add']]
+    unkeyed = [entry for entry in added if entry['Surrogate_Key'] is None]
+    if unkeyed:
+        first_key = reserve_surrogate_keys(cursor, len(unkeyed))
+        for offset, entry in enumerate(unkeyed):
+            entry['Surrogate_Key'] = first_key + offset
+    cursor.executemany(ENTRY_STATEMENTS['insert_unmerged_vins'],
+                       [(entry['VIN-NR'],) + tuple(entry[col] for col in value_columns) for entry in added])
+
+
+def write_error_report(errors, path):
+    """Writes a change set's rejected rows to a CSV file."""
+    pd.DataFrame(errors, columns=ERROR_REPORT_COLUMNS).to_csv(path, index=False)
@@ -0,0 +1,248 @@
+import json
+import logging
+import threading
+import time
+
+import numpy as np
+
+from query_builder import quote_identifier
+from schema import MODEL_COLUMNS, source_table
+
+# Tables the column store can hold and the column that identifies their rows
+COLUMN_STORE_TABLES = {'merged_nonadmin': 'Surrogate_Key'}
+
+# Categorical columns held as dictionary codes; group-bys and filters on other columns go to SQLite
+COLUMN_STORE_COLUMNS = ['Vehicle Name', 'Make', 'Model_full', 'Vehicle_Manufacturer', 'Technology', 'Model_Year',
+                        'Vehicle_Category', 'Vehicle_Use_Case', 'Vehicle_Class', 'Zip']
+
+# Rows fetched from SQLite per batch while loading
+COLUMN_STORE_BATCH_ROWS = 100000
+
+# Deleted rows are compacted away once they make up this share of the rows held
+COMPACT_FRACTION = 0.25
+
+
+def code_dtype(distinct_values):
+    """Returns the smallest unsigned integer type that can hold codes for this many values."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if distinct_values <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+def grow(array, capacity):
+    """Returns a copy of array with room for capacity elements."""
+    grown = np.zeros(capacity, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def sql_sort_key(item):
+    """Orders (value, count) pairs the way SQLite's GROUP BY does: NULL, then numbers, then text."""
+    value = item[0]
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    return (2, str(value))
+
+
+class ColumnStore:
+    """In-memory, dictionary-encoded copy of a table's categorical columns for filtered counts.
+
+    Each column is held as an array of integer codes into the column's distinct values, so a
+    filter is a vectorized comparison and a group-by is np.bincount. The copy is loaded on first
+    use and then kept current: rows a VehicleStore write reports are re-read and patched in, and
+    the copy is reloaded after a change set or when SQLite's data_version shows that another
+    connection has written to the database. Use it from one thread, like a connection.
+    """
+
+    def __init__(self, store, table_name='merged_nonadmin', columns=COLUMN_STORE_COLUMNS):
+        if table_name not in COLUMN_STORE_TABLES:
+            raise ValueError(f'No column store for {table_name}')
+        self.store = store
+        self.table_name = table_name
+        self.key_column = COLUMN_STORE_TABLES[table_name]
+        self.columns = list(columns)
+        self.lock = threading.Lock()
+        self.loaded_version = None  # (connection, data_version) the arrays were loaded at
+        self.stale = True
+        self.pending_keys = set()
+        self.size = 0
+        self.deleted = 0
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.live = np.zeros(0, dtype=bool)
+        self.codes = {}
+        store.change_listeners.append(self.changed)
+
+    def changed(self, table_name, keys):
+        """Change listener: notes the keys of rows a write touched, or that the copy must be reloaded."""
+        if table_name not in (self.table_name, source_table(self.table_name)):
+            return
+        with self.lock:
+            try:
+                self.pending_keys.update(int(key) for key in keys if key is not None)
+            except (TypeError, ValueError):
+                self.stale = True  # No keys given, or one that is not a number; reload everything
+
+    def covers(self, group_column, filters=None):
+        """Returns True if the group-by and filter columns are all held and the filters are value matches.
+
+        Range and NULL-check filters ({'min': ..., 'max': ...}, {'null': ...}) are left to SQLite.
+        """
+        return group_column in self.columns and \
+            all(col in self.columns and not isinstance(wanted, dict) for col, wanted in (filters or {}).items())
+
+    def counts(self, group_column, filters=None):
+        """Returns [(value, count)] of group_column over the rows matching the filters, like VehicleStore.counts.
+
+        filters maps columns to a value or a list of values; a row matches when each filtered
+        column holds one of its values, None matching NULL as in query_builder.
+        """
+        filters = filters or {}
+        if not self.covers(group_column, filters):
+            raise ValueError(f'The {self.table_name} column store does not hold {group_column} and {list(filters)}')
+        cursor = self.store.cursor()
+        with self.lock:
+            self.sync(cursor)
+            size = self.size
+            mask = self.live[:size].copy()
+            for col, wanted in filters.items():
+                mask &= np.isin(self.codes[col][:size], self.matching_codes(col, wanted))
+            values = self.values[group_column]
+            totals = np.bincount(self.codes[group_column][:size][mask], minlength=len(values))
+        return sorted(((values[code], int(totals[code])) for code in np.flatnonzero(totals)), key=sql_sort_key)
+
+    def memory_usage(self):
+        """Returns the approximate size of the arrays in bytes."""
+        return self.keys.nbytes + self.live.nbytes + sum(codes.nbytes for codes in self.codes.values())
+
+    def sync(self, cursor):
+        cursor.execute('PRAGMA data_version')
+        version = (cursor.connection, cursor.fetchone()[0])
+        if self.stale or version != self.loaded_version:
+            self.load(cursor)
+            self.loaded_version = version
+        elif self.pending_keys:
+            self.refresh_rows(cursor, sorted(self.pending_keys))
+            self.pending_keys.clear()
+
+    def encode(self, col, value):
+        """Returns the code for a value, adding it to the column's dictionary if it is new."""
+        code = self.codes_by_value[col].get(value)
+        if code is None:
+            code = len(self.values[col])
+            self.codes_by_value[col][value] = code
+            self.values[col].append(value)
+        return code
+
+    def matching_codes(self, col, wanted):
+        """Returns the codes of the values a filter matches.
+
+        Filter values typed into the UI arrive as text; like SQLite comparing them with an
+        integer column, numeric text also matches the number.
+        """
+        codes = []
+        for value in wanted if isinstance(wanted, (list, tuple, set)) else [wanted]:
+            candidates = [value]
+            if isinstance(value, str):
+                for convert in (int, float):
+                    try:
+                        candidates.append(convert(value))
+                    except ValueError:
+                        pass
+            codes.extend(self.codes_by_value[col][candidate] for candidate in candidates
+                         if candidate in self.codes_by_value[col])
+        return np.array(sorted(set(codes)), dtype=np.int64)
+
+    def load(self, cursor):
+        """Loads every row, encoding the vehicle_model columns once per model rather than per VIN."""
+        start = time.perf_counter()
+        self.values = {col: [] for col in self.columns}
+        self.codes_by_value = {col: {} for col in self.columns}
+        self.pending_keys.clear()
+        self.stale = False
+        model_columns = [col for col in self.columns if col in MODEL_COLUMNS]
+        fact_columns = [col for col in self.columns if col not in MODEL_COLUMNS]
+
+        model_list = ', '.join(['model_id'] + [quote_identifier(col) for col in model_columns])
+        cursor.execute(f'SELECT {model_list} FROM vehicle_model ORDER BY model_id')
+        models = list(zip(*cursor.fetchall())) or [()] * (len(model_columns) + 1)
+        model_ids = np.array(models[0], dtype=np.int64)
+        model_codes = {col: np.array([self.encode(col, value) for value in models[position + 1]], dtype=np.int64)
+                       for position, col in enumerate(model_columns)}
+
+        keys, model_positions = [], []
+        fact_codes = {col: [] for col in fact_columns}
+        fact_list = ', '.join([quote_identifier(self.key_column), 'model_id'] +
+                              [quote_identifier(col) for col in fact_columns])
+        cursor.execute(f'SELECT {fact_list} FROM vehicle_fact')
+        while True:
+            batch = cursor.fetchmany(COLUMN_STORE_BATCH_ROWS)
+            if not batch:
+                break
+            batch_columns = list(zip(*batch))
+            keys.append(np.array(batch_columns[0], dtype=np.int64))
+            model_positions.append(np.searchsorted(model_ids, np.array(batch_columns[1], dtype=np.int64)))
+            for position, col in enumerate(fact_columns):
+                fact_codes[col].append(np.array([self.encode(col, value) for value in batch_columns[position + 2]],
+                                                dtype=np.int64))
+
+        positions = np.concatenate(model_positions) if model_positions else np.zeros(0, dtype=np.int64)
+        self.keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64)
+        self.size = len(self.keys)
+        self.live = np.ones(self.size, dtype=bool)
+        self.deleted = 0
+        self.codes = {}
+        for col in self.columns:
+            if col in model_codes:
+                codes = model_codes[col][positions]
+            else:
+                codes = np.concatenate(fact_codes[col]) if fact_codes[col] else np.zeros(0, dtype=np.int64)
+            self.codes[col] = codes.astype(code_dtype(len(self.values[col])))
+        logging.info(f'Loaded the {self.table_name} column store: {self.size} rows, '
+                     f'{self.memory_usage() / 1048576:.1f} MB in {time.perf_counter() - start:.2f}s')
+
+    def refresh_rows(self, cursor, keys):
+        """Replaces the held copies of the rows with these keys by their current contents."""
+        held = np.flatnonzero(np.isin(self.keys[:self.size], keys) & self.live[:self.size])
+        self.live[held] = False
+        self.deleted += len(held)
+
+        select_list = ', '.join(quote_identifier(col) for col in [self.key_column] + self.columns)
+        cursor.execute(f'SELECT {select_list} FROM {self.table_name} '
+                       f'WHERE {quote_identifier(self.key_column)} IN (SELECT value FROM json_each(?))',
+                       (json.dumps(keys),))
+        self.append_rows(cursor.fetchall())
+        if self.deleted > COMPACT_FRACTION * self.size:
+            self.compact()
+
+    def append_rows(self, rows):
+        if not rows:
+            return
+        end = self.size + len(rows)
+        if end > len(self.keys):
+            capacity = max(end, 2 * len(self.keys), 1024)
+            self.keys = grow(self.keys, capacity)
+            self.live = grow(self.live, capacity)
+            self.codes = {col: grow(codes, capacity) for col, codes in self.codes.items()}
+
+        row_columns = list(zip(*rows))
+        self.keys[self.size:end] = row_columns[0]
+        self.live[self.size:end] = True
+        for position, col in enumerate(self.columns):
+            codes = [self.encode(col, value) for value in row_columns[position + 1]]
+            dtype = code_dtype(len(self.values[col]))
+            if np.dtype(dtype).itemsize > self.codes[col].dtype.itemsize:
+                self.codes[col] = self.codes[col].astype(dtype)
+            self.codes[col][self.size:end] = codes
+        self.size = end
+
+    def compact(self):
+        """Drops deleted rows from the arrays."""
+        live = self.live[:self.size]
+        self.keys = self.keys[:self.size][live]
+        self.codes = {col: codes[:self.size][live] for col, codes in self.codes.items()}
+        self.size = len(self.keys)
+        self.live = np.ones(self.size, dtype=bool)
+        self.deleted = 0
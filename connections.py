@@ -0,0 +1,77 @@
+import logging
+import sqlite3
+import threading
+from urllib.parse import quote
+
+# How long a connection waits for another connection's lock before raising "database is locked"
+BUSY_TIMEOUT_MS = 5000
+
+# Prepared statements kept per connection; sqlite3 reuses one whenever the same SQL text runs again
+STATEMENT_CACHE_SIZE = 256
+
+
+class ConnectionManager:
+    """Hands out one SQLite connection per thread for a database.
+
+    Writable connections switch the database to WAL, so readers never wait behind the writer.
+    Read-only managers (guest sessions) open the file with mode=ro, so they cannot modify it.
+    Every connection has a busy timeout and a prepared-statement cache sized for the
+    application's fixed statements. hidden_columns ({table: [columns]}) installs an authorizer
+    that refuses any statement reading those columns, directly or through a view. factory is the
+    sqlite3.Connection subclass to open, e.g. instrumentation.TimedConnection to time statements.
+    """
+
+    def __init__(self, database_path, read_only=False, busy_timeout_ms=BUSY_TIMEOUT_MS,
+                 statement_cache_size=STATEMENT_CACHE_SIZE, hidden_columns=None, factory=sqlite3.Connection):
+        self.database_path = database_path
+        self.read_only = read_only
+        self.hidden_columns = {(table, col) for table, cols in (hidden_columns or {}).items() for col in cols}
+        self.busy_timeout_ms = busy_timeout_ms
+        self.statement_cache_size = statement_cache_size
+        self.factory = factory
+        self.local = threading.local()
+
+    def open(self):
+        """Opens a new connection with the manager's settings."""
+        if self.read_only:
+            conn = sqlite3.connect(f'file:{quote(self.database_path)}?mode=ro', uri=True,
+                                   timeout=self.busy_timeout_ms / 1000, cached_statements=self.statement_cache_size,
+                                   factory=self.factory)
+        else:
+            conn = sqlite3.connect(self.database_path, timeout=self.busy_timeout_ms / 1000,
+                                   cached_statements=self.statement_cache_size, factory=self.factory)
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout_ms)}')
+        if self.hidden_columns:
+            conn.set_authorizer(self.authorize)
+
+        if not self.read_only:
+            try:
+                journal_mode = conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+            except sqlite3.OperationalError as e:
+                journal_mode = str(e)  # Another connection holds a lock; stay in the current mode
+            if journal_mode != 'wal':
+                logging.warning(f'Could not switch {self.database_path} to WAL: {journal_mode}')
+            else:
+                conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def authorize(self, action, arg1, arg2, database, source):
+        """Denies reads of hidden columns; every other action is allowed."""
+        if action == sqlite3.SQLITE_READ and (arg1, arg2) in self.hidden_columns:
+            return sqlite3.SQLITE_DENY
+        return sqlite3.SQLITE_OK
+
+    def connect(self):
+        """Returns the calling thread's connection, opening it on first use."""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.open()
+            self.local.conn = conn
+        return conn
+
+    def release(self):
+        """Closes the calling thread's connection."""
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            self.local.conn = None
+            conn.close()
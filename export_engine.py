@@ -0,0 +1,138 @@
+import csv
+import gzip
+import io
+import logging
+import time
+
+from query_builder import count_query, select_query, table_columns
+
+# Rows fetched from SQLite and written per batch; bounds the export's memory use
+EXPORT_BATCH_ROWS = 10000
+
+# Output formats by file suffix
+EXPORT_FORMATS = {
+    '.csv': 'csv',
+    '.csv.gz': 'csv.gz',
+    '.csv.zst': 'csv.zst',
+    '.parquet': 'parquet',
+}
+
+
+def export_format(path):
+    """Returns the export format implied by the file name."""
+    for suffix in sorted(EXPORT_FORMATS, key=len, reverse=True):
+        if path.lower().endswith(suffix):
+            return EXPORT_FORMATS[suffix]
+    raise ValueError(f'Unsupported export file type: {path} (use {", ".join(EXPORT_FORMATS)})')
+
+
+def open_csv_output(path, fmt):
+    """Opens a text stream for CSV output, compressing it if the format asks for it."""
+    if fmt == 'csv.gz':
+        return gzip.open(path, 'wt', newline='', encoding='utf-8')
+    if fmt == 'csv.zst':
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError('zstd export needs the zstandard package (pip install zstandard)')
+        raw = open(path, 'wb')
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(raw, closefd=True), newline='',
+                                encoding='utf-8')
+    return open(path, 'w', newline='', encoding='utf-8')
+
+
+class CsvBatchWriter:
+    """Writes batches of rows to a (possibly compressed) CSV file with a header row."""
+
+    def __init__(self, path, fmt, columns):
+        self.output = open_csv_output(path, fmt)
+        self.writer = csv.writer(self.output)
+        self.writer.writerow([col for col, _ in columns])
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.output.close()
+
+
+class ParquetBatchWriter:
+    """Writes batches of rows to a Parquet file, one row group per batch."""
+
+    def __init__(self, path, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError('Parquet export needs the pyarrow package (pip install pyarrow)')
+        self.pyarrow = pyarrow
+        self.columns = columns
+        self.schema = pyarrow.schema([(col, pyarrow.int64() if 'INT' in col_type else pyarrow.string())
+                                      for col, col_type in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        self.coerced_values = 0
+
+    def column_values(self, rows, position, is_integer):
+        values = [row[position] for row in rows]
+        if is_integer:
+            # SQLite lets any value into an INT column; keep what parses as an integer
+            converted = []
+            for value in values:
+                try:
+                    converted.append(None if value is None else int(value))
+                except (TypeError, ValueError):
+                    converted.append(None)
+                    self.coerced_values += 1
+            return converted
+        return [None if value is None else str(value) for value in values]
+
+    def write(self, rows):
+        arrays = [self.pyarrow.array(self.column_values(rows, i, field.type == self.pyarrow.int64()), field.type)
+                  for i, field in enumerate(self.schema)]
+        self.writer.write_table(self.pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+        if self.coerced_values:
+            logging.warning(f'{self.coerced_values} non-integer values in integer columns were exported as null')
+
+
+def export_query(cursor, table_name, filters, path, batch_size=EXPORT_BATCH_ROWS, progress=None,
+                 count_total=False):
+    """Streams the rows of a table matching the filters to a CSV, compressed CSV or Parquet file.
+
+    Rows are fetched with fetchmany, so memory use does not grow with the result size.
+    progress, if given, is called as progress(rows_written, total_rows) after every batch;
+    total_rows is None unless count_total is set.
+    Returns a dict with the row count, elapsed seconds and rows per second.
+    """
+    fmt = export_format(path)
+    columns = table_columns(cursor, table_name)
+    select_sql, params = select_query(cursor, table_name, filters, [col for col, _ in columns])
+    start = time.perf_counter()
+
+    total_rows = None
+    if count_total:
+        cursor.execute(*count_query(cursor, table_name, filters))
+        total_rows = cursor.fetchone()[0]
+
+    writer = ParquetBatchWriter(path, columns) if fmt == 'parquet' else CsvBatchWriter(path, fmt, columns)
+    rows_written = 0
+    try:
+        cursor.execute(select_sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            writer.write(rows)
+            rows_written += len(rows)
+            if progress:
+                progress(rows_written, total_rows)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    rows_per_second = rows_written / elapsed if elapsed > 0 else 0.0
+    logging.info(f'Exported {rows_written} rows from {table_name} to {path} in {elapsed:.2f}s '
+                 f'({rows_per_second:,.0f} rows/sec)')
+    return {'rows': rows_written, 'seconds': elapsed, 'rows_per_second': rows_per_second, 'path': path}
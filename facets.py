@@ -0,0 +1,280 @@
+import logging
+
+from schema import source_table, stored_tables, trigger_timing
+
+# Tables whose column values the export and graph dialogs offer as choices
+FACET_TABLES = ['merged_nonadmin', 'unmerged_vins']
+
+# Columns with more distinct values than this are catalogued without their value list
+FACET_VALUE_LIMIT = 1000
+
+
+def create_facet_tables(cursor):
+    """Creates the facet catalogue: per-column value counts and per-column metadata."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS facet_columns (
+            table_name TEXT NOT NULL,
+            column_name TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            distinct_count INTEGER NOT NULL,
+            complete INTEGER NOT NULL,
+            PRIMARY KEY (table_name, column_name)
+        )
+    ''')
+    # value is declared without a type so each value keeps the type it has in the source table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS column_facets (
+            table_name TEXT NOT NULL,
+            column_name TEXT NOT NULL,
+            value NOT NULL,
+            row_count INTEGER NOT NULL,
+            PRIMARY KEY (table_name, column_name, value)
+        )
+    ''')
+
+
+def facets_available(cursor, table_name):
+    """Returns True if the facet catalogue has been built for the table."""
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='facet_columns'")
+    if cursor.fetchone()[0] == 0:
+        return False
+    cursor.execute('SELECT COUNT(*) FROM facet_columns WHERE table_name = ?', (table_name,))
+    return cursor.fetchone()[0] > 0
+
+
+def facet_trigger_statements(table_name, column, row_alias, delta, value_limit=FACET_VALUE_LIMIT):
+    """Returns the statements that add delta to the count of one column value.
+
+    distinct_count follows the values added and removed while the column is listed. Once it
+    passes value_limit the column is marked incomplete and its value list dropped, as
+    rebuild_facets would; the statements then leave the column alone until the next rebuild.
+    """
+    catalogued = f"table_name = '{table_name}' AND column_name = '{column}'"
+    listed = f'EXISTS (SELECT 1 FROM facet_columns WHERE {catalogued} AND complete)'
+    match = f"{catalogued} AND value = {row_alias}.\"{column}\""
+    statements = []
+    if delta > 0:
+        statements.append(f'''
+            UPDATE facet_columns SET distinct_count = distinct_count + 1
+            WHERE {catalogued} AND complete AND {row_alias}."{column}" IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM column_facets WHERE {match});''')
+        statements.append(f'''
+            INSERT INTO column_facets (table_name, column_name, value, row_count)
+            SELECT '{table_name}', '{column}', {row_alias}."{column}", 0
+            WHERE {row_alias}."{column}" IS NOT NULL AND {listed}
+              AND NOT EXISTS (SELECT 1 FROM column_facets WHERE {match});''')
+    statements.append(f'UPDATE column_facets SET row_count = row_count + ({delta}) WHERE {match};')
+    if delta > 0:
+        statements.append(f'''
+            DELETE FROM column_facets WHERE {catalogued}
+              AND EXISTS (SELECT 1 FROM facet_columns WHERE {catalogued} AND complete AND distinct_count > {value_limit});''')
+        statements.append(f'UPDATE facet_columns SET complete = 0 WHERE {catalogued} AND complete AND distinct_count > {value_limit};')
+    if delta < 0:
+        statements.append(f'''
+            UPDATE facet_columns SET distinct_count = distinct_count - 1
+            WHERE {catalogued} AND EXISTS (SELECT 1 FROM column_facets WHERE {match} AND row_count <= 0);''')
+        statements.append(f'DELETE FROM column_facets WHERE {match} AND row_count <= 0;')
+    return statements
+
+
+def create_facet_triggers(cursor, table_name, columns, value_limit=FACET_VALUE_LIMIT):
+    """Creates the triggers that keep the value counts of the listed columns current on every write.
+
+    A view's counts are kept by triggers on the table or view it is written through; on a view
+    they are INSTEAD OF triggers that run alongside the view's own write triggers.
+    """
+    drop_facet_triggers(cursor, table_name)
+    if not columns:
+        return
+    base_table = source_table(table_name)
+    timing = trigger_timing(base_table)
+
+    insert_body = [s for col in columns for s in facet_trigger_statements(table_name, col, 'NEW', 1, value_limit)]
+    cursor.execute(f'''
+        CREATE TRIGGER facets_{table_name}_insert {timing} INSERT ON {base_table}
+        BEGIN {' '.join(insert_body)} END
+    ''')
+
+    delete_body = [s for col in columns for s in facet_trigger_statements(table_name, col, 'OLD', -1, value_limit)]
+    cursor.execute(f'''
+        CREATE TRIGGER facets_{table_name}_delete {timing} DELETE ON {base_table}
+        BEGIN {' '.join(delete_body)} END
+    ''')
+
+    # Updates only touch the counts of columns whose value actually changed
+    for position, col in enumerate(columns):
+        update_body = facet_trigger_statements(table_name, col, 'OLD', -1, value_limit) + \
+            facet_trigger_statements(table_name, col, 'NEW', 1, value_limit)
+        cursor.execute(f'''
+            CREATE TRIGGER facets_{table_name}_update_{position} {timing} UPDATE OF "{col}" ON {base_table}
+            WHEN OLD."{col}" IS NOT NEW."{col}"
+            BEGIN {' '.join(update_body)} END
+        ''')
+
+
+def drop_facet_triggers(cursor, table_name):
+    """Drops every facet trigger defined on the table."""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE ?", (f'facets_{table_name}_%',))
+    for (trigger_name,) in cursor.fetchall():
+        cursor.execute(f'DROP TRIGGER IF EXISTS "{trigger_name}"')
+
+
+def rebuild_facets(conn, tables=FACET_TABLES, value_limit=FACET_VALUE_LIMIT):
+    """Recomputes the facet catalogue from scratch and reinstalls its triggers; run after ingest."""
+    cursor = conn.cursor()
+    create_facet_tables(cursor)
+
+    for table_name in tables:
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type IN ('table', 'view') AND name=?", (table_name,))
+        if cursor.fetchone()[0] == 0:
+            continue
+
+        drop_facet_triggers(cursor, table_name)
+        cursor.execute('DELETE FROM column_facets WHERE table_name = ?', (table_name,))
+        cursor.execute('DELETE FROM facet_columns WHERE table_name = ?', (table_name,))
+
+        cursor.execute(f'PRAGMA table_info({table_name})')
+        columns = [row[1] for row in cursor.fetchall()]
+        listed_columns = []
+
+        for position, col in enumerate(columns):
+            cursor.execute(f'SELECT COUNT(DISTINCT "{col}") FROM {table_name}')
+            distinct_count = cursor.fetchone()[0]
+            complete = distinct_count <= value_limit
+            cursor.execute('INSERT INTO facet_columns VALUES (?, ?, ?, ?, ?)',
+                           (table_name, col, position, distinct_count, int(complete)))
+
+            # High-cardinality columns (VIN-NR, Surrogate_Key, ...) are not listed value by value
+            if complete:
+                cursor.execute(f'''
+                    INSERT INTO column_facets (table_name, column_name, value, row_count)
+                    SELECT ?, ?, "{col}", COUNT(*) FROM {table_name}
+                    WHERE "{col}" IS NOT NULL GROUP BY "{col}"
+                ''', (table_name, col))
+                listed_columns.append(col)
+
+        create_facet_triggers(cursor, table_name, listed_columns, value_limit)
+        logging.info(f'Rebuilt facets for {table_name}: {len(listed_columns)} of {len(columns)} columns listed')
+
+    conn.commit()
+
+
+def refresh_unlisted_facets(conn, tables=FACET_TABLES, value_limit=FACET_VALUE_LIMIT):
+    """Lists again the columns that are back within value_limit since they were unlisted; run after deletes.
+
+    The triggers stop counting a column once it is unlisted, so they cannot tell when deletes
+    bring it back under the limit. Each unlisted column is recounted, stopping at value_limit + 1
+    values, and any that qualify again are listed and get their triggers back, as rebuild_facets
+    would list them. Returns [(table, column)] of the columns listed again.
+    """
+    cursor = conn.cursor()
+    relisted = []
+    for table_name in tables:
+        if not facets_available(cursor, table_name):
+            continue
+        cursor.execute('SELECT column_name FROM facet_columns WHERE table_name = ? AND NOT complete ORDER BY position',
+                       (table_name,))
+        unlisted_columns = [row[0] for row in cursor.fetchall()]
+        listed_again = []
+
+        for col in unlisted_columns:
+            cursor.execute(f'''
+                SELECT COUNT(*) FROM (SELECT DISTINCT "{col}" FROM {table_name} WHERE "{col}" IS NOT NULL LIMIT ?)
+            ''', (value_limit + 1,))
+            distinct_count = cursor.fetchone()[0]
+            if distinct_count > value_limit:
+                continue
+            cursor.execute('UPDATE facet_columns SET distinct_count = ?, complete = 1 WHERE table_name = ? AND column_name = ?',
+                           (distinct_count, table_name, col))
+            cursor.execute(f'''
+                INSERT INTO column_facets (table_name, column_name, value, row_count)
+                SELECT ?, ?, "{col}", COUNT(*) FROM {table_name}
+                WHERE "{col}" IS NOT NULL GROUP BY "{col}"
+            ''', (table_name, col))
+            listed_again.append(col)
+
+        if listed_again:
+            cursor.execute('SELECT column_name FROM facet_columns WHERE table_name = ? AND complete ORDER BY position',
+                           (table_name,))
+            create_facet_triggers(cursor, table_name, [row[0] for row in cursor.fetchall()], value_limit)
+            logging.info(f'Listed facets of {table_name} again: {listed_again}')
+            relisted.extend((table_name, col) for col in listed_again)
+
+    conn.commit()
+    return relisted
+
+
+def load_facets(cursor, table_name):
+    """Returns {column: [values]} from the catalogue; high-cardinality columns map to None."""
+    cursor.execute('SELECT column_name, complete FROM facet_columns WHERE table_name = ? ORDER BY position',
+                   (table_name,))
+    facets = {col: [] if complete else None for col, complete in cursor.fetchall()}
+
+    cursor.execute('SELECT column_name, value FROM column_facets WHERE table_name = ? ORDER BY column_name, value',
+                   (table_name,))
+    for col, value in cursor.fetchall():
+        if facets.get(col) is not None:
+            facets[col].append(value)
+    return facets
+
+
+def indexed_columns(cursor, table_name):
+    """Returns the columns that lead an index on the table, so a prefix search can seek on them.
+
+    A view is searched through the indexes of the tables it reads from.
+    """
+    leading = set()
+    for stored_table in stored_tables(table_name):
+        cursor.execute(f'PRAGMA index_list({stored_table})')
+        for index in cursor.fetchall():
+            cursor.execute(f'PRAGMA index_info("{index[1]}")')
+            info = cursor.fetchall()
+            if info:
+                leading.add(min(info)[2])
+        # INTEGER PRIMARY KEY columns are the rowid and have no index of their own
+        cursor.execute(f'PRAGMA table_info({stored_table})')
+        leading.update(row[1] for row in cursor.fetchall() if row[5] and row[2].upper() == 'INTEGER')
+    return leading
+
+
+def numeric_prefix_ranges(prefix, max_digits=12):
+    """Yields [low, high) ranges covering every non-negative integer whose digits start with prefix."""
+    if len(prefix) > 1 and prefix.startswith('0'):
+        return  # Stored integers have no leading zeros
+    base = int(prefix)
+    if base == 0:
+        yield 0, 1
+        return
+    for extra_digits in range(max_digits - len(prefix) + 1):
+        scale = 10 ** extra_digits
+        yield base * scale, (base + 1) * scale
+
+
+def search_column_values(cursor, table_name, column, prefix='', limit=50):
+    """Returns up to limit distinct values of a column that start with prefix, in index order."""
+    cursor.execute(f'PRAGMA table_info({table_name})')
+    column_types = {row[1]: row[2].upper() for row in cursor.fetchall()}
+    if column not in column_types:
+        raise ValueError(f'Unknown column {column} in {table_name}')
+
+    # Without an index, skip ORDER BY so SQLite can stop scanning once it has enough values
+    order_by = f'ORDER BY "{column}"' if column in indexed_columns(cursor, table_name) else ''
+    query = f'SELECT DISTINCT "{column}" FROM {table_name} WHERE "{column}" >= ? AND "{column}" < ? {order_by} LIMIT ?'
+
+    if 'INT' in column_types[column] and prefix.isdigit():
+        # Integer columns compare numerically, so the prefix becomes one range per extra digit
+        values = []
+        for low, high in numeric_prefix_ranges(prefix):
+            cursor.execute(query, (low, high, limit - len(values)))
+            values.extend(row[0] for row in cursor.fetchall() if row[0] not in values)
+            if len(values) >= limit:
+                break
+        return sorted(values)
+
+    if prefix:
+        # Every string starting with prefix sorts before prefix with its last character incremented
+        cursor.execute(query, (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1), limit))
+    else:
+        cursor.execute(f'SELECT DISTINCT "{column}" FROM {table_name} WHERE "{column}" IS NOT NULL {order_by} LIMIT ?',
+                       (limit,))
+    return sorted((row[0] for row in cursor.fetchall()), key=str)
@@ -0,0 +1,224 @@
+import contextlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows; stages then report traced memory only
+
+# JSON-lines file stage and query metrics are appended to
+METRICS_PATH = os.environ.get('VEHICLE_METRICS_PATH', 'metrics.jsonl')
+
+# Statements slower than this are logged with their query plan; includes fetching their rows
+SLOW_QUERY_MS = float(os.environ.get('VEHICLE_SLOW_QUERY_MS', 250))
+
+# Longest statement text kept in a metrics record
+SQL_TEXT_LIMIT = 500
+
+settings = {
+    'metrics_path': METRICS_PATH,
+    'slow_query_ms': SLOW_QUERY_MS,
+    'trace_memory': False,
+}
+write_lock = threading.Lock()
+stats_lock = threading.Lock()
+query_stats = {}  # Normalized SQL -> {'count', 'seconds', 'max_seconds', 'slow'}
+
+
+def configure(metrics_path=None, slow_query_ms=None, trace_memory=None):
+    """Changes where metrics are written, the slow-query threshold and whether memory is traced.
+
+    With trace_memory set, stages also report the peak of Python and NumPy allocations measured
+    by tracemalloc, which slows allocation-heavy code down noticeably.
+    """
+    if metrics_path is not None:
+        settings['metrics_path'] = metrics_path
+    if slow_query_ms is not None:
+        settings['slow_query_ms'] = float(slow_query_ms)
+    if trace_memory is not None:
+        settings['trace_memory'] = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def record_metric(record):
+    """Appends one metrics record, stamped with the time and process, to the metrics file."""
+    record = dict(record, time=datetime.now(timezone.utc).isoformat(timespec='milliseconds'), pid=os.getpid())
+    line = json.dumps(record, default=str)
+    with write_lock:
+        try:
+            with open(settings['metrics_path'], 'a') as f:
+                f.write(line + '\n')
+        except OSError as e:
+            logging.warning(f"Could not write metrics to {settings['metrics_path']}: {e}")
+
+
+def max_rss_mb():
+    """Returns the process's peak resident memory so far in MB, or None where it is unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024, 1)  # ru_maxrss is in KB on Linux
+
+
+@contextlib.contextmanager
+def stage(name, **fields):
+    """Times a pipeline stage and records its wall time, rows processed and peak memory.
+
+    Yields the stage's record; the stage adds to record['rows'] as it processes rows. Extra
+    keyword arguments are stored with the record.
+    """
+    record = {'type': 'stage', 'stage': name, 'rows': 0, **fields}
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield record
+        record['status'] = 'ok'
+    except BaseException as e:
+        record['status'] = 'error'
+        record['error'] = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 6)
+        record['max_rss_mb'] = max_rss_mb()
+        if tracing:
+            record['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1048576, 1)
+        logging.info(f"Stage {name} took {record['seconds']:.2f}s for {record['rows']} rows "
+                     f"(peak RSS {record['max_rss_mb']} MB)")
+        record_metric(record)
+
+
+def normalize_sql(sql):
+    """Collapses a statement's whitespace so the same statement always has the same text."""
+    return re.sub(r'\s+', ' ', sql).strip()[:SQL_TEXT_LIMIT]
+
+
+def query_plan(conn, sql, parameters):
+    """Returns the EXPLAIN QUERY PLAN lines for a statement, or the error explaining it raised."""
+    try:
+        cursor = sqlite3.Cursor(conn)
+        try:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parameters)
+            return [row[3] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+    except (sqlite3.Error, ValueError) as e:
+        return [f'(no plan: {e})']
+
+
+def record_query(conn, sql, parameters, seconds, rows):
+    """Adds a finished statement to the per-statement totals; slow ones are logged with their plan."""
+    text = normalize_sql(sql)
+    slow = seconds * 1000 >= settings['slow_query_ms']
+    with stats_lock:
+        totals = query_stats.setdefault(text, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'slow': 0})
+        totals['count'] += 1
+        totals['seconds'] += seconds
+        totals['max_seconds'] = max(totals['max_seconds'], seconds)
+        totals['slow'] += slow
+    if slow:
+        plan = query_plan(conn, sql, parameters)
+        logging.warning(f'Slow query ({seconds * 1000:.0f} ms, {rows} rows): {text} | plan: {"; ".join(plan)}')
+        record_metric({'type': 'slow_query', 'sql': text, 'seconds': round(seconds, 6), 'rows': rows, 'plan': plan})
+
+
+def write_query_summary():
+    """Records the per-statement totals gathered so far and clears them."""
+    with stats_lock:
+        summary = dict(query_stats)
+        query_stats.clear()
+    for text, totals in sorted(summary.items(), key=lambda item: -item[1]['seconds']):
+        record_metric({'type': 'query_summary', 'sql': text, 'count': totals['count'],
+                       'seconds': round(totals['seconds'], 6), 'max_seconds': round(totals['max_seconds'], 6),
+                       'slow': totals['slow']})
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that times each statement from execute until its last row is fetched or the cursor is dropped."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.statement = None
+
+    def begin(self, sql, parameters):
+        self.finish()
+        self.statement = {'sql': sql, 'parameters': parameters, 'seconds': 0.0, 'rows': 0}
+
+    def finish(self):
+        statement, self.statement = self.statement, None
+        if statement is not None:
+            rows = statement['rows'] or max(self.rowcount, 0)
+            record_query(self.connection, statement['sql'], statement['parameters'], statement['seconds'], rows)
+
+    def timed(self, call, *args):
+        start = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            if self.statement is not None:
+                self.statement['seconds'] += time.perf_counter() - start
+
+    def execute(self, sql, parameters=()):
+        self.begin(sql, parameters)
+        return self.timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self.begin(sql, ())  # Unbound parameters are NULL in the plan, which is the same for every row
+        return self.timed(super().executemany, sql, seq_of_parameters)
+
+    def fetchone(self):
+        row = self.timed(super().fetchone)
+        if row is None:
+            self.finish()
+        elif self.statement is not None:
+            self.statement['rows'] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self.timed(super().fetchmany, self.arraysize if size is None else size)
+        if not rows:
+            self.finish()
+        elif self.statement is not None:
+            self.statement['rows'] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.timed(super().fetchall)
+        if self.statement is not None:
+            self.statement['rows'] += len(rows)
+        self.finish()
+        return rows
+
+    def close(self):
+        self.finish()
+        super().close()
+
+    def __del__(self):
+        # A single-row read never fetches past its row, so the statement is recorded when the cursor goes
+        if getattr(self, 'statement', None) is not None:
+            self.finish()
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors, including the ones execute() creates, are TimedCursors."""
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or TimedCursor)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,52 @@
+import sqlite3
+
+SURROGATE_KEY_SEQUENCE = 'Surrogate_Key'
+
+# Tables whose Surrogate_Key values are drawn from the shared sequence. merged_admin is a view
+# of vehicle_fact, and is only listed for databases whose merged_admin is still a table.
+KEYED_TABLES = ['vehicle_fact', 'merged_admin', 'unmerged_vins']
+
+
+def create_sequence_table(cursor):
+    """Creates the table that holds the next free value of each key sequence."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS key_sequence (
+            name TEXT PRIMARY KEY,
+            next_value INTEGER NOT NULL
+        )
+    ''')
+
+
+def sync_sequence(cursor, name=SURROGATE_KEY_SEQUENCE):
+    """Moves the sequence past every key already stored in the keyed tables."""
+    create_sequence_table(cursor)
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name IN (%s)"
+                   % ', '.join('?' * len(KEYED_TABLES)), KEYED_TABLES)
+    existing_tables = [row[0] for row in cursor.fetchall()]
+
+    highest_key = 0
+    for table_name in existing_tables:
+        cursor.execute(f'SELECT MAX(Surrogate_Key) FROM {table_name}')
+        highest_key = max(highest_key, cursor.fetchone()[0] or 0)
+
+    cursor.execute('INSERT OR IGNORE INTO key_sequence (name, next_value) VALUES (?, ?)', (name, highest_key + 1))
+    cursor.execute('UPDATE key_sequence SET next_value = MAX(next_value, ?) WHERE name = ?', (highest_key + 1, name))
+
+
+def reserve_surrogate_keys(cursor, count=1, name=SURROGATE_KEY_SEQUENCE):
+    """Reserves a block of count consecutive keys and returns the first one.
+
+    The reservation is part of the caller's transaction, so it is released again
+    if the caller rolls back instead of committing.
+    """
+    try:
+        cursor.execute('UPDATE key_sequence SET next_value = next_value + ? WHERE name = ?', (count, name))
+        reserved = cursor.rowcount == 1
+    except sqlite3.OperationalError:
+        reserved = False  # key_sequence has not been created in this database yet
+
+    if not reserved:
+        sync_sequence(cursor, name)
+        cursor.execute('UPDATE key_sequence SET next_value = next_value + ? WHERE name = ?', (count, name))
+    cursor.execute('SELECT next_value FROM key_sequence WHERE name = ?', (name,))
+    return cursor.fetchone()[0] - count
@@ -1,30 +1,94 @@
 import tkinter as tk
-from tkinter import messagebox, ttk
-import sqlite3
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
+from tkinter import filedialog, messagebox, ttk
 import logging
+from query_executor import QueryExecutor
+from vehicle_store import GUEST_HIDDEN_COLUMNS, VehicleStore
+from connections import ConnectionManager
+from instrumentation import TimedConnection, write_query_summary
+from query_builder import RANGE_COLUMNS
+from search import NAME_SEARCH_TABLES, SEARCH_PAGE_ROWS, VIN_SEARCH_TABLES
 
 # Logging Configuration
 logging.basicConfig(filename='app.log', level=logging.INFO, format='%(asctime)s [%(levelname)s] - %(message)s')
 
-# Database Connection
+# Database Connection: the window is a client of the vehicle store, created at login with a
+# read-only connection for guests, and calls it from the executor's worker thread
 DATABASE_PATH = '/mnt/c/Users/duck2/Desktop/School/Fall2023/4402/data.db'
-conn = sqlite3.connect(DATABASE_PATH)
-cursor = conn.cursor()
+store = None
+executor = None
+
+# Type-ahead dropdowns show this many matches and wait this long after a keystroke before querying
+TYPEAHEAD_LIMIT = 50
+TYPEAHEAD_DELAY_MS = 250
+
+# Dialogs refresh the elapsed time of a running query this often
+QUERY_STATUS_INTERVAL_MS = 200
+
+# The table browser fetches this many rows per page and holds at most this many pages; it asks
+# for the next page once the view is within the margin (a fraction of the rows held) of either end
+BROWSER_PAGE_ROWS = 200
+BROWSER_WINDOW_PAGES = 3
+BROWSER_FETCH_MARGIN = 0.2
+BROWSER_VISIBLE_ROWS = 20
+
+# Graphs of these tables are counted from an in-memory column store instead of SQLite when it
+# holds the columns; set to False to always count in SQLite
+ANALYTICS_ENABLED = True
+ANALYTICS_TABLES = ['merged_nonadmin']
+
+# Export file types offered by the export dialog and the suffix each one writes
+EXPORT_FILE_TYPES = {'CSV': '.csv', 'CSV (gzip)': '.csv.gz', 'CSV (zstd)': '.csv.zst', 'Parquet': '.parquet'}
+
+# In the export and graph dialogs, this value matches empty (NULL) cells, and values separated
+# by LIST_SEPARATOR match any of them; range columns are filtered with From/To fields instead
+BLANK_VALUE = '(blank)'
+LIST_SEPARATOR = '|'
 
 # Global Variables
-surrogate_key = 0
 main_window_opened = False
+# pandas, the VIN decoder and matplotlib take seconds to import, so they are loaded on first
+# use rather than before the login window can be drawn
+vin_decoder = None  # Compiled VIN decoder, loaded on first use by the add dialog
+plt = None  # matplotlib.pyplot, loaded when the first graph is drawn
+column_stores = {}  # Column stores by table, loaded by the first graph of the table
 # Utility Functions
 
-def generate_unique_surrogate_key():
-    """Generates a unique surrogate key for the merged_nonadmin table."""
-    global surrogate_key
-    cursor.execute("SELECT MAX(Surrogate_Key) FROM merged_nonadmin")
-    result = cursor.fetchone()
-    surrogate_key = (result[0] if result[0] is not None else 0) + 1
+def create_status_bar(parent):
+    """Creates the progress bar and status label a dialog uses to show its running query."""
+    progress_bar = ttk.Progressbar(parent, length=200, maximum=100)
+    progress_bar.pack()
+    status_label = tk.Label(parent, text="")
+    status_label.pack()
+    return progress_bar, status_label
+
+def track_query(ticket, progress_bar, status_label, message):
+    """Shows a query's elapsed time until it finishes; message may be a function returning the text."""
+    progress_bar.configure(mode='indeterminate', value=0)
+    progress_bar.start()
+
+    def refresh():
+        if not status_label.winfo_exists():
+            return
+        if ticket.cancelled:
+            progress_bar.stop()
+            return
+        if ticket.finished:
+            progress_bar.stop()
+            outcome = "Failed after" if ticket.error is not None else "Finished in"
+            status_label.config(text=f"{outcome} {ticket.elapsed():.1f}s")
+            return
+        text = message() if callable(message) else message
+        status_label.config(text=f"{text} {ticket.elapsed():.1f}s")
+        status_label.after(QUERY_STATUS_INTERVAL_MS, refresh)
+
+    refresh()
+
+def report_query_error(action, title="Error"):
+    """Returns an on_error callback that shows and logs a failed query."""
+    def show_error(e):
+        messagebox.showerror(title, f"Error {action}: {str(e)}")
+        logging.error(f"Error {action}: {str(e)}")
+    return show_error
 
 def validate_login(username, password):
     """Validates the login credentials."""
@@ -69,8 +133,17 @@ def create_login_window():
     return login_root
 def access_tables(user_role):
     """Grants access to tables based on user role."""
-    global main_window_opened
+    global main_window_opened, store, executor
     main_window_opened = True
+    # Every statement the UI runs is timed; slow ones are logged with their query plan
+    if user_role == 'admin':
+        connections = ConnectionManager(DATABASE_PATH, factory=TimedConnection)
+    else:
+        # Guests get a read-only connection that cannot read VIN-NR from any table
+        connections = ConnectionManager(DATABASE_PATH, read_only=True, hidden_columns=GUEST_HIDDEN_COLUMNS,
+                                        factory=TimedConnection)
+    store = VehicleStore(DATABASE_PATH, connections=connections)
+    executor = QueryExecutor(store.connections)
     tables = ['merged_admin', 'merged_nonadmin', 'unmerged_vins'] if user_role == 'admin' else ['merged_nonadmin']
     open_main_window(user_role, tables)
 
@@ -83,19 +156,27 @@ def open_main_window(user_role, tables):
     for table_name in tables:
         create_table_tab(notebook, table_name, user_role)
 
-    notebook.pack()
+    notebook.pack(fill='both', expand=True)
+    executor.start(main_window)
+
+    # Open the connection and read the schema on the worker thread while the window is drawn
+    executor.submit(lambda cursor, report: [store.columns(table_name) for table_name in tables],
+                    on_error=report_query_error("opening the database"))
     main_window.mainloop()
 
 def create_table_tab(notebook, table_name, user_role):
     """Creates a tab for each table with appropriate buttons and functionalities."""
     tab = ttk.Frame(notebook)
     notebook.add(tab, text=table_name)
+    create_table_browser(tab, table_name)
+    tk.Button(tab, text="Search", command=lambda: open_search_dialog(table_name)).pack()
 
     # Add buttons for admin, but exclude them for merged_nonadmin table
     if user_role == 'admin' and table_name != 'merged_nonadmin':
         tk.Button(tab, text="Add", command=lambda: open_add_dialog(table_name)).pack()
         tk.Button(tab, text="Remove", command=lambda: open_remove_dialog(table_name)).pack()
         tk.Button(tab, text="Update", command=lambda: open_update_dialog(table_name)).pack()
+        tk.Button(tab, text="Bulk Edit", command=lambda: open_bulk_edit_dialog(table_name)).pack()
 
     # Special handling for 'unmerged_vins' table
     if table_name == 'unmerged_vins' and user_role == 'admin':
@@ -109,6 +190,242 @@ def create_table_tab(notebook, table_name, user_role):
         tk.Button(tab, text="Export", command=lambda: create_export_dialog(table_name)).pack()
         tk.Button(tab, text="Graph", command=lambda: create_graph_dialog(table_name)).pack()
 
+def create_table_browser(parent, table_name):
+    """Adds a grid showing the table's rows that holds only a few pages of them at a time.
+
+    Pages are fetched by key as the view nears either end of the rows held, and the page at the
+    far end is dropped, so memory stays the same however large the table is. Clicking a heading
+    sorts on that column (clicking again reverses it); sorting and the filter bar's
+    filters are both done by the query.
+    """
+    view = {'order_by': None, 'descending': False, 'filters': {}, 'pages': [], 'loading': False, 'generation': 0}
+
+    frame = tk.Frame(parent)
+    frame.pack(fill='both', expand=True)
+
+    # Filter bar: one filter per column, combined with AND; (blank) and | lists work as in the dialogs
+    filter_bar = tk.Frame(frame)
+    filter_bar.pack(fill='x')
+    filter_column_var = tk.StringVar()
+    filter_value_var = tk.StringVar()
+    tk.Label(filter_bar, text="Filter:").pack(side='left')
+    filter_column_dropdown = ttk.Combobox(filter_bar, textvariable=filter_column_var, state='readonly', width=20)
+    filter_column_dropdown.pack(side='left')
+    tk.Entry(filter_bar, textvariable=filter_value_var).pack(side='left')
+    tk.Button(filter_bar, text="Apply", command=lambda: apply_filter()).pack(side='left')
+    tk.Button(filter_bar, text="Clear", command=lambda: clear_filters()).pack(side='left')
+    tk.Button(filter_bar, text="Refresh", command=lambda: reload()).pack(side='left')
+    filter_label = tk.Label(filter_bar, text="")
+    filter_label.pack(side='left')
+
+    grid = tk.Frame(frame)
+    grid.pack(fill='both', expand=True)
+    tree = ttk.Treeview(grid, show='headings', height=BROWSER_VISIBLE_ROWS)
+    y_scrollbar = ttk.Scrollbar(grid, orient='vertical', command=tree.yview)
+    x_scrollbar = ttk.Scrollbar(grid, orient='horizontal', command=tree.xview)
+    tree.configure(xscrollcommand=x_scrollbar.set, yscrollcommand=lambda first, last: on_scroll(first, last))
+    tree.grid(row=0, column=0, sticky='nsew')
+    y_scrollbar.grid(row=0, column=1, sticky='ns')
+    x_scrollbar.grid(row=1, column=0, sticky='ew')
+    grid.rowconfigure(0, weight=1)
+    grid.columnconfigure(0, weight=1)
+    status_label = tk.Label(frame, text="")
+    status_label.pack()
+
+    def show_columns(columns):
+        if list(tree['columns']) == columns:
+            return
+        tree.configure(columns=columns)
+        filter_column_dropdown.configure(values=columns)
+        for col in columns:
+            tree.heading(col, text=col, command=lambda col=col: sort_by(col))
+            tree.column(col, width=120, stretch=False)
+
+    def show_sort_order():
+        for col in tree['columns']:
+            arrow = '' if col != view['order_by'] else (' \u25bc' if view['descending'] else ' \u25b2')
+            tree.heading(col, text=col + arrow)
+
+    def show_status():
+        rows_held = sum(len(page['items']) for page in view['pages'])
+        more = view['pages'] and view['pages'][-1]['next_after'] is not None
+        status_label.config(text="Loading..." if view['loading'] else
+                            f"{rows_held:,} rows loaded{', scroll for more' if more else ''}")
+
+    def fetch(direction):
+        # Only one page is fetched at a time; a reload supersedes a fetch still running
+        if direction == 'reload':
+            token = None
+        elif view['loading'] or not view['pages']:
+            return
+        else:
+            token = view['pages'][-1]['next_after'] if direction == 'next' else view['pages'][0]['previous_before']
+            if token is None:
+                return
+        view['loading'] = True
+        generation = view['generation']
+        filters, order_by, descending = dict(view['filters']), view['order_by'], view['descending']
+
+        def read_page(cursor, report):
+            return store.query(table_name, filters, BROWSER_PAGE_ROWS, after=token if direction == 'next' else None,
+                               before=token if direction == 'previous' else None, order_by=order_by,
+                               descending=descending)
+
+        def fetch_failed(e):
+            if generation == view['generation']:
+                view['loading'] = False
+            report_query_error("loading rows")(e)
+
+        executor.submit(read_page, on_done=lambda page: show_page(page, direction, generation),
+                        on_error=fetch_failed, channel=('browse', str(tree)))
+        show_status()
+
+    def show_page(page, direction, generation):
+        if generation != view['generation'] or not tree.winfo_exists():
+            return
+        view['loading'] = False
+        pages = view['pages']
+        if direction == 'reload':
+            show_columns(page['columns'])
+            tree.delete(*tree.get_children())
+            tree.yview_moveto(0)
+            pages.clear()
+
+        # An empty page means the rows held already reach that end
+        if not page['rows']:
+            if pages and direction == 'next':
+                pages[-1]['next_after'] = None
+            elif pages and direction == 'previous':
+                pages[0]['previous_before'] = None
+            show_status()
+            return
+
+        rows_held = len(tree.get_children())
+        first_visible = tree.yview()[0] * rows_held
+        values = [['' if value is None else value for value in row.values()] for row in page['rows']]
+        if direction == 'previous':
+            items = [tree.insert('', position, values=row) for position, row in enumerate(values)]
+        else:
+            items = [tree.insert('', 'end', values=row) for row in values]
+        held = {'items': items, 'previous_before': page['previous_before'], 'next_after': page['next_after']}
+
+        # Keep the rows in view where they were while pages are added and dropped at the ends
+        shift = 0
+        if direction == 'previous':
+            pages.insert(0, held)
+            shift = len(items)
+            if len(pages) > BROWSER_WINDOW_PAGES:
+                tree.delete(*pages.pop()['items'])
+        else:
+            pages.append(held)
+            if len(pages) > BROWSER_WINDOW_PAGES:
+                dropped = pages.pop(0)['items']
+                tree.delete(*dropped)
+                shift = -len(dropped)
+        if direction != 'reload':
+            tree.yview_moveto((first_visible + shift) / len(tree.get_children()))
+        show_status()
+
+    def on_scroll(first, last):
+        y_scrollbar.set(first, last)
+        if float(last) >= 1 - BROWSER_FETCH_MARGIN:
+            fetch('next')
+        elif float(first) <= BROWSER_FETCH_MARGIN:
+            fetch('previous')
+
+    def reload():
+        view['generation'] += 1
+        view['loading'] = False
+        filter_label.config(text=', '.join(f"{col} = {value}" for col, value in view['filters'].items()))
+        show_sort_order()
+        fetch('reload')
+
+    def sort_by(col):
+        if view['order_by'] == col:
+            view['descending'] = not view['descending']
+        else:
+            view['order_by'], view['descending'] = col, False
+        reload()
+
+    def apply_filter():
+        if filter_column_var.get():
+            view['filters'][filter_column_var.get()] = parse_filter_value(filter_value_var.get())
+            reload()
+
+    def clear_filters():
+        view['filters'].clear()
+        filter_value_var.set('')
+        reload()
+
+    reload()
+
+
+def open_search_dialog(table_name):
+    """Opens a dialog that finds entries by name words or, on the admin tables, by the start of their VIN."""
+    search_dialog = tk.Toplevel()
+    search_dialog.title(f"Search {table_name}")
+    modes = (['Name'] if table_name in NAME_SEARCH_TABLES else []) + \
+        (['VIN prefix'] if table_name in VIN_SEARCH_TABLES else [])
+    search = {'text': None, 'mode': None, 'next_after': None, 'generation': 0}
+
+    form = tk.Frame(search_dialog)
+    form.pack(fill='x')
+    mode_var = tk.StringVar(value=modes[0])
+    text_var = tk.StringVar()
+    ttk.Combobox(form, textvariable=mode_var, values=modes, state='readonly', width=12).pack(side='left')
+    text_entry = tk.Entry(form, textvariable=text_var, width=40)
+    text_entry.pack(side='left')
+    text_entry.bind('<Return>', lambda event: run_search(False))
+    tk.Button(form, text="Search", command=lambda: run_search(False)).pack(side='left')
+    more_button = tk.Button(form, text="More", state='disabled', command=lambda: run_search(True))
+    more_button.pack(side='left')
+
+    tree = ttk.Treeview(search_dialog, show='headings', height=BROWSER_VISIBLE_ROWS)
+    y_scrollbar = ttk.Scrollbar(search_dialog, orient='vertical', command=tree.yview)
+    tree.configure(yscrollcommand=y_scrollbar.set)
+    y_scrollbar.pack(side='right', fill='y')
+    tree.pack(fill='both', expand=True)
+    results_label = tk.Label(search_dialog, text="")
+    results_label.pack()
+    progress_bar, status_label = create_status_bar(search_dialog)
+
+    def run_search(more):
+        # A new search starts from the first page; More continues the last search from where it stopped
+        if not more:
+            if not text_var.get().strip():
+                return
+            search['generation'] += 1
+            search['text'], search['mode'], search['next_after'] = text_var.get(), mode_var.get(), None
+        text, mode, after, generation = search['text'], search['mode'], search['next_after'], search['generation']
+        more_button.config(state='disabled')
+
+        def find(cursor, report):
+            if mode == 'VIN prefix':
+                return store.search_vins(table_name, text, SEARCH_PAGE_ROWS, after)
+            return store.search_names(table_name, text, SEARCH_PAGE_ROWS, after)
+
+        ticket = executor.submit(find, on_done=lambda page: show_results(page, more, generation),
+                                 on_error=report_query_error("searching"), channel=('search', str(tree)))
+        track_query(ticket, progress_bar, status_label, "Searching...")
+
+    def show_results(page, more, generation):
+        if generation != search['generation'] or not tree.winfo_exists():
+            return
+        if not more:
+            tree.delete(*tree.get_children())
+            tree.configure(columns=page['columns'])
+            for col in page['columns']:
+                tree.heading(col, text=col)
+                tree.column(col, width=120, stretch=False)
+        for row in page['rows']:
+            tree.insert('', 'end', values=['' if value is None else value for value in row.values()])
+        search['next_after'] = page['next_after']
+        more_button.config(state='normal' if page['next_after'] is not None else 'disabled')
+        results_label.config(text=f"{len(tree.get_children()):,} matches shown"
+                                  f"{', more available' if page['next_after'] is not None else ''}")
+
+    text_entry.focus_set()
+
 
 def open_add_dialog(table_name):
     """Opens the dialog for adding a new entry to the specified table."""
@@ -123,32 +440,101 @@ def open_add_dialog(table_name):
 
     entries = create_entry_fields(add_dialog, column_names)
 
+    # Let admins fill the decoded columns from the VIN instead of typing them
+    if table_name == 'merged_admin':
+        tk.Button(add_dialog, text="Decode VIN", command=lambda: fill_decoded_fields(column_names, entries)).pack()
+
     # Assign the function to add entry based on the table
-    tk.Button(add_dialog, text="Add Entry", command=lambda: add_entry_to_table(table_name, *[e.get() for e in entries])).pack()
+    tk.Button(add_dialog, text="Add Entry",
+              command=lambda: add_entry_to_table(table_name, *[e.get() for e in entries], status_bar=status_bar)).pack()
+    status_bar = create_status_bar(add_dialog)
 
-def add_entry_to_table(table_name, *entry_data):
-    """Adds a new entry to the specified table."""
-    try:
-        if table_name == 'merged_admin':
-            # Handle addition to merged_admin and also to merged_nonadmin
-            generate_unique_surrogate_key()
-            complete_entry_data_admin = entry_data + (surrogate_key,)
-            add_entry_to_merged_admin(cursor, complete_entry_data_admin)
-            complete_entry_data_nonadmin = (surrogate_key,) + entry_data[:-1]  # Exclude Surrogate_Key from admin
-            add_entry_to_merged_nonadmin(cursor, complete_entry_data_nonadmin)
-        elif table_name == 'merged_nonadmin':
-            # Direct addition to merged_nonadmin
-            complete_entry_data = (surrogate_key,) + entry_data
-            add_entry_to_merged_nonadmin(cursor, complete_entry_data)
-        elif table_name == 'unmerged_vins':
-            # Addition to unmerged_vins
-            add_entry_to_unmerged_vins(cursor, entry_data)
-
-        conn.commit()
+def add_entry_to_table(table_name, *entry_data, status_bar=None):
+    """Adds a new entry to the specified table through the vehicle store, off the Tk thread."""
+    def add(cursor, report):
+        return store.add_entry(table_name, entry_data)
+
+    def show_added(result):
         messagebox.showinfo("Success", "Entry added successfully.")
-    except sqlite3.Error as e:
-        messagebox.showerror("Error", f"Error adding entry: {str(e)}")
-        logging.error(f"Error adding entry: {str(e)}")
+
+    ticket = executor.submit(add, on_done=show_added, on_error=report_query_error("adding entry"))
+    if status_bar is not None:
+        track_query(ticket, *status_bar, "Adding entry...")
+
+def get_vin_decoder():
+    """Returns the shared VIN decoder, loading it on first use."""
+    global vin_decoder
+    if vin_decoder is None:
+        from vin_decoder import VinDecoder
+        vin_decoder = VinDecoder.load()
+    return vin_decoder
+
+def get_pyplot():
+    """Returns matplotlib.pyplot, importing it when the first graph is drawn."""
+    global plt
+    if plt is None:
+        import matplotlib.pyplot
+        plt = matplotlib.pyplot
+    return plt
+
+def fill_decoded_fields(column_names, entries):
+    """Fills the add dialog's fields with the decoder values for the entered VIN."""
+    try:
+        decoded_fields = get_vin_decoder().decode_admin_fields(entries[0].get())
+    except OSError as e:
+        messagebox.showerror("Error", f"Error loading VIN decoder: {str(e)}")
+        logging.error(f"Error loading VIN decoder: {str(e)}")
+        return
+
+    if decoded_fields is None:
+        messagebox.showerror("Error", "VIN not found in the decoder.")
+        return
+
+    for name, entry in zip(column_names, entries):
+        if name in decoded_fields:
+            entry.delete(0, tk.END)
+            entry.insert(0, decoded_fields[name])
+
+def get_column_store(table_name):
+    """Returns the column store for a table, creating it on first use; None if graphs use SQLite."""
+    global ANALYTICS_ENABLED
+    if not ANALYTICS_ENABLED or table_name not in ANALYTICS_TABLES:
+        return None
+    if table_name not in column_stores:
+        try:
+            from column_store import ColumnStore
+        except ImportError as e:
+            logging.warning(f"Counting graphs in SQLite; the column store is unavailable: {str(e)}")
+            ANALYTICS_ENABLED = False
+            return None
+        column_stores[table_name] = ColumnStore(store, table_name)
+    return column_stores[table_name]
+
+def count_values(table_name, group_column, filters):
+    """Counts rows per group_column value, from the column store when it holds the columns."""
+    column_store = get_column_store(table_name)
+    if column_store is not None and column_store.covers(group_column, filters):
+        return column_store.counts(group_column, filters)
+    # Otherwise the rollup cube or the table answers, with the filters compiled by query_builder
+    return store.counts(table_name, group_column, filters)
+
+def parse_filter_value(text):
+    """Turns a value picked or typed in a dialog into a filter: the value, None for (blank), or a list."""
+    if LIST_SEPARATOR in text:
+        return [parse_filter_value(part.strip()) for part in text.split(LIST_SEPARATOR) if part.strip()]
+    return None if text == BLANK_VALUE else text
+
+def dialog_filters(selected_values, range_values=None):
+    """Returns the filters for a dialog's {column: value} picks and {column: (from, to)} ranges.
+
+    'Any' and empty fields set no filter.
+    """
+    filters = {col: parse_filter_value(text) for col, text in selected_values.items() if text not in ('Any', '')}
+    for col, (low, high) in (range_values or {}).items():
+        bounds = {bound: text.strip() for bound, text in (('min', low), ('max', high)) if text.strip()}
+        if bounds:
+            filters[col] = bounds
+    return filters
 
 def create_entry_fields(parent, column_names):
     """Creates entry fields and labels for each specified column name."""
@@ -159,6 +545,56 @@ def create_entry_fields(parent, column_names):
         entry.pack()
         entries.append(entry)
     return entries
+def open_bulk_edit_dialog(table_name):
+    """Opens the dialog for applying a CSV change set of adds, updates and removes to the specified table."""
+    bulk_dialog = tk.Toplevel()
+    bulk_dialog.title(f"Bulk Edit {table_name}")
+
+    tk.Label(bulk_dialog, text="CSV with an operation column (add, update or remove),\n"
+                               "a VIN-NR column and the columns to set.").pack()
+    path_var = tk.StringVar()
+    tk.Entry(bulk_dialog, textvariable=path_var, width=50).pack()
+    tk.Button(bulk_dialog, text="Choose File",
+              command=lambda: path_var.set(filedialog.askopenfilename(filetypes=[("CSV files", "*.csv")]) or path_var.get())).pack()
+
+    # Strict change sets are applied only when every row is valid
+    strict_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(bulk_dialog, text="Apply nothing if any row is invalid", variable=strict_var).pack()
+
+    tk.Button(bulk_dialog, text="Apply Changes",
+              command=lambda: apply_bulk_changes(table_name, path_var.get(), strict_var.get(), status_bar)).pack()
+    status_bar = create_status_bar(bulk_dialog)
+
+def apply_bulk_changes(table_name, path, strict=False, status_bar=None):
+    """Applies a change set file in one transaction and reports the rows that were rejected."""
+    if not path:
+        messagebox.showerror("Error", "Choose a change set file first.")
+        return
+    error_report_path = path.rsplit('.', 1)[0] + '_errors.csv'
+
+    def apply_changes(cursor, report):
+        # Imported here so pandas loads on the worker thread, not before the login window
+        from change_sets import apply_change_set, write_error_report
+        result = apply_change_set(store, table_name, path, strict)
+        if result['errors']:
+            write_error_report(result['errors'], error_report_path)
+        return result
+
+    def show_result(result):
+        summary = (f"Added {result['added']:,}, updated {result['updated']:,} and removed {result['removed']:,} "
+                   f"entries in {result['seconds']:.1f}s.")
+        if result['errors']:
+            first_errors = '\n'.join(f"Row {error['row']}: {error['error']}" for error in result['errors'][:5])
+            messagebox.showwarning("Bulk Edit", f"{summary}\n{len(result['errors']):,} rows were rejected"
+                                   f"{' so nothing was applied' if strict else ''}; "
+                                   f"see {error_report_path}.\n\n{first_errors}")
+        else:
+            messagebox.showinfo("Bulk Edit", summary)
+
+    ticket = executor.submit(apply_changes, on_done=show_result, on_error=report_query_error("applying change set"))
+    if status_bar is not None:
+        track_query(ticket, *status_bar, "Applying changes...")
+
 def open_remove_dialog(table_name):
     """Opens the dialog for removing an entry from the specified table."""
     remove_dialog = tk.Toplevel()
@@ -169,36 +605,19 @@ def open_remove_dialog(table_name):
     vin_entry.pack()
 
     tk.Button(remove_dialog, text="Remove Entry",
-              command=lambda: remove_entry_from_table(table_name, vin_entry.get())).pack()
-def remove_entry_from_table(table_name, key_value):
-    """Removes an entry from the specified table."""
-    try:
-        if table_name == 'merged_admin':
-            # Fetch the Surrogate_Key for the given VIN-NR
-            cursor.execute("SELECT Surrogate_Key FROM merged_admin WHERE [VIN-NR] = ?", (key_value,))
-            surrogate_key_result = cursor.fetchone()
-
-            # Remove the entry from merged_admin
-            remove_from_merged_admin(cursor, key_value)
-
-            # If there's a corresponding entry in merged_nonadmin, remove it using the Surrogate_Key
-            if surrogate_key_result:
-                surrogate_key = surrogate_key_result[0]
-                remove_from_merged_nonadmin(cursor, surrogate_key)
-
-        elif table_name == 'merged_nonadmin':
-            # Direct removal from merged_nonadmin
-            remove_from_merged_nonadmin(cursor, key_value)
-
-        elif table_name == 'unmerged_vins':
-            # Removal from unmerged_vins if needed
-            remove_from_unmerged_vins(cursor, key_value)
-
-        conn.commit()
+              command=lambda: remove_entry_from_table(table_name, vin_entry.get(), status_bar)).pack()
+    status_bar = create_status_bar(remove_dialog)
+def remove_entry_from_table(table_name, key_value, status_bar=None):
+    """Removes an entry from the specified table through the vehicle store, off the Tk thread."""
+    def remove(cursor, report):
+        return store.remove_entry(table_name, key_value)
+
+    def show_removed(result):
         messagebox.showinfo("Success", "Entry removed successfully.")
-    except sqlite3.Error as e:
-        messagebox.showerror("Error", f"Error removing entry: {str(e)}")
-        logging.error(f"Error removing entry: {str(e)}")
+
+    ticket = executor.submit(remove, on_done=show_removed, on_error=report_query_error("removing entry"))
+    if status_bar is not None:
+        track_query(ticket, *status_bar, "Removing entry...")
 
 def open_update_dialog(table_name):
     """Opens the dialog for updating an entry in the specified table."""
@@ -214,28 +633,24 @@ def open_update_dialog(table_name):
 
 def update_entry_in_table(table_name, vin):
     """Retrieves existing data for the given VIN and opens the update entry dialog."""
-    try:
-        cursor.execute(f"SELECT * FROM {table_name} WHERE [VIN-NR] = ?", (vin,))
-        entry_data = cursor.fetchone()
-
-        if entry_data:
+    def open_entry(entry):
+        if entry:
+            entry_data = tuple(entry.values())
             if table_name == 'merged_admin':
                 open_update_entry_dialog(table_name, vin, entry_data, True)
             else:
                 open_update_entry_dialog(table_name, vin, entry_data, False)
         else:
             messagebox.showerror("Error", "Entry not found in the table.")
-    except sqlite3.Error as e:
-        messagebox.showerror("Error", f"Error retrieving entry: {str(e)}")
-        logging.error(f"Error retrieving entry: {str(e)}")
 
+    executor.submit(lambda cursor, report: store.lookup(table_name, vin),
+                    on_done=open_entry, on_error=report_query_error("retrieving entry"))
 
-def update_entry_in_table(table_name, vin):
-    try:
-        cursor.execute(f"SELECT * FROM {table_name} WHERE [VIN-NR] = ?", (vin,))
-        entry_data = cursor.fetchone()
 
-        if entry_data:
+def update_entry_in_table(table_name, vin):
+    def open_entry(entry):
+        if entry:
+            entry_data = tuple(entry.values())
             if table_name == 'merged_admin':
                 open_update_entry_dialog(table_name, vin, entry_data, True)
             elif table_name == 'unmerged_vins':
@@ -245,9 +660,9 @@ def update_entry_in_table(table_name, vin):
                 open_update_entry_dialog(table_name, vin, entry_data, False)
         else:
             messagebox.showerror("Error", "Entry not found in the table.")
-    except sqlite3.Error as e:
-        messagebox.showerror("Error", f"Error retrieving entry: {str(e)}")
-        logging.error(f"Error retrieving entry: {str(e)}")
+
+    executor.submit(lambda cursor, report: store.lookup(table_name, vin),
+                    on_done=open_entry, on_error=report_query_error("retrieving entry"))
 
 def open_update_entry_dialog(table_name, vin, entry_data, is_merged_admin=False, is_unmerged_vins=False):
     update_entry_dialog = tk.Toplevel()
@@ -268,104 +683,25 @@ def open_update_entry_dialog(table_name, vin, entry_data, is_merged_admin=False,
         entry.insert(0, data)
 
     tk.Button(update_entry_dialog, text="Update Entry", 
-              command=lambda: perform_update(table_name, vin, *[e.get() for e in entries], is_merged_admin)).pack()
+              command=lambda: perform_update(table_name, vin, *[e.get() for e in entries], is_merged_admin,
+                                             status_bar=status_bar)).pack()
+    status_bar = create_status_bar(update_entry_dialog)
 
-def update_unmerged_vins(cursor, vin_nr, updated_data):
-    try:
-        if len(updated_data) != 6:
-            raise ValueError("Incorrect number of data items supplied for updating unmerged_vins.")
-
-        sql = '''UPDATE unmerged_vins SET "MAKE-OF-CAR" = ?, "MODEL-Short" = ?, "MODEL-YEAR" = ?, 
-                 key1 = ?, key2 = ?, Surrogate_Key = ? WHERE "VIN-NR" = ?'''
-        cursor.execute(sql, updated_data + (vin_nr,))
-        conn.commit()
-        messagebox.showinfo("Success", "Entry updated successfully in unmerged_vins.")
-    except sqlite3.Error as e:
-        messagebox.showerror("Error", f"Error updating entry in unmerged_vins: {str(e)}")
-        logging.error(f"Error updating entry in unmerged_vins: {str(e)}")
-    except ValueError as e:
-        messagebox.showerror("Error", str(e))
-
-
-def remove_from_unmerged_vins(cursor, vin_nr):
-    try:
-        sql = "DELETE FROM unmerged_vins WHERE \"VIN-NR\"=?"
-        cursor.execute(sql, (vin_nr,))
-        conn.commit()
-        messagebox.showinfo("Success", "Entry removed successfully from unmerged_vins.")
-    except sqlite3.Error as e:
-        messagebox.showerror("Error", f"Error removing entry from unmerged_vins: {str(e)}")
-        logging.error(f"Error removing entry from unmerged_vins: {str(e)}")
-
-def perform_update(table_name, vin, *new_data, is_merged_admin=False):
-    """Performs the update operation on the specified table."""
-    try:
-        if table_name == 'merged_admin' or is_merged_admin:
-            # Exclude the last data point which is Surrogate_Key
-            update_merged_admin(cursor, vin, new_data[:-1]) 
-            cursor.execute("SELECT Surrogate_Key FROM merged_admin WHERE [VIN-NR] = ?", (vin,))
-            surrogate_key = cursor.fetchone()[0]
-            # Update corresponding entry in merged_nonadmin
-            update_merged_nonadmin(cursor, surrogate_key, new_data[:-2])  # Exclude Surrogate_Key and VIN-NR
-        elif table_name == 'unmerged_vins':
-            # Update logic for unmerged_vins
-            update_unmerged_vins(cursor, vin, new_data[:-1])  
-        conn.commit()
+def perform_update(table_name, vin, *new_data, is_merged_admin=False, status_bar=None):
+    """Performs the update operation on the specified table through the vehicle store, off the Tk thread."""
+    # The last value is the is_merged_admin flag passed along with the entry fields
+    updated_data = new_data[:-1]
+
+    def update(cursor, report):
+        return store.update_entry(table_name, vin, updated_data)
+
+    def show_updated(result):
         messagebox.showinfo("Success", "Entry updated successfully.")
-    except sqlite3.Error as e:
-        messagebox.showerror("Error", f"Error updating entry: {str(e)}")
-        logging.error(f"Error updating entry: {str(e)}")
-
-
-def add_entry_to_merged_admin(cursor, entry_data):
-    """Adds a new entry to the merged_admin table."""
-    sql = '''INSERT INTO merged_admin ("VIN-NR", "Vehicle Name", Make, Model_full, Vehicle_Manufacturer,
-             Technology, Model_Year, Date_Added, Date_Updated, VIN_Key, Vehicle_Category,
-             Vehicle_Use_Case, Vehicle_Class, Zip, Surrogate_Key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
-    cursor.execute(sql, entry_data)
-
-def add_entry_to_merged_nonadmin(cursor, entry_data):
-    """Adds a new entry to the merged_nonadmin table."""
-    sql = '''INSERT INTO merged_nonadmin (Surrogate_Key, "Vehicle Name", Make, Model_full, Vehicle_Manufacturer,
-             Technology, Model_Year, Date_Added, Date_Updated, VIN_Key, Vehicle_Category,
-             Vehicle_Use_Case, Vehicle_Class, Zip) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
-    cursor.execute(sql, entry_data)
-
-def add_entry_to_unmerged_vins(cursor, entry_data):
-    """Adds a new entry to the unmerged_vins table."""
-    try:
-        sql = '''INSERT INTO unmerged_vins ("VIN-NR", "MAKE-OF-CAR", "MODEL-Short", "MODEL-YEAR", key1, key2, Surrogate_Key)
-                 VALUES (?, ?, ?, ?, ?, ?, ?)'''
-        cursor.execute(sql, entry_data)
-        conn.commit()
-        messagebox.showinfo("Success", "Entry added successfully to unmerged_vins.")
-    except sqlite3.Error as e:
-        messagebox.showerror("Error", f"Error adding entry to unmerged_vins: {str(e)}")
-        logging.error(f"Error adding entry to unmerged_vins: {str(e)}")
-
-def remove_from_merged_admin(cursor, vin_nr):
-    """Removes an entry from the merged_admin table."""
-    sql = "DELETE FROM merged_admin WHERE [VIN-NR]=?"
-    cursor.execute(sql, (vin_nr,))
-
-def remove_from_merged_nonadmin(cursor, surrogate_key):
-    """Removes an entry from the merged_nonadmin table."""
-    sql = "DELETE FROM merged_nonadmin WHERE Surrogate_Key=?"
-    cursor.execute(sql, (surrogate_key,))
-
-def update_merged_admin(cursor, vin_nr, updated_data):
-    """Updates an entry in the merged_admin table."""
-    sql = '''UPDATE merged_admin SET "Vehicle Name"=?, Make=?, Model_full=?, Vehicle_Manufacturer=?,
-             Technology=?, Model_Year=?, Date_Added=?, Date_Updated=?, VIN_Key=?, Vehicle_Category=?,
-             Vehicle_Use_Case=?, Vehicle_Class=?, Zip=?, Surrogate_Key=? WHERE "VIN-NR"=?'''
-    cursor.execute(sql, updated_data + (vin_nr,))
-
-def update_merged_nonadmin(cursor, surrogate_key, updated_data):
-    """Updates an entry in the merged_nonadmin table."""
-    sql = '''UPDATE merged_nonadmin SET "Vehicle Name"=?, Make=?, Model_full=?, Vehicle_Manufacturer=?,
-             Technology=?, Model_Year=?, Date_Added=?, Date_Updated=?, VIN_Key=?, Vehicle_Category=?,
-             Vehicle_Use_Case=?, Vehicle_Class=?, Zip=? WHERE Surrogate_Key=?'''
-    cursor.execute(sql, updated_data + (surrogate_key,))
+
+    ticket = executor.submit(update, on_done=show_updated, on_error=report_query_error("updating entry"))
+    if status_bar is not None:
+        track_query(ticket, *status_bar, "Updating entry...")
+
 
 def export_unmerged_vins():
     messagebox.showinfo("Not Implemented", "Export functionality not implemented yet.")
@@ -376,60 +712,108 @@ def create_export_dialog(table_name):
     export_dialog = tk.Toplevel()
     export_dialog.title(f"Export Data from {table_name}")
 
-    # Fetch unique values for each column from the database
-    column_values = get_unique_column_values(table_name)
-
-    # Dictionary to hold the user's selection for each column
-    selected_values = {col: tk.StringVar(value='Any') for col in column_values}
-
-    # Create dropdown menus for each column
-    for col, values in column_values.items():
-        tk.Label(export_dialog, text=f"{col}:").pack()
-        dropdown = ttk.Combobox(export_dialog, textvariable=selected_values[col], values=['Any'] + values)
-        dropdown.pack()
+    # The form is filled in once the column values have been fetched
+    form = tk.Frame(export_dialog)
+    form.pack()
+    progress_bar, status_label = create_status_bar(export_dialog)
+
+    def build_form(column_values):
+        if not form.winfo_exists():
+            return
+
+        # Dictionaries to hold the user's selection for each column, and the From/To of range columns
+        selected_values = {col: tk.StringVar(value='Any') for col in column_values if col not in RANGE_COLUMNS}
+        range_values = {col: (tk.StringVar(), tk.StringVar()) for col in column_values if col in RANGE_COLUMNS}
+
+        # Create dropdown menus for each column; high-cardinality columns search as the user types
+        for col, values in column_values.items():
+            tk.Label(form, text=f"{col}:").pack()
+            if col in range_values:
+                range_row = tk.Frame(form)
+                range_row.pack()
+                tk.Label(range_row, text="From").pack(side='left')
+                tk.Entry(range_row, textvariable=range_values[col][0], width=12).pack(side='left')
+                tk.Label(range_row, text="To").pack(side='left')
+                tk.Entry(range_row, textvariable=range_values[col][1], width=12).pack(side='left')
+                continue
+            dropdown = ttk.Combobox(form, textvariable=selected_values[col], values=['Any', BLANK_VALUE] + (values or []))
+            dropdown.pack()
+            if values is None:
+                attach_typeahead(dropdown, table_name, lambda col=col: col)
+
+        # Output format
+        file_type_var = tk.StringVar(value='CSV')
+        tk.Label(form, text="File Type:").pack()
+        ttk.Combobox(form, textvariable=file_type_var, values=list(EXPORT_FILE_TYPES), state='readonly').pack()
+
+        # Export button
+        tk.Button(form, text="Export Data",
+                  command=lambda: export_data(table_name, selected_values, file_type_var.get(), progress_bar, status_label,
+                                              range_values)).pack()
 
-    # Export button
-    tk.Button(export_dialog, text="Export Data", command=lambda: export_data(table_name, selected_values)).pack()
-
-def get_unique_column_values(table_name):
-    unique_values = {}
-    columns = get_table_columns(table_name)
-
-    for col in columns:
-        safe_col = f'"{col}"' if ' ' in col or '-' in col else col
-        try:
-            cursor.execute(f"SELECT DISTINCT {safe_col} FROM {table_name}")
-            values = [row[0] for row in cursor.fetchall() if row[0] is not None]
-            unique_values[col] = values
-        except sqlite3.OperationalError as e:
-            print(f"Error fetching unique values for column {col}: {e}")
-
-    return unique_values
-
-def get_table_columns(table_name):
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    return [row[1] for row in cursor.fetchall()]
-def export_data(table_name, selected_values):
-    query = f"SELECT * FROM {table_name} WHERE "
-    query_conditions = []
-    for col, var in selected_values.items():
-        if var.get() != 'Any':
-            safe_col = f'"{col}"' if ' ' in col or '-' in col else col
-            query_conditions.append(f"{safe_col} = '{var.get()}'")
-    query += ' AND '.join(query_conditions) if query_conditions else "1=1"
-
-    cursor.execute(query)
-    data = cursor.fetchall()
-    export_to_csv(data, table_name + '_export.csv')
-
-
-def export_to_csv(data, filename):
-    import csv
-    with open(filename, 'w', newline='') as csvfile:
-        csvwriter = csv.writer(csvfile)
-        for row in data:
-            csvwriter.writerow(row)
-    messagebox.showinfo("Export Successful", f"Data exported successfully to {filename}")
+    # Fetch unique values for each column from the database
+    ticket = executor.submit(lambda cursor, report: store.column_values(table_name),
+                             on_done=build_form, on_error=report_query_error("loading column values"))
+    track_query(ticket, progress_bar, status_label, "Loading column values...")
+
+def attach_typeahead(dropdown, table_name, get_column):
+    """Fills a combobox with values matching what has been typed instead of listing every value.
+
+    get_column returns the column to search, or None while the dropdown lists its values in full.
+    """
+    pending = {'job': None}
+
+    def show_matches(matches):
+        if dropdown.winfo_exists():
+            dropdown.configure(values=['Any'] + matches)
+
+    def log_search_error(e):
+        logging.error(f"Error searching values for column {get_column()}: {str(e)}")
+
+    def refresh_matches():
+        pending['job'] = None
+        column = get_column()
+        if column is None:
+            return
+        prefix = dropdown.get() if dropdown.get() != 'Any' else ''
+        # A newer search from this dropdown supersedes one still waiting or running
+        executor.submit(lambda cursor, report: store.search_values(table_name, column, prefix, TYPEAHEAD_LIMIT),
+                        on_done=show_matches, on_error=log_search_error, channel=('typeahead', str(dropdown)))
+
+    def schedule_refresh(event):
+        # Wait for a pause in typing so each keystroke does not issue its own query
+        if pending['job'] is not None:
+            dropdown.after_cancel(pending['job'])
+        pending['job'] = dropdown.after(TYPEAHEAD_DELAY_MS, refresh_matches)
+
+    dropdown.bind('<KeyRelease>', schedule_refresh)
+    dropdown.configure(postcommand=refresh_matches)
+
+def export_data(table_name, selected_values, file_type='CSV', progress_bar=None, status_label=None, range_values=None):
+    """Streams the rows matching the selected values and ranges to an export file with a header row."""
+    filters = dialog_filters({col: var.get() for col, var in selected_values.items()},
+                             {col: (low.get(), high.get()) for col, (low, high) in (range_values or {}).items()})
+    filename = table_name + '_export' + EXPORT_FILE_TYPES[file_type]
+    progress_text = {'text': "Counting rows..."}
+
+    def show_progress(rows_written, total_rows):
+        if progress_bar is not None and total_rows and progress_bar.winfo_exists():
+            progress_bar.stop()
+            progress_bar.configure(mode='determinate', value=100 * rows_written / total_rows)
+        progress_text['text'] = f"{rows_written:,} of {total_rows:,} rows" if total_rows else f"{rows_written:,} rows"
+
+    def show_result(stats):
+        messagebox.showinfo("Export Successful",
+                            f"Exported {stats['rows']:,} rows to {filename} in {stats['seconds']:.1f}s "
+                            f"({stats['rows_per_second']:,.0f} rows/sec)")
+
+    # Starting another export of this table supersedes one that is still running
+    ticket = executor.submit(
+        lambda cursor, report: store.export(table_name, filters, filename, progress=report, count_total=True),
+        on_done=show_result, on_error=report_query_error("exporting data", "Export Failed"),
+        on_progress=show_progress, channel=('export', table_name))
+    if progress_bar is not None and status_label is not None:
+        track_query(ticket, progress_bar, status_label, lambda: progress_text['text'])
 
 def create_graph_dialog(table_name):
     graph_dialog = tk.Toplevel()
@@ -442,63 +826,81 @@ def create_graph_dialog(table_name):
     graph_type_dropdown = ttk.Combobox(graph_dialog, textvariable=graph_type_var, values=graph_types)
     graph_type_dropdown.pack()
 
+    # The column dropdowns are filled in once the column values have been fetched
+    form = tk.Frame(graph_dialog)
+    form.pack()
+    progress_bar, status_label = create_status_bar(graph_dialog)
+
+    def build_form(column_values):
+        if not form.winfo_exists():
+            return
+
+        # Dropdown for column selection
+        columns_var = tk.StringVar(value=list(column_values.keys())[0])
+        tk.Label(form, text="Column:").pack()
+        columns_dropdown = ttk.Combobox(form, textvariable=columns_var, values=list(column_values.keys()))
+        columns_dropdown.pack()
+
+        # Dropdown for value selection in the chosen column
+        value_var = tk.StringVar()
+        tk.Label(form, text="Value:").pack()
+        value_dropdown = ttk.Combobox(form, textvariable=value_var)
+        value_dropdown.pack()
+
+        # Update value dropdown based on column selection
+        def update_values_dropdown(*args):
+            selected_column = columns_var.get()
+            values = column_values.get(selected_column) or []
+            value_dropdown.configure(values=['Any', BLANK_VALUE] + values)
+            value_dropdown.set(values[0] if values else 'Any')
+
+        columns_var.trace("w", update_values_dropdown)
+
+        # Columns too large to list are searched by prefix as the user types a value
+        attach_typeahead(value_dropdown, table_name,
+                         lambda: columns_var.get() if column_values.get(columns_var.get(), []) is None else None)
+
+        # Dropdown for additional column selection
+        additional_column_var = tk.StringVar(value=list(column_values.keys())[0])
+        tk.Label(form, text="Additional Column:").pack()
+        additional_column_dropdown = ttk.Combobox(form, textvariable=additional_column_var, values=list(column_values.keys()))
+        additional_column_dropdown.pack()
+
+        # Generate button
+        tk.Button(form, text="Generate Graph",
+                  command=lambda: generate_graph_data(table_name, graph_type_var.get(), columns_var.get(), value_var.get(),
+                                                      additional_column_var.get(), progress_bar, status_label)).pack()
+
     # Fetch unique values for each column from the database
-    column_values = get_unique_column_values(table_name)
-
-    # Dropdown for column selection
-    columns_var = tk.StringVar(value=list(column_values.keys())[0])
-    tk.Label(graph_dialog, text="Column:").pack()
-    columns_dropdown = ttk.Combobox(graph_dialog, textvariable=columns_var, values=list(column_values.keys()))
-    columns_dropdown.pack()
-
-    # Dropdown for value selection in the chosen column
-    value_var = tk.StringVar()
-    tk.Label(graph_dialog, text="Value:").pack()
-    value_dropdown = ttk.Combobox(graph_dialog, textvariable=value_var)
-    value_dropdown.pack()
-
-    # Update value dropdown based on column selection
-    def update_values_dropdown(*args):
-        selected_column = columns_var.get()
-        value_dropdown.configure(values=column_values[selected_column])
-        value_dropdown.set(column_values[selected_column][0])
-
-    columns_var.trace("w", update_values_dropdown)
-
-    # Dropdown for additional column selection
-    additional_column_var = tk.StringVar(value=list(column_values.keys())[0])
-    tk.Label(graph_dialog, text="Additional Column:").pack()
-    additional_column_dropdown = ttk.Combobox(graph_dialog, textvariable=additional_column_var, values=list(column_values.keys()))
-    additional_column_dropdown.pack()
-
-    # Generate button
-    tk.Button(graph_dialog, text="Generate Graph", 
-              command=lambda: generate_graph_data(table_name, graph_type_var.get(), columns_var.get(), value_var.get(), additional_column_var.get())).pack()
-
-def generate_graph_data(table_name, graph_type, column, value, additional_column):
-    # Format the column names for SQL query
-    formatted_column = f'"{column}"' if ' ' in column or '-' in column else column
-    formatted_additional_column = f'"{additional_column}"' if ' ' in additional_column or '-' in additional_column else additional_column
-
-    # Construct the SQL query
-    if value != 'Any':
-        query = f"SELECT {formatted_additional_column}, COUNT(*) FROM {table_name} WHERE {formatted_column} = '{value}' GROUP BY {formatted_additional_column}"
-    else:
-        query = f"SELECT {formatted_additional_column}, COUNT(*) FROM {table_name} GROUP BY {formatted_additional_column}"
+    ticket = executor.submit(lambda cursor, report: store.column_values(table_name),
+                             on_done=build_form, on_error=report_query_error("loading column values"))
+    track_query(ticket, progress_bar, status_label, "Loading column values...")
+
+def generate_graph_data(table_name, graph_type, column, value, additional_column, progress_bar=None, status_label=None):
+    # Count rows per additional_column value, from the column store or the rollup cube when they cover the columns
+    filters = dialog_filters({column: value})
+
+    def count_rows(cursor, report):
+        return count_values(table_name, additional_column, filters)
 
-    # Execute the query and fetch the data
-    cursor.execute(query)
-    data = cursor.fetchall()
+    def draw_graph(data):
+        get_pyplot()
 
-    # Extract data for graph
-    categories = [row[0] for row in data]
-    counts = [row[1] for row in data]
+        # Extract data for graph
+        categories = [row[0] for row in data]
+        counts = [row[1] for row in data]
 
-    # Generate the graph using matplotlib
-    if graph_type == 'Pie Chart':
-        generate_pie_chart(categories, counts, column, value)
-    elif graph_type == 'Bar Chart':
-        generate_bar_chart(categories, counts, additional_column, value)
+        # Generate the graph using matplotlib
+        if graph_type == 'Pie Chart':
+            generate_pie_chart(categories, counts, column, value)
+        elif graph_type == 'Bar Chart':
+            generate_bar_chart(categories, counts, additional_column, value)
+
+    # Asking for another graph of this table supersedes a count that is still running
+    ticket = executor.submit(count_rows, on_done=draw_graph, on_error=report_query_error("generating graph data"),
+                             channel=('graph', table_name))
+    if progress_bar is not None and status_label is not None:
+        track_query(ticket, progress_bar, status_label, "Counting rows...")
 
 def generate_pie_chart(categories, counts, column, value):
     plt.figure(figsize=(10, 8))
@@ -510,7 +912,7 @@ def generate_pie_chart(categories, counts, column, value):
 
 def generate_bar_chart(categories, counts, column, value):
     plt.figure(figsize=(12, 8))
-    y_pos = np.arange(len(categories))
+    y_pos = range(len(categories))
     plt.bar(y_pos, counts, align='center', alpha=0.7)
     plt.xticks(y_pos, categories, rotation=45, ha='right')  # Rotate labels for better readability
     plt.xlabel(column)  # Use 'column' instead of 'additional_column'
@@ -521,35 +923,36 @@ def generate_bar_chart(categories, counts, column, value):
 
 
 def generate_graph(table_name, chart_type, primary_col, filter_val):
-    # Construct query based on selections
-    safe_col = f'"{primary_col}"' if ' ' in primary_col or '-' in primary_col else primary_col
-    query = f"SELECT {safe_col}, COUNT(*) FROM {table_name}"
-
-    if filter_val != 'Any':
-        query += f" WHERE {safe_col} = '{filter_val}'"
-
-    query += f" GROUP BY {safe_col}"
-
-    cursor.execute(query)
-    data = cursor.fetchall()
-
-    # Generate graph based on chart type
-    if chart_type == 'Pie Chart':
-        labels, sizes = zip(*data)
-        plt.figure(figsize=(8, 6))
-        plt.pie(sizes, labels=labels, autopct='%1.1f%%')
-        plt.title(f"Pie Chart of {primary_col}")
-    elif chart_type == 'Bar Chart':
-        categories, values = zip(*data)
-        plt.figure(figsize=(8, 6))
-        plt.bar(categories, values)
-        plt.xlabel(primary_col)
-        plt.ylabel('Count')
-        plt.title(f"Bar Chart of {primary_col}")
-
-    plt.show()
+    # Count rows per primary_col value, from the column store or the rollup cube when they cover the column
+    filters = dialog_filters({primary_col: filter_val})
+
+    def count_rows(cursor, report):
+        return count_values(table_name, primary_col, filters)
+
+    def draw_graph(data):
+        get_pyplot()
+
+        # Generate graph based on chart type
+        if chart_type == 'Pie Chart':
+            labels, sizes = zip(*data)
+            plt.figure(figsize=(8, 6))
+            plt.pie(sizes, labels=labels, autopct='%1.1f%%')
+            plt.title(f"Pie Chart of {primary_col}")
+        elif chart_type == 'Bar Chart':
+            categories, values = zip(*data)
+            plt.figure(figsize=(8, 6))
+            plt.bar(categories, values)
+            plt.xlabel(primary_col)
+            plt.ylabel('Count')
+            plt.title(f"Bar Chart of {primary_col}")
+
+        plt.show()
+
+    executor.submit(count_rows, on_done=draw_graph, on_error=report_query_error("generating graph data"),
+                    channel=('graph', table_name))
 
 if __name__ == "__main__":
     # Initialize the login window and start the application
     login_window = create_login_window()
     login_window.mainloop()
+    write_query_summary()
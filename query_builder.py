@@ -0,0 +1,167 @@
+import datetime
+import functools
+import json
+
+# Columns that can be filtered by range, and how their values compare: Model_Year as a number,
+# the dates (stored as M/D/YYYY text) as the integer YYYYMMDD
+RANGE_COLUMNS = {
+    'Model_Year': 'number',
+    'Date_Added': 'date',
+    'Date_Updated': 'date',
+}
+
+# Compiled statement texts kept, one per query shape; matches the connections' prepared-statement cache
+COMPILED_STATEMENT_CACHE_SIZE = 256
+
+# Date text formats a date range bound may be given in
+DATE_FORMATS = ['%m/%d/%Y', '%Y-%m-%d']
+
+
+def quote_identifier(name):
+    """Quotes a table or column name for use in SQL."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def table_columns(cursor, table_name):
+    """Returns [(column, declared type)] for a table."""
+    cursor.execute(f'PRAGMA table_info({quote_identifier(table_name)})')
+    columns = [(row[1], row[2].upper()) for row in cursor.fetchall()]
+    if not columns:
+        raise ValueError(f'Unknown table {table_name}')
+    return columns
+
+
+def date_sort_key(column):
+    """Returns an SQL expression turning M/D/YYYY text in a column into the integer YYYYMMDD."""
+    # CAST reads the leading digits of the text, so each part is cast from where it starts
+    rest = f"substr({column}, instr({column}, '/') + 1)"
+    return (f"(CAST(substr({rest}, instr({rest}, '/') + 1) AS INTEGER) * 10000 + "
+            f"CAST({column} AS INTEGER) * 100 + CAST({rest} AS INTEGER))")
+
+
+def range_bound(col, value):
+    """Returns a range bound as the number it is compared as, or raises ValueError."""
+    if RANGE_COLUMNS[col] == 'number':
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{col} range bound {value!r} is not a number') from None
+        return int(number) if number.is_integer() else number
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.year * 10000 + value.month * 100 + value.day
+    for date_format in DATE_FORMATS:
+        try:
+            date = datetime.datetime.strptime(str(value).strip(), date_format)
+            return date.year * 10000 + date.month * 100 + date.day
+        except ValueError:
+            pass
+    raise ValueError(f'{col} range bound {value!r} is not a date (use M/D/YYYY or YYYY-MM-DD)')
+
+
+def filter_condition(col, spec):
+    """Returns (kind, params) for one column's filter.
+
+    A filter is a value (equality), None (IS NULL), a list of values (IN; a None in the list also
+    matches NULL), {'null': bool} (IS NULL / IS NOT NULL), or {'min': low, 'max': high} for the
+    columns in RANGE_COLUMNS, with either bound optional and both inclusive.
+    """
+    if spec is None:
+        return 'null', []
+    if isinstance(spec, (list, tuple, set)):
+        values = list(spec)
+        present = [value for value in values if value is not None]
+        return ('in_or_null' if len(present) < len(values) else 'in'), [json.dumps(present, default=str)]
+    if isinstance(spec, dict):
+        if set(spec) == {'null'}:
+            return ('null' if spec['null'] else 'not_null'), []
+        if not spec or not set(spec) <= {'min', 'max'}:
+            raise ValueError(f'Filter on {col} must have min and/or max, or null: {spec!r}')
+        if col not in RANGE_COLUMNS:
+            raise ValueError(f'{col} cannot be filtered by range (use one of {", ".join(RANGE_COLUMNS)})')
+        bounds = [bound for bound in ('min', 'max') if spec.get(bound) is not None]
+        if not bounds:
+            raise ValueError(f'Range filter on {col} has no bounds')
+        return 'range_' + '_'.join(bounds), [range_bound(col, spec[bound]) for bound in bounds]
+    return 'eq', [spec]
+
+
+def filter_shape(cursor, table_name, filters, other_columns=()):
+    """Checks the filters and other_columns against the table's columns and returns (shape, params, columns).
+
+    The shape is the sorted ((column, kind), ...) the statement text depends on; params are the
+    values to bind, in the order the compiled statement uses them; columns are the table's.
+    """
+    columns = [col for col, _ in table_columns(cursor, table_name)]
+    for col in list(filters or {}) + [col for col in other_columns if col is not None]:
+        if col not in columns:
+            raise ValueError(f'Unknown column {col} in {table_name}')
+    shape, params = [], []
+    for col in sorted(filters or {}):
+        kind, values = filter_condition(col, filters[col])
+        shape.append((col, kind))
+        params.extend(values)
+    return tuple(shape), params, columns
+
+
+@functools.lru_cache(maxsize=COMPILED_STATEMENT_CACHE_SIZE)
+def compile_conditions(shape):
+    """Returns the WHERE clause text for a filter shape; every value is a bound parameter."""
+    conditions = []
+    for col, kind in shape:
+        column = quote_identifier(col)
+        if kind == 'eq':
+            conditions.append(f'{column} = ?')
+        elif kind == 'null':
+            conditions.append(f'{column} IS NULL')
+        elif kind == 'not_null':
+            conditions.append(f'{column} IS NOT NULL')
+        elif kind == 'in':
+            # One parameter holds the whole list as JSON, so lists of any length share a statement
+            conditions.append(f'{column} IN (SELECT value FROM json_each(?))')
+        elif kind == 'in_or_null':
+            conditions.append(f'({column} IN (SELECT value FROM json_each(?)) OR {column} IS NULL)')
+        else:
+            value = date_sort_key(column) if RANGE_COLUMNS[col] == 'date' else column
+            bounds = {'min': f'{value} >= ?', 'max': f'{value} <= ?'}
+            conditions.extend(bounds[bound] for bound in kind.split('_')[1:])
+    return ' AND '.join(conditions) if conditions else '1=1'
+
+
+@functools.lru_cache(maxsize=COMPILED_STATEMENT_CACHE_SIZE)
+def compile_select(source, shape, columns=None, group_column=None, count_expression=None):
+    """Returns the statement text for one query shape.
+
+    Selects the given columns, or the count (count_expression, e.g. COUNT(*)) grouped by
+    group_column when one is given, or just the count.
+    """
+    where_clause = compile_conditions(shape)
+    if count_expression is None:
+        select_list = ', '.join(quote_identifier(col) for col in columns)
+        return f'SELECT {select_list} FROM {quote_identifier(source)} WHERE {where_clause}'
+    if group_column is None:
+        return f'SELECT {count_expression} FROM {quote_identifier(source)} WHERE {where_clause}'
+    group = quote_identifier(group_column)
+    return f'SELECT {group}, {count_expression} FROM {quote_identifier(source)} WHERE {where_clause} GROUP BY {group}'
+
+
+def filter_clause(cursor, table_name, filters):
+    """Turns filters (see filter_condition) into a WHERE clause with bound parameters."""
+    shape, params, _ = filter_shape(cursor, table_name, filters)
+    return compile_conditions(shape), params
+
+
+def select_query(cursor, table_name, filters, columns=None):
+    """Returns (sql, params) selecting the columns (all by default) of the rows matching the filters."""
+    shape, params, table_column_names = filter_shape(cursor, table_name, filters, columns or ())
+    return compile_select(table_name, shape, columns=tuple(columns or table_column_names)), params
+
+
+def count_query(cursor, table_name, filters, group_column=None, source=None, count_expression='COUNT(*)'):
+    """Returns (sql, params) counting the rows matching the filters, per group_column value if given.
+
+    source is the table the count is read from when it is not table_name itself, e.g. a count
+    cube with the same columns; count_expression is then how that table's rows are counted.
+    """
+    shape, params, _ = filter_shape(cursor, table_name, filters, [group_column])
+    return compile_select(source or table_name, shape, group_column=group_column,
+                          count_expression=count_expression), params
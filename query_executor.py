@@ -0,0 +1,175 @@
+import logging
+import queue
+import threading
+import time
+from tkinter import TclError
+
+# How often the Tk event loop collects results from the worker thread
+QUERY_POLL_MS = 50
+
+
+class QueryCancelled(Exception):
+    """Raised inside a task when its request has been superseded or cancelled."""
+
+
+class QueryTicket:
+    """One submitted task: its callbacks, its cancellation flag and its timing."""
+
+    def __init__(self, task, on_done, on_error, on_progress, channel):
+        self.task = task
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.channel = channel
+        self.cancelled = False
+        self.finished = False
+        self.error = None
+        self.started = None
+        self.ended = None
+
+    def elapsed(self):
+        """Returns the seconds the task has been running, or 0 while it is still queued."""
+        if self.started is None:
+            return 0.0
+        return (self.ended or time.perf_counter()) - self.started
+
+
+class QueryExecutor:
+    """Runs database tasks on a worker thread so the Tk event loop never waits on SQLite.
+
+    The worker takes its connection from a ConnectionManager, so the connection's read-only
+    mode, WAL and busy timeout follow the session, and all of the window's database access is
+    serialized on one thread.
+    A task is called as task(cursor, report) and may call report(*args) to send progress;
+    report raises QueryCancelled once the task has been superseded. Results, errors and
+    progress are handed back to the callbacks on the Tk thread by polling with after().
+
+    Submitting with a channel supersedes the previous task on that channel: it is dropped if
+    still queued, interrupted if running, and its callbacks are never called.
+    """
+
+    def __init__(self, connections, poll_interval_ms=QUERY_POLL_MS):
+        self.connections = connections
+        self.poll_interval_ms = poll_interval_ms
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.channels = {}
+        self.running = None
+        self.conn = None
+        self.widget = None
+        self.thread = None
+
+    def start(self, widget):
+        """Starts the worker thread and delivers results through widget's event loop."""
+        self.widget = widget
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='query-executor', daemon=True)
+            self.thread.start()
+        self.widget.after(self.poll_interval_ms, self.poll)
+
+    def submit(self, task, on_done=None, on_error=None, on_progress=None, channel=None):
+        """Queues a task and returns its ticket."""
+        ticket = QueryTicket(task, on_done, on_error, on_progress, channel)
+        if channel is not None:
+            self.cancel(channel)
+            with self.lock:
+                self.channels[channel] = ticket
+        self.tasks.put(ticket)
+        return ticket
+
+    def cancel(self, channel):
+        """Cancels the latest task submitted on a channel, interrupting it if it is running."""
+        with self.lock:
+            ticket = self.channels.pop(channel, None)
+            if ticket is None:
+                return
+            ticket.cancelled = True
+            if self.running is ticket:
+                # interrupt() is safe to call from another thread; it stops the running statement
+                self.conn.interrupt()
+
+    def shutdown(self):
+        """Stops the worker thread once the queued tasks have run."""
+        if self.thread is not None:
+            self.tasks.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def report(self, ticket, args):
+        if ticket.cancelled:
+            raise QueryCancelled()
+        self.results.put((ticket, 'progress', args))
+
+    def run(self):
+        while True:
+            ticket = self.tasks.get()
+            if ticket is None:
+                break
+            with self.lock:
+                if ticket.cancelled:
+                    continue
+                self.running = ticket
+
+            ticket.started = time.perf_counter()
+            try:
+                if self.conn is None:
+                    self.conn = self.connections.connect()
+                cursor = self.conn.cursor()
+                try:
+                    outcome = ('done', ticket.task(cursor, lambda *args: self.report(ticket, args)))
+                finally:
+                    cursor.close()
+            except Exception as e:
+                # A failed or interrupted write must not leave its transaction open for the next task
+                if self.conn is not None and self.conn.in_transaction:
+                    self.conn.rollback()
+                outcome = ('error', e)
+            ticket.ended = time.perf_counter()
+
+            with self.lock:
+                self.running = None
+            self.results.put((ticket,) + outcome)
+
+        if self.conn is not None:
+            self.connections.release()
+            self.conn = None
+
+    def poll(self):
+        """Hands finished results and progress to their callbacks; runs on the Tk thread."""
+        try:
+            while True:
+                try:
+                    ticket, kind, payload = self.results.get_nowait()
+                except queue.Empty:
+                    break
+                if kind != 'progress':
+                    ticket.finished = True
+                    with self.lock:
+                        if self.channels.get(ticket.channel) is ticket:
+                            del self.channels[ticket.channel]
+                if ticket.cancelled:
+                    continue
+                self.deliver(ticket, kind, payload)
+        finally:
+            try:
+                self.widget.after(self.poll_interval_ms, self.poll)
+            except TclError:
+                pass  # The window has been closed
+
+    def deliver(self, ticket, kind, payload):
+        try:
+            if kind == 'progress':
+                if ticket.on_progress:
+                    ticket.on_progress(*payload)
+            elif kind == 'done':
+                if ticket.on_done:
+                    ticket.on_done(payload)
+            else:
+                ticket.error = payload
+                if ticket.on_error:
+                    ticket.on_error(payload)
+                else:
+                    logging.error(f'Query failed: {str(payload)}')
+        except Exception:
+            logging.exception('Error in query callback')
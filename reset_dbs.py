@@ -4,6 +4,22 @@ import sqlite3
 import glob
 import logging
 import random
+import argparse
+import multiprocessing
+import time
+import shutil
+import tempfile
+import json
+import statistics
+import numpy as np
+from vin_decoder import VinDecoder, ADMIN_COLUMN_NAMES, DECODER_PATH
+from schema import (TABLE_DEFINITIONS, VIEW_DEFINITIONS, create_tables, create_indexes, create_merged_tables,
+                    load_merged_rows, prune_vehicle_models, upgrade_schema)
+from key_allocator import create_sequence_table, reserve_surrogate_keys
+from facets import FACET_TABLES, facets_available, rebuild_facets, refresh_unlisted_facets
+from rollups import ROLLUP_TABLES, rollup_available, rebuild_rollups
+from search import rebuild_search, search_available
+from instrumentation import configure, stage
 
 # Configure logging to save diagnostic information to 'logfile.log'
 logging.basicConfig(filename='logfile.log', level=logging.DEBUG)
@@ -14,107 +30,166 @@ def create_database(db_name):
     conn = sqlite3.connect(db_name)
     conn.close()
 
+# Default peak-memory budget (in MB) for the streaming decode mode
+STREAM_MEMORY_BUDGET_MB = 256
+
+# Rough multiplier for the temporary copies pandas makes while keying and merging a chunk
+CHUNK_WORKING_SET_FACTOR = 4
+
 # Function to process a CSV file, merge it with a decoder, and save the results
 def process_file(filename):
     logging.info(f'Starting process_file for {filename}')
     
     try:
-        # Load VIN data and decoder CSV files
-        vin_data = pd.read_csv(filename)
-        vin_decoder = pd.read_csv('VIN_decoder.csv', encoding='latin1')
-
-        # Extract relevant parts of VIN for merging
-        vin_data['key1'] = vin_data.iloc[:, 0].astype(str).str[:8]
-        vin_data['key2'] = vin_data.iloc[:, 0].astype(str).str[9]
-        vin_decoder['key1'] = vin_decoder.iloc[:, 0].astype(str).str[:8]
-        vin_decoder['key2'] = vin_decoder.iloc[:, 1].astype(str)
-
-        # Perform the merge
-        merged_df = pd.merge(
-            vin_data,
-            vin_decoder,
-            left_on=['key1', 'key2'],
-            right_on=['key1', 'key2'],
-            how='inner'
-        )
+        with stage('process_file', file=filename) as metric:
+            # Load VIN data and decoder CSV files
+            vin_data = pd.read_csv(filename)
+            vin_decoder = VinDecoder.load()
+
+            merged_df, unmerged_df = vin_decoder.decode_frame(vin_data)
+
+            # Remove duplicates from merged data
+            merged_df.drop_duplicates(subset=['VIN-NR'], keep='first', inplace=True)
+
+            # Save the data to files
+            merged_filename = f'merged_{os.path.basename(filename)}'
+            unmerged_filename = f'unmerged_{os.path.basename(filename)}'
+
+            merged_df.to_csv(merged_filename, index=False)
+            unmerged_df.to_csv(unmerged_filename, index=False)
+            metric.update(rows=len(vin_data), merged_rows=len(merged_df), unmerged_rows=len(unmerged_df))
+
+        logging.info(f'Saved merged data to {merged_filename}')
+        logging.info(f'Saved unmerged data to {unmerged_filename}')
+    
+    except Exception as e:
+        logging.error(f"An error occurred in the process_file function: {e}")
 
-        # Drop temporary key columns
-        merged_df.drop(columns=['key1', 'key2'], inplace=True)
+# Function to estimate how many VIN rows can be decoded at once within a memory budget
+def estimate_chunk_size(filename, memory_budget_mb, reserved_bytes=0, sample_rows=10000):
+    sample = pd.read_csv(filename, nrows=sample_rows)
+    if sample.empty:
+        return sample_rows
 
-        # Find unmerged rows
-        merged_keys = merged_df.iloc[:, 0]
-        unmerged_df = vin_data[~vin_data.iloc[:, 0].isin(merged_keys)]
+    bytes_per_row = sample.memory_usage(index=True, deep=True).sum() / len(sample)
+    available_bytes = memory_budget_mb * 1024 * 1024 - reserved_bytes
+    if available_bytes <= 0:
+        logging.warning(f'Memory budget of {memory_budget_mb} MB is smaller than the decoder itself')
+        return 1000
 
-        # Remove duplicates from merged data
-        merged_df.drop_duplicates(subset=['VIN-NR'], keep='first', inplace=True)
+    return max(1000, int(available_bytes / (bytes_per_row * CHUNK_WORKING_SET_FACTOR)))
+
+# Function to decode a VIN file chunk by chunk, yielding (merged, unmerged, rows read) per chunk
+def iter_decoded_chunks(filename, vin_decoder, memory_budget_mb=STREAM_MEMORY_BUDGET_MB, chunk_size=None):
+    # The decoder stays resident for the whole run, so it counts against the budget
+    if chunk_size is None:
+        chunk_size = estimate_chunk_size(filename, memory_budget_mb, vin_decoder.memory_usage())
+    logging.info(f'Decoding {filename} in chunks of {chunk_size} rows')
+
+    for vin_data in pd.read_csv(filename, chunksize=chunk_size):
+        merged_df, unmerged_df = vin_decoder.decode_frame(vin_data)
+
+        # Remove duplicates within the chunk. A VIN repeated in a later chunk is dropped by the table
+        # it is loaded into, which keeps the first row for a VIN-NR, so no per-VIN state outlives the chunk.
+        merged_df = merged_df.drop_duplicates(subset=['VIN-NR'], keep='first')
+
+        yield merged_df, unmerged_df, len(vin_data)
+
+# Function to process a CSV file in fixed-size chunks so feeds larger than RAM can be decoded
+def process_file_chunked(filename, memory_budget_mb=STREAM_MEMORY_BUDGET_MB, chunk_size=None):
+    logging.info(f'Starting process_file_chunked for {filename}')
+
+    try:
+        vin_decoder = VinDecoder.load()
 
-        # Save the data to files
         merged_filename = f'merged_{os.path.basename(filename)}'
         unmerged_filename = f'unmerged_{os.path.basename(filename)}'
 
-        merged_df.to_csv(merged_filename, index=False)
-        unmerged_df.to_csv(unmerged_filename, index=False)
+        first_chunk = True
+        total_rows = 0
+
+        with stage('process_file_chunked', file=filename, memory_budget_mb=memory_budget_mb) as metric:
+            for merged_df, unmerged_df, rows in iter_decoded_chunks(filename, vin_decoder, memory_budget_mb,
+                                                                    chunk_size):
+                # Append the chunk, writing the header only once
+                write_mode = 'w' if first_chunk else 'a'
+                merged_df.to_csv(merged_filename, mode=write_mode, header=first_chunk, index=False)
+                unmerged_df.to_csv(unmerged_filename, mode=write_mode, header=first_chunk, index=False)
+                first_chunk = False
+
+                total_rows += rows
+                metric['rows'] = total_rows
+                logging.info(f'Decoded {total_rows} rows from {filename}')
 
         logging.info(f'Saved merged data to {merged_filename}')
         logging.info(f'Saved unmerged data to {unmerged_filename}')
-    
+
     except Exception as e:
-        logging.error(f"An error occurred in the process_file function: {e}")
+        logging.error(f"An error occurred in the process_file_chunked function: {e}")
 
 # Function to drop a specific column in CSV files
 def drop_column_in_files(directory, file_pattern, column_index, column_name):
     pattern = os.path.join(directory, file_pattern)
     files = glob.glob(pattern)
 
-    for file_path in files:
-        try:
-            df = pd.read_csv(file_path)
-        except Exception as e:
-            continue
-
-        if len(df.columns) > column_index and df.columns[column_index] == column_name:
-            df.drop(df.columns[column_index], axis=1, inplace=True)
+    with stage('drop_column_in_files', pattern=file_pattern, column=column_name, files=len(files)) as metric:
+        for file_path in files:
             try:
-                df.to_csv(file_path, index=False)
-                logging.info(f'Processed {file_path}')
+                df = pd.read_csv(file_path)
             except Exception as e:
-                logging.error(f'Error saving {file_path}: {e}')
-        else:
-            logging.warning(f'Skipped {file_path}: Column {column_index + 1} is not named "{column_name}" or does not exist')
+                continue
+
+            if len(df.columns) > column_index and df.columns[column_index] == column_name:
+                df.drop(df.columns[column_index], axis=1, inplace=True)
+                try:
+                    df.to_csv(file_path, index=False)
+                    metric['rows'] += len(df)
+                    logging.info(f'Processed {file_path}')
+                except Exception as e:
+                    logging.error(f'Error saving {file_path}: {e}')
+            else:
+                logging.warning(f'Skipped {file_path}: Column {column_index + 1} is not named "{column_name}" or does not exist')
 
 # Function to import data from CSV files to an SQLite database
 def import_to_db(directory, file_prefix, db_name):
     print(f'Importing data to database: {db_name}')
     conn = sqlite3.connect(db_name)
 
-    # Iterate over CSV files in the directory with the specified prefix and extension
-    for file in os.listdir(directory):
-        if file.startswith(file_prefix) and file.endswith('.csv'):
-            file_path = os.path.join(directory, file)
-            try:
-                df = pd.read_csv(file_path)
-            except Exception as e:
-                print(f"Error reading {file_path}: {e}")
-                continue
-
-            # Import the DataFrame to the SQLite database
-            table_name = os.path.splitext(file)[0]
-            try:
-                df.to_sql(table_name, conn, if_exists='append', index=False)
-                print(f'Imported {file_path} to table {table_name}')
-            except Exception as e:
-                print(f"Error importing {file_path} to database: {e}")
-                continue
+    with stage('import_to_db', prefix=file_prefix, database=db_name) as metric:
+        # Iterate over CSV files in the directory with the specified prefix and extension
+        for file in os.listdir(directory):
+            if file.startswith(file_prefix) and file.endswith('.csv'):
+                file_path = os.path.join(directory, file)
+                try:
+                    df = pd.read_csv(file_path)
+                except Exception as e:
+                    print(f"Error reading {file_path}: {e}")
+                    continue
+
+                # Import the DataFrame to the SQLite database
+                table_name = os.path.splitext(file)[0]
+                try:
+                    df.to_sql(table_name, conn, if_exists='append', index=False)
+                    metric['rows'] += len(df)
+                    print(f'Imported {file_path} to table {table_name}')
+                except Exception as e:
+                    print(f"Error importing {file_path} to database: {e}")
+                    continue
 
     conn.close()
 
-# Function to empty an SQLite database by dropping all tables
+# Function to empty an SQLite database by dropping all views and tables
 def empty_database(database_path):
     try:
         # Connect to the SQLite database
         conn = sqlite3.connect(database_path)
         cursor = conn.cursor()
 
+        # Drop the views first, so none is left pointing at a dropped table
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='view';")
+        for (view_name,) in cursor.fetchall():
+            cursor.execute(f"DROP VIEW IF EXISTS {view_name};")
+
         # Get a list of all tables in the database
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
         tables = cursor.fetchall()
@@ -142,50 +217,35 @@ def remove_file(file_path):
     else:
         logging.warning(f"File not found: {file_path}")
 
-# Function to create the 'merged_admin' table with a surrogate key
-def create_merged_admin_table(cursor):
-    cursor.execute('''
-        CREATE TABLE merged_admin AS
-        SELECT 
-            "VIN-NR",
-            "Vehicle Name",
-            "Make",
-            "Model-full" AS "Model_full",
-            "Vehicle Manufacturer" AS "Vehicle_Manufacturer",
-            "Technology",
-            "Model Year" AS "Model_Year",
-            "Date Added" AS "Date_Added",
-            "Date Updated" AS "Date_Updated",
-            "VIN_Key",
-            "Vehicle Category" AS "Vehicle_Category",
-            "Vehicle Use Case" AS "Vehicle_Use_Case",
-            "Vehicle Class" AS "Vehicle_Class",
-            CAST(ABS(RANDOM()) % 10 + 1 AS INTEGER) AS "Zip",
-            CAST(ABS(RANDOM()) % 1000000 AS INTEGER) AS "Surrogate_Key"  -- Generate a unique surrogate key
-        FROM merged_vins
-    ''')
-
-# Function to create the 'merged_nonadmin' table with the same surrogate key
+# Function to create the 'merged_admin' view and its vehicle_model/vehicle_fact tables with a surrogate key
+def create_merged_admin_table(cursor, first_key=1):
+    with stage('create_merged_admin_table') as metric:
+        create_merged_tables(cursor)
+        metric['rows'] = load_merged_rows(cursor, '''
+            SELECT 
+                "VIN-NR",
+                "Vehicle Name",
+                "Make",
+                "Model-full" AS "Model_full",
+                "Vehicle Manufacturer" AS "Vehicle_Manufacturer",
+                "Technology",
+                "Model Year" AS "Model_Year",
+                "Date Added" AS "Date_Added",
+                "Date Updated" AS "Date_Updated",
+                "VIN_Key",
+                "Vehicle Category" AS "Vehicle_Category",
+                "Vehicle Use Case" AS "Vehicle_Use_Case",
+                "Vehicle Class" AS "Vehicle_Class",
+                CAST(ABS(RANDOM()) % 10 + 1 AS INTEGER) AS "Zip",
+                ? + rowid - 1 AS "Surrogate_Key"  -- One key per source row from the reserved block
+            FROM merged_vins
+            ORDER BY rowid
+            ''', (first_key,))
+
+# Function to create the 'merged_nonadmin' view, which shows merged_admin without VIN-NR
 def create_merged_nonadmin_table(cursor):
-    cursor.execute('''
-        CREATE TABLE merged_nonadmin AS
-        SELECT 
-            "Surrogate_Key",  -- Use the same surrogate key
-            "Vehicle Name",
-            "Make",
-            "Model_full",
-            "Vehicle_Manufacturer",
-            "Technology",
-            "Model_Year",
-            "Date_Added",
-            "Date_Updated",
-            "VIN_Key",
-            "Vehicle_Category",
-            "Vehicle_Use_Case",
-            "Vehicle_Class",
-            "Zip"
-        FROM merged_admin
-    ''')
+    cursor.execute('DROP VIEW IF EXISTS merged_nonadmin')
+    cursor.execute(VIEW_DEFINITIONS['merged_nonadmin'])
 
 # Function to copy data from source databases to a target database with surrogate key
 def copy_data_to_target_database_with_surrogate_key():
@@ -205,15 +265,31 @@ def copy_data_to_target_database_with_surrogate_key():
     cursor_target.execute("ATTACH DATABASE 'merged_data.db' AS source_merged")
     cursor_target.execute("ATTACH DATABASE 'unmerged_data.db' AS source_unmerged")
 
-    # Create tables in the target database with the same surrogate key
-    create_merged_admin_table(cursor_target)
-    create_merged_nonadmin_table(cursor_target)
-
-    # Copy the 'unmerged_vins' table from source_unmerged to target database
-    cursor_target.execute("CREATE TABLE IF NOT EXISTS unmerged_vins AS SELECT *, ? AS Surrogate_Key FROM source_unmerged.unmerged_vins", (random.randint(1, 1000000),))
-
-    # Commit and close connections
-    conn_target.commit()
+    # Reserve one block of surrogate keys per source table, sized by its rowids
+    create_sequence_table(cursor_target)
+    cursor_target.execute("SELECT COALESCE(MAX(rowid), 0) FROM source_merged.merged_vins")
+    merged_first_key = reserve_surrogate_keys(cursor_target, cursor_target.fetchone()[0])
+    cursor_target.execute("SELECT COALESCE(MAX(rowid), 0) FROM source_unmerged.unmerged_vins")
+    unmerged_first_key = reserve_surrogate_keys(cursor_target, cursor_target.fetchone()[0])
+
+    with stage('copy_data_to_target_database') as metric:
+        # Create the tables in the target database; merged_nonadmin is a view of merged_admin
+        create_merged_admin_table(cursor_target, merged_first_key)
+        create_merged_nonadmin_table(cursor_target)
+        cursor_target.execute('SELECT COUNT(*) FROM vehicle_fact')
+        metric['rows'] = cursor_target.fetchone()[0]
+
+        # Copy the 'unmerged_vins' table from source_unmerged to target database, one row per VIN
+        cursor_target.execute(TABLE_DEFINITIONS['unmerged_vins'])
+        cursor_target.execute(f"INSERT OR IGNORE INTO unmerged_vins SELECT {quote_columns(UNMERGED_COLUMNS)}, ? + rowid - 1 AS Surrogate_Key FROM source_unmerged.unmerged_vins", (unmerged_first_key,))
+        metric['rows'] += cursor_target.rowcount
+
+        # Index the columns the UI filters and groups by, then build the facet catalogue and rollups
+        create_indexes(cursor_target)
+        rebuild_summaries(conn_target)
+
+        # Commit and close connections
+        conn_target.commit()
     conn_merged.close()
     conn_unmerged.close()
     conn_target.close()
@@ -241,49 +317,671 @@ def cleanup_databases():
     except Exception as e:
         print(f"Error during cleanup: {e}")
 
+# Maximum number of decoded batches waiting for the writer before the workers block
+WRITER_QUEUE_DEPTH = 8
+
+# Queue the pool workers send decoded batches on, set by init_decode_worker
+worker_batch_queue = None
+
+# Function to give each pool worker the shared batch queue
+def init_decode_worker(batch_queue):
+    global worker_batch_queue
+    worker_batch_queue = batch_queue
+
+# Function run in a pool worker to decode one VIN file and send its batches to the writer
+def decode_file_worker(filename, memory_budget_mb):
+    try:
+        vin_decoder = VinDecoder.load()
+        for merged_df, unmerged_df, rows in iter_decoded_chunks(filename, vin_decoder, memory_budget_mb):
+            worker_batch_queue.put(('batch', filename, merged_df, unmerged_df, rows))
+        worker_batch_queue.put(('done', filename, None, None, 0))
+    except Exception as e:
+        worker_batch_queue.put(('error', filename, None, None, f'{type(e).__name__}: {e}'))
+
+# Function to decode many VIN files across a process pool while one writer stores the batches
+def parallel_ingest(filenames, write_batch, workers=None, memory_budget_mb=STREAM_MEMORY_BUDGET_MB):
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(filenames))
+    logging.info(f'Starting parallel_ingest of {len(filenames)} files with {workers} workers')
+    start = time.perf_counter()
+
+    total_rows = 0
+    failed_files = []
+
+    batch_queue = multiprocessing.Queue(maxsize=WRITER_QUEUE_DEPTH)
+    with multiprocessing.Pool(workers, initializer=init_decode_worker, initargs=(batch_queue,)) as pool:
+        for filename in filenames:
+            pool.apply_async(decode_file_worker, (filename, memory_budget_mb // workers))
+
+        # This process is the single SQLite writer; it runs until every file has reported back
+        pending_files = len(filenames)
+        while pending_files:
+            kind, filename, merged_df, unmerged_df, rows = batch_queue.get()
+            if kind == 'batch':
+                # VINs repeated across files are dropped by the keyed tables the batches end up in
+                write_batch(merged_df, unmerged_df)
+                total_rows += rows
+            else:
+                pending_files -= 1
+                if kind == 'error':
+                    failed_files.append(filename)
+                    logging.error(f'Error decoding {filename}: {rows}')
+                else:
+                    logging.info(f'Finished decoding {filename}')
+
+    elapsed = time.perf_counter() - start
+    rows_per_second = total_rows / elapsed if elapsed > 0 else 0.0
+    logging.info(f'parallel_ingest decoded {total_rows} rows in {elapsed:.2f}s ({rows_per_second:,.0f} rows/sec)')
+    print(f'Decoded {total_rows} rows from {len(filenames) - len(failed_files)} files in {elapsed:.2f}s '
+          f'({rows_per_second:,.0f} rows/sec) using {workers} workers')
+    return {'rows': total_rows, 'seconds': elapsed, 'rows_per_second': rows_per_second,
+            'failed_files': failed_files}
+
+# Function to build a writer that appends decoded batches to the merged_vins/unmerged_vins source tables
+def make_source_table_writer(merged_conn, unmerged_conn):
+    def write_batch(merged_df, unmerged_df):
+        merged_df.to_sql('merged_vins', merged_conn, if_exists='append', index=False)
+        unmerged_df.to_sql('unmerged_vins', unmerged_conn, if_exists='append', index=False)
+    return write_batch
+
+# Function to decode the VIN feed files in parallel straight into merged_data.db and unmerged_data.db
+def import_feeds_in_parallel(filenames, workers=None, memory_budget_mb=STREAM_MEMORY_BUDGET_MB):
+    merged_conn = sqlite3.connect('merged_data.db')
+    unmerged_conn = sqlite3.connect('unmerged_data.db')
+    try:
+        writer = make_source_table_writer(merged_conn, unmerged_conn)
+        return parallel_ingest(filenames, writer, workers, memory_budget_mb)
+    finally:
+        merged_conn.close()
+        unmerged_conn.close()
+
+# Function to rebuild the facet catalogue, rollup cubes and search index, along with the triggers that maintain them
+def rebuild_summaries(conn):
+    rebuild_facets(conn)
+    rebuild_rollups(conn)
+    rebuild_search(conn)
+
+# Function to check that the facet catalogue, rollup cubes and search index exist
+def summaries_available(cursor):
+    return all(facets_available(cursor, t) for t in FACET_TABLES) and \
+        all(rollup_available(cursor, t) for t in ROLLUP_TABLES) and search_available(cursor)
+
+# merged_admin columns filled from the decoder, in table order
+MERGED_DECODED_COLUMNS = list(ADMIN_COLUMN_NAMES.values())
+
+# unmerged_vins columns taken from the VIN feed, in table order
+UNMERGED_COLUMNS = ['VIN-NR', 'MAKE-OF-CAR', 'MODEL-Short', 'MODEL-YEAR', 'key1', 'key2']
+
+# Function to quote a list of column names for use in SQL
+def quote_columns(columns):
+    return ', '.join(f'"{col}"' for col in columns)
+
+# Function to turn a DataFrame into a list of tuples SQLite can bind (NaN becomes NULL)
+def frame_to_rows(df):
+    # Converting column by column is several times faster than converting the frame as a whole
+    columns = [series.astype(object).where(series.notna(), None).tolist() for _, series in df.items()]
+    return list(zip(*columns))
+
+# Function to rename decoded rows to the merged_admin column layout
+def to_merged_admin_frame(merged_df):
+    admin_df = merged_df[['VIN-NR'] + list(ADMIN_COLUMN_NAMES.keys())]
+    return admin_df.rename(columns=ADMIN_COLUMN_NAMES)
+
+# Function to decode a VIN feed into temporary staging tables, one row per VIN
+def stage_vin_feed(conn, filename, memory_budget_mb=STREAM_MEMORY_BUDGET_MB):
+    cursor = conn.cursor()
+    cursor.execute('DROP TABLE IF EXISTS temp.staging_merged')
+    cursor.execute('DROP TABLE IF EXISTS temp.staging_unmerged')
+    cursor.execute('''
+        CREATE TEMP TABLE staging_merged (
+            "VIN-NR" TEXT PRIMARY KEY, "Vehicle Name" TEXT, Make TEXT, Model_full TEXT,
+            Vehicle_Manufacturer TEXT, Technology TEXT, Model_Year INT, Date_Added TEXT,
+            Date_Updated TEXT, VIN_Key TEXT, Vehicle_Category TEXT, Vehicle_Use_Case TEXT,
+            Vehicle_Class TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TEMP TABLE staging_unmerged (
+            "VIN-NR" TEXT PRIMARY KEY, "MAKE-OF-CAR" TEXT, "MODEL-Short" TEXT, "MODEL-YEAR" INT,
+            key1 TEXT, key2 TEXT
+        )
+    ''')
+
+    # INSERT OR IGNORE keeps the first row for a repeated VIN
+    merged_sql = f'INSERT OR IGNORE INTO staging_merged VALUES ({", ".join("?" * (len(MERGED_DECODED_COLUMNS) + 1))})'
+    unmerged_sql = f'INSERT OR IGNORE INTO staging_unmerged VALUES ({", ".join("?" * len(UNMERGED_COLUMNS))})'
+
+    vin_decoder = VinDecoder.load()
+    for merged_df, unmerged_df, rows in iter_decoded_chunks(filename, vin_decoder, memory_budget_mb):
+        cursor.executemany(merged_sql, frame_to_rows(to_merged_admin_frame(merged_df)))
+        cursor.executemany(unmerged_sql, frame_to_rows(unmerged_df[UNMERGED_COLUMNS]))
+
+# Function to apply a VIN feed to data.db as upserts and deletes instead of a full rebuild
+def incremental_ingest(filename='vins.csv', database_path='data.db', remove_missing=True,
+                       memory_budget_mb=STREAM_MEMORY_BUDGET_MB):
+    logging.info(f'Starting incremental_ingest of {filename} into {database_path}')
+    conn = sqlite3.connect(database_path)
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type IN ('table', 'view') AND name IN ('merged_admin', 'merged_nonadmin', 'unmerged_vins')")
+    if cursor.fetchone()[0] != 3:
+        conn.close()
+        raise RuntimeError(f'{database_path} has not been built yet; run a full rebuild first')
+
+    counts = {}
+    try:
+        # Rebuilt tables lose their facet and rollup triggers, so those are recomputed afterwards
+        summaries_stale = bool(upgrade_schema(conn)) or not summaries_available(cursor)
+        stage_vin_feed(conn, filename, memory_budget_mb)
+
+        decoded = quote_columns(MERGED_DECODED_COLUMNS)
+        staged_decoded = ', '.join(f's."{col}"' for col in MERGED_DECODED_COLUMNS)
+        merged_changed = ' OR '.join(f's."{col}" IS NOT m."{col}"' for col in MERGED_DECODED_COLUMNS)
+        staged_raw = ', '.join(f's."{col}"' for col in UNMERGED_COLUMNS[1:])
+        unmerged_changed = ' OR '.join(f's."{col}" IS NOT u."{col}"' for col in UNMERGED_COLUMNS[1:])
+
+        # Removed VINs: no longer decoded in the feed, or no longer in it at all
+        if remove_missing:
+            # Rows deleted through a view's triggers are not counted in rowcount, so count them first
+            cursor.execute('SELECT COUNT(*) FROM vehicle_fact WHERE "VIN-NR" NOT IN (SELECT "VIN-NR" FROM staging_merged)')
+            counts['merged_removed'] = cursor.fetchone()[0]
+            cursor.execute('DELETE FROM merged_admin WHERE "VIN-NR" NOT IN (SELECT "VIN-NR" FROM staging_merged)')
+            cursor.execute('DELETE FROM unmerged_vins WHERE "VIN-NR" NOT IN (SELECT "VIN-NR" FROM staging_unmerged)')
+            counts['unmerged_removed'] = cursor.rowcount
+
+        # Changed VINs: update in place so Surrogate_Key and Zip stay the same
+        cursor.execute(f'''
+            SELECT {staged_decoded}, m."VIN-NR"
+            FROM staging_merged s JOIN merged_admin m ON m."VIN-NR" = s."VIN-NR"
+            WHERE {merged_changed}
+        ''')
+        changed = cursor.fetchall()
+        assignments = ', '.join(f'"{col}" = ?' for col in MERGED_DECODED_COLUMNS)
+        cursor.executemany(f'UPDATE merged_admin SET {assignments} WHERE "VIN-NR" = ?', changed)
+        counts['merged_changed'] = len(changed)
+
+        cursor.execute(f'''
+            SELECT {staged_raw}, u."VIN-NR"
+            FROM staging_unmerged s JOIN unmerged_vins u ON u."VIN-NR" = s."VIN-NR"
+            WHERE {unmerged_changed}
+        ''')
+        changed = cursor.fetchall()
+        assignments = ', '.join(f'"{col}" = ?' for col in UNMERGED_COLUMNS[1:])
+        cursor.executemany(f'UPDATE unmerged_vins SET {assignments} WHERE "VIN-NR" = ?', changed)
+        counts['unmerged_changed'] = len(changed)
+
+        # New VINs: insert with a freshly reserved block of surrogate keys
+        cursor.execute(f'''
+            SELECT s."VIN-NR", {staged_decoded} FROM staging_merged s
+            WHERE NOT EXISTS (SELECT 1 FROM merged_admin m WHERE m."VIN-NR" = s."VIN-NR")
+        ''')
+        new_rows = cursor.fetchall()
+        first_key = reserve_surrogate_keys(cursor, len(new_rows))
+        new_rows = [row + (random.randint(1, 10), first_key + i) for i, row in enumerate(new_rows)]
+        cursor.executemany(f'''
+            INSERT INTO merged_admin ("VIN-NR", {decoded}, Zip, Surrogate_Key)
+            VALUES ({", ".join("?" * (len(MERGED_DECODED_COLUMNS) + 3))})
+        ''', new_rows)
+        counts['merged_added'] = len(new_rows)
+
+        cursor.execute(f'''
+            SELECT s."VIN-NR", {staged_raw} FROM staging_unmerged s
+            WHERE NOT EXISTS (SELECT 1 FROM unmerged_vins u WHERE u."VIN-NR" = s."VIN-NR")
+        ''')
+        new_rows = cursor.fetchall()
+        first_key = reserve_surrogate_keys(cursor, len(new_rows))
+        new_rows = [row + (first_key + i,) for i, row in enumerate(new_rows)]
+        cursor.executemany(f'''
+            INSERT INTO unmerged_vins ({quote_columns(UNMERGED_COLUMNS)}, Surrogate_Key)
+            VALUES ({", ".join("?" * (len(UNMERGED_COLUMNS) + 1))})
+        ''', new_rows)
+        counts['unmerged_added'] = len(new_rows)
+
+        # Drop the models that only removed or re-decoded VINs pointed at
+        counts['models_pruned'] = prune_vehicle_models(cursor)
+
+        conn.commit()
+        if summaries_stale:
+            rebuild_summaries(conn)
+        else:
+            refresh_unlisted_facets(conn)  # Deletes may bring a high-cardinality column back under the limit
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    logging.info(f'Incremental ingest of {filename} applied: {counts}')
+    print(f"Incremental ingest complete: {counts}")
+    return counts
+
+# Function to read the decoder entries data.db's merged VINs were decoded with, from vehicle_model
+def database_decoder_entries(cursor):
+    cursor.execute(f'SELECT {quote_columns(MERGED_DECODED_COLUMNS)} FROM vehicle_model WHERE VIN_Key IS NOT NULL')
+    entries = {}
+    for row in cursor.fetchall():
+        entries.setdefault(row[MERGED_DECODED_COLUMNS.index('VIN_Key')], set()).add(row)
+    return entries
+
+# Function to list the decoder keys whose entry was added, removed or changed between two decoders
+def changed_decoder_keys(old_entries, new_entries):
+    added = new_entries.keys() - old_entries.keys()
+    removed = old_entries.keys() - new_entries.keys()
+    changed = {key for key in new_entries.keys() & old_entries.keys() if new_entries[key] not in old_entries[key]}
+    return added, removed, changed
+
+# Function to find the VINs decoded with the given keys: merged ones by VIN-NR prefix, unmerged ones by key1/key2
+def stage_refresh_keys(cursor, keys, new_entries):
+    cursor.execute('DROP TABLE IF EXISTS temp.refresh_keys')
+    cursor.execute(f'''
+        CREATE TEMP TABLE refresh_keys (
+            key1 TEXT, key1_end TEXT, key2 TEXT, decoded INT, {", ".join(f'"{col}"' for col in MERGED_DECODED_COLUMNS)},
+            PRIMARY KEY (key1, key2)
+        )
+    ''')
+    # Every VIN-NR starting with key1 sorts before key1 with its last character incremented
+    rows = [(key[:8], key[:7] + chr(ord(key[7]) + 1), key[8], key in new_entries) +
+            new_entries.get(key, (None,) * len(MERGED_DECODED_COLUMNS)) for key in keys if len(key) == 9]
+    cursor.executemany(f'INSERT OR IGNORE INTO refresh_keys VALUES ({", ".join("?" * (len(MERGED_DECODED_COLUMNS) + 4))})',
+                       rows)
+
+# Function to give rows moving between tables a new Surrogate_Key where theirs is missing or taken in the target table
+def free_surrogate_keys(cursor, rows, target_table):
+    cursor.execute(f'SELECT Surrogate_Key FROM {target_table} WHERE Surrogate_Key IN (SELECT value FROM json_each(?))',
+                   (json.dumps([row[-1] for row in rows if row[-1] is not None]),))
+    taken = {key for (key,) in cursor.fetchall()}
+    rekeyed = sum(1 for row in rows if row[-1] is None or row[-1] in taken)
+    if not rekeyed:
+        return rows
+    first_key = reserve_surrogate_keys(cursor, rekeyed)
+    new_keys = iter(range(first_key, first_key + rekeyed))
+    return [row[:-1] + (next(new_keys),) if row[-1] is None or row[-1] in taken else row for row in rows]
+
+# Function to apply a refreshed VIN_decoder.csv to data.db, touching only the VINs whose decoder entry changed.
+# The old decoder is old_decoder_path, or else the entries data.db's merged VINs were decoded with; then
+# every decoder key no merged VIN uses counts as added, and is checked against unmerged_vins by index.
+def refresh_decoder(decoder_path=DECODER_PATH, database_path='data.db', old_decoder_path=None):
+    logging.info(f'Starting refresh_decoder from {decoder_path} into {database_path}')
+    conn = sqlite3.connect(database_path)
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type IN ('table', 'view') AND name IN ('merged_admin', 'merged_nonadmin', 'unmerged_vins')")
+    if cursor.fetchone()[0] != 3:
+        conn.close()
+        raise RuntimeError(f'{database_path} has not been built yet; run a full rebuild first')
+
+    counts = {}
+    try:
+        with stage('refresh_decoder', decoder=decoder_path) as record:
+            summaries_stale = bool(upgrade_schema(conn)) or not summaries_available(cursor)
+
+            # Diff the decoders by (VIN prefix, year code); only VINs with those keys are read below
+            new_entries = VinDecoder.load(decoder_path).admin_entries()
+            if old_decoder_path is not None:
+                old_entries = {key: {entry} for key, entry in VinDecoder.load(old_decoder_path).admin_entries().items()}
+            else:
+                old_entries = database_decoder_entries(cursor)
+            added, removed, changed = changed_decoder_keys(old_entries, new_entries)
+            counts.update(keys_added=len(added), keys_removed=len(removed), keys_changed=len(changed))
+            stage_refresh_keys(cursor, added | removed | changed, new_entries)
+
+            # Merged VINs with a changed key: a range seek on VIN-NR per key
+            decoded = quote_columns(MERGED_DECODED_COLUMNS)
+            cursor.execute(f'''
+                SELECT f."VIN-NR", k.decoded, {", ".join(f'k."{col}"' for col in MERGED_DECODED_COLUMNS)},
+                       {", ".join(f'm."{col}"' for col in MERGED_DECODED_COLUMNS)}, f.Surrogate_Key
+                FROM refresh_keys k
+                JOIN vehicle_fact f ON f."VIN-NR" >= k.key1 AND f."VIN-NR" < k.key1_end
+                    AND substr(f."VIN-NR", 10, 1) = k.key2
+                JOIN vehicle_model m ON m.model_id = f.model_id
+            ''')
+            width = len(MERGED_DECODED_COLUMNS)
+            redecoded, demoted = [], []
+            for row in cursor.fetchall():
+                vin, new_values, old_values, surrogate_key = row[0], row[2:2 + width], row[2 + width:-1], row[-1]
+                if not row[1]:
+                    model_year = old_values[MERGED_DECODED_COLUMNS.index('Model_Year')]
+                    demoted.append((vin, None, None, model_year, vin[:8], vin[9], surrogate_key))
+                elif new_values != old_values:
+                    redecoded.append(new_values + (vin,))
+
+            # Re-decoded VINs are updated in place, so Surrogate_Key and Zip stay the same
+            assignments = ', '.join(f'"{col}" = ?' for col in MERGED_DECODED_COLUMNS)
+            cursor.executemany(f'UPDATE merged_admin SET {assignments} WHERE "VIN-NR" = ?', redecoded)
+            counts['merged_redecoded'] = len(redecoded)
+
+            # VINs whose key is gone move to unmerged_vins. The feed's make and model are not kept for
+            # merged VINs, so only the model year and keys are filled in.
+            cursor.executemany('DELETE FROM merged_admin WHERE "VIN-NR" = ?', [(row[0],) for row in demoted])
+            cursor.executemany(f'''
+                INSERT OR IGNORE INTO unmerged_vins ({quote_columns(UNMERGED_COLUMNS)}, Surrogate_Key)
+                VALUES ({", ".join("?" * (len(UNMERGED_COLUMNS) + 1))})
+            ''', free_surrogate_keys(cursor, demoted, 'unmerged_vins'))
+            counts['merged_demoted'] = len(demoted)
+
+            # Unmerged VINs whose key now decodes move to merged_admin, keeping their Surrogate_Key
+            cursor.execute(f'''
+                SELECT u."VIN-NR", {", ".join(f'k."{col}"' for col in MERGED_DECODED_COLUMNS)}, u.Surrogate_Key
+                FROM refresh_keys k JOIN unmerged_vins u ON u.key1 = k.key1 AND u.key2 = k.key2
+                WHERE k.decoded AND NOT EXISTS (SELECT 1 FROM vehicle_fact f WHERE f."VIN-NR" = u."VIN-NR")
+            ''')
+            promoted = [row[:-1] + (random.randint(1, 10), row[-1]) for row in cursor.fetchall()]
+            promoted = free_surrogate_keys(cursor, promoted, 'vehicle_fact')
+            cursor.executemany(f'''
+                INSERT INTO merged_admin ("VIN-NR", {decoded}, Zip, Surrogate_Key)
+                VALUES ({", ".join("?" * (len(MERGED_DECODED_COLUMNS) + 3))})
+            ''', promoted)
+            cursor.executemany('DELETE FROM unmerged_vins WHERE "VIN-NR" = ?', [(row[0],) for row in promoted])
+            counts['unmerged_promoted'] = len(promoted)
+
+            # Drop the models that only re-decoded or demoted VINs pointed at
+            counts['models_pruned'] = prune_vehicle_models(cursor)
+            cursor.execute('DROP TABLE refresh_keys')
+            record['rows'] = len(redecoded) + len(demoted) + len(promoted)
+            record.update(counts)
+
+            conn.commit()
+            if summaries_stale:
+                rebuild_summaries(conn)
+            else:
+                refresh_unlisted_facets(conn)  # Deletes may bring a high-cardinality column back under the limit
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    logging.info(f'Decoder refresh from {decoder_path} applied: {counts}')
+    print(f"Decoder refresh complete: {counts}")
+    return counts
+
+# Number of rows bulk loads write per transaction
+BULK_TRANSACTION_ROWS = 200000
+
+# PRAGMAs used while bulk loading into a freshly emptied database
+BULK_LOAD_PRAGMAS = [
+    'PRAGMA journal_mode = MEMORY',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA cache_size = -262144',  # 256 MB page cache
+    'PRAGMA temp_store = MEMORY',
+]
+
+# PRAGMAs restored once the bulk load has finished; WAL matches the UI's connections
+SAFE_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = FULL',
+    'PRAGMA cache_size = -2000',
+    'PRAGMA temp_store = DEFAULT',
+]
+
+# Function to build a writer that loads decoded batches straight into the data.db tables
+def make_target_table_writer(conn):
+    cursor = conn.cursor()
+    decoded = quote_columns(MERGED_DECODED_COLUMNS)
+    model_sql = f'''INSERT INTO vehicle_model (model_id, {decoded})
+                    VALUES ({", ".join("?" * (len(MERGED_DECODED_COLUMNS) + 1))})'''
+    # VINs are only deduped within a chunk before they get here; INSERT OR IGNORE keeps the first row
+    # for a VIN, as the legacy load does
+    fact_sql = '''INSERT OR IGNORE INTO vehicle_fact ("VIN-NR", model_id, Zip, Surrogate_Key) VALUES (?, ?, ?, ?)'''
+    unmerged_sql = f'''INSERT OR IGNORE INTO unmerged_vins ({quote_columns(UNMERGED_COLUMNS)}, Surrogate_Key)
+                       VALUES ({", ".join("?" * (len(UNMERGED_COLUMNS) + 1))})'''
+
+    # model_id of every set of decoded attributes written so far, so each decoder entry is stored once
+    cursor.execute('SELECT COALESCE(MAX(model_id), 0) FROM vehicle_model')
+    state = {'uncommitted_rows': 0, 'model_ids': {}, 'next_model_id': cursor.fetchone()[0] + 1}
+
+    def model_ids_for(model_rows):
+        model_ids, new_models = [], []
+        for model in model_rows:
+            model_id = state['model_ids'].get(model)
+            if model_id is None:
+                model_id = state['next_model_id']
+                state['next_model_id'] += 1
+                state['model_ids'][model] = model_id
+                new_models.append((model_id,) + model)
+            model_ids.append(model_id)
+        cursor.executemany(model_sql, new_models)
+        return model_ids
+
+    def write_batch(merged_df, unmerged_df):
+        admin_df = to_merged_admin_frame(merged_df).reset_index(drop=True)
+        unmerged_df = unmerged_df[UNMERGED_COLUMNS].reset_index(drop=True)
+
+        # One key reservation per batch covers both tables
+        key_start = reserve_surrogate_keys(cursor, len(admin_df) + len(unmerged_df))
+        admin_df['Zip'] = np.random.randint(1, 11, size=len(admin_df))
+        admin_df['Surrogate_Key'] = np.arange(key_start, key_start + len(admin_df))
+        key_start += len(admin_df)
+        unmerged_df['Surrogate_Key'] = np.arange(key_start, key_start + len(unmerged_df))
+
+        model_ids = model_ids_for(frame_to_rows(admin_df[MERGED_DECODED_COLUMNS]))
+        cursor.executemany(fact_sql, zip(admin_df['VIN-NR'], model_ids, admin_df['Zip'].tolist(),
+                                         admin_df['Surrogate_Key'].tolist()))
+        cursor.executemany(unmerged_sql, frame_to_rows(unmerged_df))
+
+        # Commit in large transactions rather than per batch
+        state['uncommitted_rows'] += len(admin_df) + len(unmerged_df)
+        if state['uncommitted_rows'] >= BULK_TRANSACTION_ROWS:
+            conn.commit()
+            state['uncommitted_rows'] = 0
+
+    return write_batch
+
+# Function to decode VIN feeds directly into data.db, skipping the CSV files and staging databases
+def bulk_load(feed_files=('vins.csv',), database_path='data.db', workers=None,
+              memory_budget_mb=STREAM_MEMORY_BUDGET_MB):
+    logging.info(f'Starting bulk_load of {len(feed_files)} files into {database_path}')
+    start = time.perf_counter()
+    empty_database(database_path)
+
+    conn = sqlite3.connect(database_path)
+    cursor = conn.cursor()
+    try:
+        for pragma in BULK_LOAD_PRAGMAS:
+            cursor.execute(pragma)
+        create_tables(cursor)
+        writer = make_target_table_writer(conn)
+
+        if workers and workers > 1:
+            parallel_ingest(list(feed_files), writer, workers, memory_budget_mb)
+        else:
+            # Decode in-process; the keyed tables drop VINs repeated across chunks and files
+            vin_decoder = VinDecoder.load()
+            for filename in feed_files:
+                for merged_df, unmerged_df, rows in iter_decoded_chunks(filename, vin_decoder, memory_budget_mb):
+                    writer(merged_df, unmerged_df)
+        conn.commit()
+
+        # Secondary indexes, facets and rollups are cheaper to build once than to maintain row by row
+        create_indexes(cursor)
+        conn.commit()
+        rebuild_summaries(conn)
+    finally:
+        # A failed batch leaves its transaction open, and synchronous cannot be changed inside one
+        try:
+            conn.rollback()
+            for pragma in SAFE_PRAGMAS:
+                cursor.execute(pragma)
+        finally:
+            conn.close()
+
+    elapsed = time.perf_counter() - start
+    logging.info(f'bulk_load finished in {elapsed:.2f}s')
+    print(f"Bulk load into {database_path} complete in {elapsed:.2f}s.")
+    return elapsed
+
+# Function to copy a VIN feed, repeating its first matched and first unmatched VIN so duplicates are exercised
+def write_feed_with_duplicates(feed_file, vin_decoder, output_file):
+    vin_data = pd.read_csv(feed_file)
+    merged_df, unmerged_df = vin_decoder.decode_frame(vin_data)
+    repeated = [df['VIN-NR'].iloc[0] for df in (merged_df, unmerged_df) if len(df)]
+    duplicates = vin_data[vin_data['VIN-NR'].isin(repeated)].drop_duplicates(subset=['VIN-NR'])
+    pd.concat([vin_data, duplicates], ignore_index=True).to_csv(output_file, index=False)
+
+# Function to read the loaded rows of data.db, leaving out the random Zip and the surrogate keys
+def loaded_tables(database_path='data.db'):
+    conn = sqlite3.connect(database_path)
+    cursor = conn.cursor()
+    tables = {}
+    for table_name in ('merged_admin', 'unmerged_vins'):
+        cursor.execute(f'PRAGMA table_info({table_name})')
+        columns = [row[1] for row in cursor.fetchall() if row[1] not in ('Zip', 'Surrogate_Key')]
+        cursor.execute(f'SELECT {quote_columns(columns)} FROM {table_name} ORDER BY "VIN-NR"')
+        tables[table_name] = cursor.fetchall()
+    conn.close()
+    return tables
+
+# Function to time the original CSV/three-database path against bulk_load on the same feed, as the median of several runs
+def compare_load_paths(feed_file='vins.csv', decoder_file='VIN_decoder.csv', repeats=3):
+    feed_file = os.path.abspath(feed_file)
+    decoder_file = os.path.abspath(decoder_file)
+    original_directory = os.getcwd()
+    runs = {'legacy': [], 'bulk': []}
+    tables = {}
+
+    # The paths take turns, so a slow patch on the machine does not land on one path only
+    for _ in range(repeats):
+        for path_name in runs:
+            with tempfile.TemporaryDirectory() as work_directory:
+                # Each run gets a private working directory; the decoder cache is warmed outside the timing
+                os.chdir(work_directory)
+                try:
+                    shutil.copy(decoder_file, 'VIN_decoder.csv')
+                    write_feed_with_duplicates(feed_file, VinDecoder.load(), 'vins.csv')
+
+                    start = time.perf_counter()
+                    if path_name == 'legacy':
+                        main()
+                        copy_data_to_target_database_with_surrogate_key()
+                        cleanup_databases()
+                    else:
+                        bulk_load(['vins.csv'])
+                    runs[path_name].append(time.perf_counter() - start)
+                    tables[path_name] = loaded_tables()
+                finally:
+                    os.chdir(original_directory)
+
+        # Both paths must store the same rows, repeated VINs included
+        for table_name in tables['legacy']:
+            if tables['legacy'][table_name] != tables['bulk'][table_name]:
+                raise RuntimeError(f'The legacy path and bulk_load produced different {table_name} rows')
+
+    timings = {path_name: statistics.median(seconds) for path_name, seconds in runs.items()}
+    saved = timings['legacy'] - timings['bulk']
+    percent = 100 * saved / timings['legacy'] if timings['legacy'] > 0 else 0.0
+    logging.info(f'Load path comparison: {runs}')
+    print(f"Legacy path: {timings['legacy']:.2f}s, bulk load: {timings['bulk']:.2f}s, "
+          f"saved {saved:.2f}s ({percent:.0f}%), median of {repeats} runs")
+    return timings
+
 # Main function to perform data processing and database operations
-def main():
+def main(stream=False, memory_budget_mb=STREAM_MEMORY_BUDGET_MB, feed_files=None, workers=None):
     # Empty the target databases
     empty_database('merged_data.db')
     empty_database('unmerged_data.db')
     empty_database('data.db')
 
     directory = '.'
-    process_file('vins.csv')
+    if feed_files or workers:
+        # Decode the feed files in parallel; batches go straight into the source tables
+        create_database('merged_data.db')
+        create_database('unmerged_data.db')
+        import_feeds_in_parallel(feed_files or ['vins.csv'], workers, memory_budget_mb)
+    else:
+        if stream:
+            process_file_chunked('vins.csv', memory_budget_mb)
+        else:
+            process_file('vins.csv')
 
-    # Drop specified columns in CSV files
-    drop_column_in_files(directory, 'merged_small_file_vins_*.xlsx', 3, 'MODEL')
-    drop_column_in_files(directory, 'unmerged_small_file*.xlsx', 9, 'Model')
+        # Drop specified columns in CSV files
+        drop_column_in_files(directory, 'merged_small_file_vins_*.xlsx', 3, 'MODEL')
+        drop_column_in_files(directory, 'unmerged_small_file*.xlsx', 9, 'Model')
 
-    # Create target databases
-    create_database('merged_data.db')
-    create_database('unmerged_data.db')
+        # Create target databases
+        create_database('merged_data.db')
+        create_database('unmerged_data.db')
 
-    # Import data from CSV files to target databases
-    import_to_db(directory, 'merged_', 'merged_data.db')
-    import_to_db(directory, 'unmerged_', 'unmerged_data.db')
+        # Import data from CSV files to target databases
+        import_to_db(directory, 'merged_', 'merged_data.db')
+        import_to_db(directory, 'unmerged_', 'unmerged_data.db')
 
-    # Remove original CSV files
-    remove_file('merged_vins.csv')
-    remove_file('unmerged_vins.csv')
+        # Remove original CSV files
+        remove_file('merged_vins.csv')
+        remove_file('unmerged_vins.csv')
 
     # Connect to the merged_data.db database
     conn = sqlite3.connect('merged_data.db')
     cursor = conn.cursor()
 
-    # Create 'merged_admin' table with surrogate key
+    # Create the 'merged_admin' view and its tables with surrogate keys
     create_merged_admin_table(cursor)
     conn.commit()
 
-    # Create 'merged_nonadmin' table with the same surrogate key
+    # Create the 'merged_nonadmin' view over merged_admin
     create_merged_nonadmin_table(cursor)
     conn.commit()
 
     conn.close()
     print("Processing complete.")
 
+# Function to parse the command line options
+def parse_args():
+    parser = argparse.ArgumentParser(description='Rebuild the vehicle databases from vins.csv')
+    parser.add_argument('--stream', action='store_true',
+                        help='decode the VIN file in chunks instead of loading it all at once')
+    parser.add_argument('--incremental', metavar='FEED', nargs='?', const='vins.csv',
+                        help='apply a VIN feed (default: vins.csv) to data.db as upserts and deletes')
+    parser.add_argument('--keep-missing', action='store_true',
+                        help='with --incremental, keep VINs that are absent from the feed')
+    parser.add_argument('--bulk', action='store_true',
+                        help='decode the feeds straight into data.db instead of going through CSV files')
+    parser.add_argument('--compare-load-paths', metavar='FEED', nargs='?', const='vins.csv',
+                        help='time the original load path against --bulk on a feed (default: vins.csv)')
+    parser.add_argument('--refresh-decoder', metavar='DECODER', nargs='?', const=DECODER_PATH,
+                        help='apply a refreshed decoder (default: VIN_decoder.csv) to data.db, re-decoding only '
+                             'the VINs whose decoder entry changed')
+    parser.add_argument('--old-decoder', metavar='DECODER',
+                        help='with --refresh-decoder, the decoder data.db was built with (default: read from data.db)')
+    parser.add_argument('--upgrade-schema', action='store_true',
+                        help='add the declared keys and indexes to an existing data.db')
+    parser.add_argument('--feeds', metavar='PATTERN', nargs='+',
+                        help='VIN feed files or glob patterns to decode in parallel (default: vins.csv)')
+    parser.add_argument('--workers', type=int,
+                        help='number of decoding processes for --feeds (default: one per CPU core)')
+    parser.add_argument('--memory-budget-mb', type=int, default=STREAM_MEMORY_BUDGET_MB,
+                        help='peak memory budget for chunked decoding (default: %(default)s)')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='JSON-lines file to append stage timings and memory to (default: metrics.jsonl)')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also record the Python allocation peak of each stage (slower)')
+    args = parser.parse_args()
+    if args.feeds:
+        args.feeds = sorted({path for pattern in args.feeds for path in (glob.glob(pattern) or [pattern])})
+    return args
+
 # Entry point of the script
 if __name__ == "__main__":
-    main()  # Run the main function to process and create databases
-    copy_data_to_target_database_with_surrogate_key()  # Run the data copying function with surrogate key
-    cleanup_databases()  # Run the cleanup function
+    args = parse_args()
+    configure(metrics_path=args.metrics, trace_memory=args.trace_memory)
+    if args.incremental:
+        incremental_ingest(args.incremental, remove_missing=not args.keep_missing,
+                           memory_budget_mb=args.memory_budget_mb)  # Apply only the differences to data.db
+    elif args.refresh_decoder:
+        refresh_decoder(args.refresh_decoder, old_decoder_path=args.old_decoder)  # Re-decode only the changed keys
+    elif args.upgrade_schema:
+        conn = sqlite3.connect('data.db')
+        upgraded = upgrade_schema(conn)
+        print(f"Upgraded tables: {upgraded}")  # Add keys and indexes in place
+        rebuild_summaries(conn)
+        if 'merged_nonadmin' in upgraded:
+            conn.execute('VACUUM')  # Return the pages of the old merged_nonadmin copy to the file system
+        conn.close()
+    elif args.compare_load_paths:
+        compare_load_paths(args.compare_load_paths)  # Time the original path against the bulk loader
+    elif args.bulk:
+        bulk_load(args.feeds or ['vins.csv'], workers=args.workers,
+                  memory_budget_mb=args.memory_budget_mb)  # Load straight into data.db
+    else:
+        main(args.stream, args.memory_budget_mb, args.feeds, args.workers)  # Run the main function to process and create databases
+        copy_data_to_target_database_with_surrogate_key()  # Run the data copying function with surrogate key
+        cleanup_databases()  # Run the cleanup function
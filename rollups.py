@@ -0,0 +1,114 @@
+import logging
+
+from query_builder import count_query, quote_identifier, table_columns
+from schema import source_table, trigger_timing
+
+# Dimensions of the count cube that the graph dialog's GROUP BY queries are answered from
+ROLLUP_DIMENSIONS = ['Technology', 'Make', 'Model_Year', 'Zip', 'Vehicle_Category']
+
+# Tables that have a count cube
+ROLLUP_TABLES = ['merged_nonadmin']
+
+
+def rollup_table_name(table_name):
+    """Returns the name of the count cube for a table."""
+    return f'rollup_{table_name}'
+
+
+def rollup_available(cursor, table_name):
+    """Returns True if the table has a built count cube."""
+    if table_name not in ROLLUP_TABLES:
+        return False
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=?", (rollup_table_name(table_name),))
+    return cursor.fetchone()[0] > 0
+
+
+def dimension_match(row_alias):
+    """Returns a NULL-safe condition matching the cube row for a NEW or OLD base row."""
+    return ' AND '.join(f'{quote_identifier(dim)} IS {row_alias}.{quote_identifier(dim)}' for dim in ROLLUP_DIMENSIONS)
+
+
+def rollup_trigger_statements(cube_name, row_alias, delta):
+    """Returns the statements that add delta to the cube cell of a NEW or OLD base row."""
+    match = dimension_match(row_alias)
+    statements = []
+    if delta > 0:
+        dimensions = ', '.join(quote_identifier(dim) for dim in ROLLUP_DIMENSIONS)
+        values = ', '.join(f'{row_alias}.{quote_identifier(dim)}' for dim in ROLLUP_DIMENSIONS)
+        statements.append(f'''
+            INSERT INTO {cube_name} ({dimensions}, row_count)
+            SELECT {values}, 0 WHERE NOT EXISTS (SELECT 1 FROM {cube_name} WHERE {match});''')
+    statements.append(f'UPDATE {cube_name} SET row_count = row_count + ({delta}) WHERE {match};')
+    if delta < 0:
+        statements.append(f'DELETE FROM {cube_name} WHERE {match} AND row_count <= 0;')
+    return statements
+
+
+def drop_rollup_triggers(cursor, table_name):
+    """Drops the triggers that maintain a table's count cube."""
+    for event in ('insert', 'delete', 'update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS rollup_{table_name}_{event}')
+
+
+def rebuild_rollups(conn, tables=ROLLUP_TABLES):
+    """Recomputes the count cubes from their base tables and reinstalls their triggers; run after ingest."""
+    cursor = conn.cursor()
+    dimensions = ', '.join(quote_identifier(dim) for dim in ROLLUP_DIMENSIONS)
+
+    for table_name in tables:
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type IN ('table', 'view') AND name=?", (table_name,))
+        if cursor.fetchone()[0] == 0:
+            continue
+
+        cube_name = rollup_table_name(table_name)
+        drop_rollup_triggers(cursor, table_name)
+        cursor.execute(f'DROP TABLE IF EXISTS {cube_name}')
+
+        # Cube columns keep the base column types, so bound filter values compare the same way
+        column_types = dict(table_columns(cursor, table_name))
+        definitions = ', '.join(f'{quote_identifier(dim)} {column_types[dim]}' for dim in ROLLUP_DIMENSIONS)
+        cursor.execute(f'CREATE TABLE {cube_name} ({definitions}, row_count INTEGER NOT NULL)')
+        cursor.execute(f'''
+            INSERT INTO {cube_name} ({dimensions}, row_count)
+            SELECT {dimensions}, COUNT(*) FROM {table_name} GROUP BY {dimensions}
+        ''')
+        cursor.execute(f'CREATE INDEX idx_{cube_name}_cell ON {cube_name} ({dimensions})')
+
+        # A view's cube is kept by triggers on the table or view it is written through
+        base_table = source_table(table_name)
+        timing = trigger_timing(base_table)
+
+        cursor.execute(f'''
+            CREATE TRIGGER rollup_{table_name}_insert {timing} INSERT ON {base_table}
+            BEGIN {' '.join(rollup_trigger_statements(cube_name, 'NEW', 1))} END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER rollup_{table_name}_delete {timing} DELETE ON {base_table}
+            BEGIN {' '.join(rollup_trigger_statements(cube_name, 'OLD', -1))} END
+        ''')
+        changed = ' OR '.join(f'OLD.{quote_identifier(dim)} IS NOT NEW.{quote_identifier(dim)}' for dim in ROLLUP_DIMENSIONS)
+        cursor.execute(f'''
+            CREATE TRIGGER rollup_{table_name}_update {timing} UPDATE OF {dimensions} ON {base_table}
+            WHEN {changed}
+            BEGIN {' '.join(rollup_trigger_statements(cube_name, 'OLD', -1) + rollup_trigger_statements(cube_name, 'NEW', 1))} END
+        ''')
+
+        cursor.execute(f'SELECT COUNT(*) FROM {cube_name}')
+        logging.info(f'Rebuilt rollup cube {cube_name} with {cursor.fetchone()[0]} cells')
+
+    conn.commit()
+
+
+def grouped_counts(cursor, table_name, group_column, filters=None):
+    """Returns [(value, count)] for SELECT group_column, COUNT(*) ... WHERE filters GROUP BY group_column.
+
+    The query is answered from the table's count cube when the cube covers both the grouping
+    and the filter columns, and from the base table otherwise.
+    """
+    covered = group_column in ROLLUP_DIMENSIONS and all(col in ROLLUP_DIMENSIONS for col in filters or {})
+    if covered and rollup_available(cursor, table_name):
+        source, count_expression = rollup_table_name(table_name), 'SUM(row_count)'
+    else:
+        source, count_expression = table_name, 'COUNT(*)'
+    cursor.execute(*count_query(cursor, table_name, filters, group_column, source, count_expression))
+    return cursor.fetchall()
@@ -0,0 +1,323 @@
+import logging
+
+from key_allocator import create_sequence_table, reserve_surrogate_keys, sync_sequence
+
+# Decoded vehicle attributes, which merged_admin rows share through the vehicle_model dimension
+MODEL_COLUMNS = ['Vehicle Name', 'Make', 'Model_full', 'Vehicle_Manufacturer', 'Technology', 'Model_Year',
+                 'Date_Added', 'Date_Updated', 'VIN_Key', 'Vehicle_Category', 'Vehicle_Use_Case', 'Vehicle_Class']
+
+# Declared layout of the vehicle tables in data.db. Decoded VINs are stored as a star:
+# vehicle_model holds one row per decoder entry (VIN_Key), plus one per hand-edited set of
+# attributes, and vehicle_fact holds one slim row per VIN pointing at its model. unmerged_vins
+# is keyed on VIN-NR and Surrogate_Key.
+TABLE_DEFINITIONS = {
+    'vehicle_model': '''
+        CREATE TABLE vehicle_model (
+            model_id INTEGER PRIMARY KEY,
+            "Vehicle Name" TEXT,
+            Make TEXT,
+            Model_full TEXT,
+            Vehicle_Manufacturer TEXT,
+            Technology TEXT,
+            Model_Year INT,
+            Date_Added TEXT,
+            Date_Updated TEXT,
+            VIN_Key TEXT,
+            Vehicle_Category TEXT,
+            Vehicle_Use_Case TEXT,
+            Vehicle_Class TEXT
+        )
+    ''',
+    'vehicle_fact': '''
+        CREATE TABLE vehicle_fact (
+            "VIN-NR" TEXT PRIMARY KEY,
+            model_id INTEGER NOT NULL REFERENCES vehicle_model (model_id),
+            Zip INT,
+            Surrogate_Key INTEGER NOT NULL UNIQUE
+        )
+    ''',
+    'unmerged_vins': '''
+        CREATE TABLE unmerged_vins (
+            "VIN-NR" TEXT PRIMARY KEY,
+            "MAKE-OF-CAR" TEXT,
+            "MODEL-Short" TEXT,
+            "MODEL-YEAR" INT,
+            key1 TEXT,
+            key2 TEXT,
+            Surrogate_Key INTEGER UNIQUE
+        )
+    ''',
+}
+
+# Tables that together store the rows of merged_admin
+MERGED_TABLES = ['vehicle_model', 'vehicle_fact']
+
+# Views over the vehicle tables, keeping the column layouts the application has always used.
+# merged_admin is written through its INSTEAD OF triggers. merged_nonadmin is the guest
+# projection; it reads the star directly, so it never references VIN-NR even indirectly.
+VIEW_DEFINITIONS = {
+    'merged_admin': '''
+        CREATE VIEW merged_admin AS
+        SELECT f."VIN-NR", m."Vehicle Name", m.Make, m.Model_full, m.Vehicle_Manufacturer, m.Technology,
+               m.Model_Year, m.Date_Added, m.Date_Updated, m.VIN_Key, m.Vehicle_Category, m.Vehicle_Use_Case,
+               m.Vehicle_Class, f.Zip, f.Surrogate_Key
+        FROM vehicle_fact f JOIN vehicle_model m ON m.model_id = f.model_id
+    ''',
+    'merged_nonadmin': '''
+        CREATE VIEW merged_nonadmin AS
+        SELECT f.Surrogate_Key, m."Vehicle Name", m.Make, m.Model_full, m.Vehicle_Manufacturer, m.Technology,
+               m.Model_Year, m.Date_Added, m.Date_Updated, m.VIN_Key, m.Vehicle_Category, m.Vehicle_Use_Case,
+               m.Vehicle_Class, f.Zip
+        FROM vehicle_fact f JOIN vehicle_model m ON m.model_id = f.model_id
+    ''',
+}
+
+# The table or view each view's rows are written through; triggers for a view live on it
+VIEW_SOURCES = {'merged_nonadmin': 'merged_admin'}
+
+# The tables each view reads, whose indexes serve the view's queries
+VIEW_TABLES = {
+    'merged_admin': MERGED_TABLES,
+    'merged_nonadmin': MERGED_TABLES,
+}
+
+# Secondary indexes on the columns the export and graph dialogs filter and group by, plus the
+# high-cardinality columns their type-ahead dropdowns search by prefix
+SECONDARY_INDEXES = {
+    'vehicle_model': ['VIN_Key', 'Make', 'Technology', 'Model_Year', 'Vehicle_Category'],
+    'vehicle_fact': ['model_id', 'Zip'],
+    'unmerged_vins': ['MAKE-OF-CAR', 'MODEL-YEAR', 'MODEL-Short', 'key1'],
+}
+
+
+def index_name(table_name, column):
+    """Returns the name used for the secondary index on a column."""
+    return f"idx_{table_name}_{column.lower().replace('-', '_').replace(' ', '_')}"
+
+
+def source_table(table_name):
+    """Returns the table or view that a view's rows are written through, or the table itself."""
+    return VIEW_SOURCES.get(table_name, table_name)
+
+
+def stored_tables(table_name):
+    """Returns the tables that hold a view's rows, or just the table itself."""
+    return VIEW_TABLES.get(table_name, [table_name])
+
+
+def trigger_timing(table_name):
+    """Returns when a trigger on the table or view sees a write: views only have INSTEAD OF triggers."""
+    return 'INSTEAD OF' if table_name in VIEW_DEFINITIONS else 'AFTER'
+
+
+def model_match(row_alias, model_alias='vehicle_model'):
+    """Returns a NULL-safe condition matching the vehicle_model row with a merged row's attributes."""
+    # VIN_Key leads, so the lookup seeks on its index and compares the rest within one decoder entry
+    columns = ['VIN_Key'] + [col for col in MODEL_COLUMNS if col != 'VIN_Key']
+    return ' AND '.join(f'{model_alias}."{col}" IS {row_alias}."{col}"' for col in columns)
+
+
+def model_insert(row_alias):
+    """Returns a statement adding a merged row's attributes to vehicle_model unless they are there already."""
+    columns = ', '.join(f'"{col}"' for col in MODEL_COLUMNS)
+    values = ', '.join(f'{row_alias}."{col}"' for col in MODEL_COLUMNS)
+    return f'''
+        INSERT INTO vehicle_model ({columns})
+        SELECT {values} WHERE NOT EXISTS (SELECT 1 FROM vehicle_model WHERE {model_match(row_alias)})'''
+
+
+def model_lookup(row_alias):
+    """Returns a scalar subquery giving the model_id for a merged row's attributes."""
+    return f'(SELECT model_id FROM vehicle_model WHERE {model_match(row_alias)} ORDER BY model_id LIMIT 1)'
+
+
+def create_write_triggers(cursor):
+    """Creates the INSTEAD OF triggers that turn writes to merged_admin into writes to the star."""
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS merged_admin_insert INSTEAD OF INSERT ON merged_admin
+        BEGIN
+            {model_insert('NEW')};
+            INSERT INTO vehicle_fact ("VIN-NR", model_id, Zip, Surrogate_Key)
+            VALUES (NEW."VIN-NR", {model_lookup('NEW')}, NEW.Zip, NEW.Surrogate_Key);
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS merged_admin_update INSTEAD OF UPDATE ON merged_admin
+        BEGIN
+            {model_insert('NEW')};
+            UPDATE vehicle_fact SET "VIN-NR" = NEW."VIN-NR", model_id = {model_lookup('NEW')},
+                Zip = NEW.Zip, Surrogate_Key = NEW.Surrogate_Key
+            WHERE "VIN-NR" = OLD."VIN-NR";
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS merged_admin_delete INSTEAD OF DELETE ON merged_admin
+        BEGIN
+            DELETE FROM vehicle_fact WHERE "VIN-NR" = OLD."VIN-NR";
+        END
+    ''')
+
+
+def create_merged_tables(cursor):
+    """Creates the star tables behind merged_admin, the merged_admin view and its write triggers."""
+    for table_name in MERGED_TABLES:
+        cursor.execute(TABLE_DEFINITIONS[table_name])
+    cursor.execute(VIEW_DEFINITIONS['merged_admin'])
+    create_write_triggers(cursor)
+
+
+def create_tables(cursor):
+    """Creates the vehicle tables with their declared keys and views, plus the key sequence."""
+    for table_name, definition in TABLE_DEFINITIONS.items():
+        cursor.execute(definition)
+    for view_name, definition in VIEW_DEFINITIONS.items():
+        cursor.execute(definition)
+    create_write_triggers(cursor)
+    create_sequence_table(cursor)
+
+
+def load_merged_rows(cursor, source_query, params=()):
+    """Adds rows in the merged_admin layout from a query, keeping the first row for a repeated key.
+
+    This is the set-based form of the merged_admin insert trigger, for loads and upgrades: each
+    distinct set of attributes becomes one vehicle_model row, then every VIN gets one fact row.
+    Returns the number of VINs added.
+    """
+    cursor.execute('DROP TABLE IF EXISTS temp.merged_load')
+    cursor.execute(f'CREATE TEMP TABLE merged_load AS {source_query}', params)
+
+    columns = ', '.join(f'"{col}"' for col in MODEL_COLUMNS)
+    values = ', '.join(f's."{col}"' for col in MODEL_COLUMNS)
+    cursor.execute(f'''
+        INSERT INTO vehicle_model ({columns})
+        SELECT DISTINCT {values} FROM merged_load s
+        WHERE NOT EXISTS (SELECT 1 FROM vehicle_model WHERE {model_match('s')})
+    ''')
+    cursor.execute(f'''
+        INSERT OR IGNORE INTO vehicle_fact ("VIN-NR", model_id, Zip, Surrogate_Key)
+        SELECT s."VIN-NR", {model_lookup('s')}, s.Zip, s.Surrogate_Key FROM merged_load s ORDER BY s.rowid
+    ''')
+    loaded = cursor.rowcount
+    cursor.execute('DROP TABLE merged_load')
+    return loaded
+
+
+def prune_vehicle_models(cursor):
+    """Deletes vehicle_model rows that no VIN points at any more and returns how many there were."""
+    cursor.execute('''
+        DELETE FROM vehicle_model
+        WHERE NOT EXISTS (SELECT 1 FROM vehicle_fact f WHERE f.model_id = vehicle_model.model_id)
+    ''')
+    return cursor.rowcount
+
+
+def create_indexes(cursor):
+    """Creates the secondary indexes; done after bulk loads so the load does not maintain them."""
+    for table_name, columns in SECONDARY_INDEXES.items():
+        for column in columns:
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {index_name(table_name, column)} ON {table_name} ("{column}")')
+
+
+def object_type(cursor, name):
+    """Returns 'table' or 'view' for an existing table or view, or None."""
+    cursor.execute("SELECT type FROM sqlite_master WHERE name=? AND type IN ('table', 'view')", (name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def matches_definition(cursor, table_name):
+    """Returns True if the table or view exists and was created from its current declared definition."""
+    if table_name in VIEW_DEFINITIONS:
+        object_type, definition = 'view', VIEW_DEFINITIONS[table_name]
+    else:
+        object_type, definition = 'table', TABLE_DEFINITIONS[table_name]
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type=? AND name=?", (object_type, table_name))
+    row = cursor.fetchone()
+    return row is not None and row[0].split() == definition.split()
+
+
+def drop_table_or_view(cursor, name):
+    """Drops whichever kind of schema object currently has the name."""
+    existing_type = object_type(cursor, name)
+    if existing_type is not None:
+        cursor.execute(f'DROP {existing_type.upper()} {name}')
+
+
+def rekey_duplicate_surrogate_keys(cursor, table_name):
+    """Gives rows that share a Surrogate_Key (or have none) fresh keys, keeping the first row's key."""
+    cursor.execute(f'''
+        SELECT rowid FROM {table_name}
+        WHERE Surrogate_Key IS NULL
+           OR rowid NOT IN (SELECT MIN(rowid) FROM {table_name} GROUP BY Surrogate_Key)
+        ORDER BY rowid
+    ''')
+    duplicate_rows = [row[0] for row in cursor.fetchall()]
+    if duplicate_rows:
+        first_key = reserve_surrogate_keys(cursor, len(duplicate_rows))
+        cursor.executemany(f'UPDATE {table_name} SET Surrogate_Key = ? WHERE rowid = ?',
+                           [(first_key + i, rowid) for i, rowid in enumerate(duplicate_rows)])
+    return len(duplicate_rows)
+
+
+def upgrade_schema(conn):
+    """Rebuilds tables that predate the declared, keyed layout and syncs the key sequence."""
+    cursor = conn.cursor()
+    sync_sequence(cursor)
+    upgraded = []
+
+    if not matches_definition(cursor, 'merged_admin'):
+        # merged_nonadmin reads the same rows, so it is recreated below once they have moved
+        drop_table_or_view(cursor, 'merged_nonadmin')
+        rebuild_merged_admin(cursor)
+        upgraded.append('merged_admin')
+
+    if not matches_definition(cursor, 'merged_nonadmin'):
+        # Older builds kept merged_nonadmin as a second copy of merged_admin; it is now a view
+        drop_table_or_view(cursor, 'merged_nonadmin')
+        cursor.execute(VIEW_DEFINITIONS['merged_nonadmin'])
+        upgraded.append('merged_nonadmin')
+
+    if not matches_definition(cursor, 'unmerged_vins'):
+        # Older builds gave every unmerged row the same Surrogate_Key
+        rekey_duplicate_surrogate_keys(cursor, 'unmerged_vins')
+        rebuild_table(cursor, 'unmerged_vins')
+        upgraded.append('unmerged_vins')
+
+    create_indexes(cursor)
+    conn.commit()
+    if upgraded:
+        logging.info(f'Upgraded tables to the declared schema: {upgraded}')
+    return upgraded
+
+
+def rebuild_merged_admin(cursor):
+    """Moves merged_admin rows from an older single-table layout into the vehicle_model/vehicle_fact star."""
+    legacy = object_type(cursor, 'merged_admin') == 'table'
+    if legacy:
+        # Older builds drew Surrogate_Key from RANDOM(), so colliding rows need fresh keys first
+        rekey_duplicate_surrogate_keys(cursor, 'merged_admin')
+        cursor.execute('ALTER TABLE merged_admin RENAME TO merged_admin_legacy')
+    else:
+        drop_table_or_view(cursor, 'merged_admin')
+
+    for table_name in MERGED_TABLES:
+        if object_type(cursor, table_name) is None:
+            cursor.execute(TABLE_DEFINITIONS[table_name])
+    cursor.execute(VIEW_DEFINITIONS['merged_admin'])
+    create_write_triggers(cursor)
+
+    if legacy:
+        columns = ', '.join(f'"{col}"' for col in ['VIN-NR'] + MODEL_COLUMNS + ['Zip', 'Surrogate_Key'])
+        load_merged_rows(cursor, f'SELECT {columns} FROM merged_admin_legacy ORDER BY rowid')
+        cursor.execute('DROP TABLE merged_admin_legacy')
+
+
+def rebuild_table(cursor, table_name):
+    """Copies a table into its declared definition, keeping the first row for a repeated key."""
+    legacy_name = f'{table_name}_legacy'
+    cursor.execute(f'ALTER TABLE {table_name} RENAME TO {legacy_name}')
+    cursor.execute(TABLE_DEFINITIONS[table_name])
+    cursor.execute(f'PRAGMA table_info({table_name})')
+    columns = ', '.join(f'"{row[1]}"' for row in cursor.fetchall())
+    cursor.execute(f'INSERT OR IGNORE INTO {table_name} ({columns}) SELECT {columns} FROM {legacy_name} ORDER BY rowid')
+    cursor.execute(f'DROP TABLE {legacy_name}')
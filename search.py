@@ -0,0 +1,189 @@
+import json
+import logging
+import sqlite3
+
+from query_builder import quote_identifier, table_columns
+
+# Full-text index over the vehicle names, kept on vehicle_model so each name is indexed once
+# however many VINs share it; matches are joined to vehicle_fact's model_id index
+SEARCH_INDEX = 'vehicle_search'
+SEARCH_COLUMNS = ['Vehicle Name', 'Model_full']
+
+# Tables whose entries can be found by name, and by a VIN-NR prefix (guests cannot read VIN-NR)
+NAME_SEARCH_TABLES = ['merged_admin', 'merged_nonadmin']
+VIN_SEARCH_TABLES = ['merged_admin', 'unmerged_vins']
+
+# Results per page unless the caller asks for fewer
+SEARCH_PAGE_ROWS = 50
+MAX_SEARCH_PAGE_ROWS = 1000
+
+
+def fts5_available(cursor):
+    """Returns True if this SQLite build has the FTS5 extension."""
+    try:
+        cursor.execute('CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(probe)')
+        cursor.execute('DROP TABLE temp.fts5_probe')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def search_index_built(cursor):
+    """Returns True if the full-text index exists."""
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=?", (SEARCH_INDEX,))
+    return cursor.fetchone()[0] > 0
+
+
+def search_available(cursor):
+    """Returns True if name searches are served from the index, or have to scan because FTS5 is missing."""
+    return search_index_built(cursor) or not fts5_available(cursor)
+
+
+def drop_search_index(cursor):
+    """Drops the full-text index and the triggers that maintain it."""
+    for event in ('insert', 'delete', 'update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {SEARCH_INDEX}_{event}')
+    cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_INDEX}')
+
+
+def rebuild_search(conn):
+    """Rebuilds the full-text index over vehicle_model and reinstalls its triggers; run after ingest.
+
+    The index stores no copy of the names (vehicle_model is its content table), and the
+    triggers keep it in step with every insert, update and delete of a model. Without FTS5 the
+    index is skipped and name searches scan vehicle_model instead.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='vehicle_model'")
+    if cursor.fetchone()[0] == 0:
+        return
+    drop_search_index(cursor)
+    if not fts5_available(cursor):
+        logging.warning('SQLite has no FTS5; name searches will scan vehicle_model')
+        conn.commit()
+        return
+
+    columns = ', '.join(quote_identifier(col) for col in SEARCH_COLUMNS)
+    new_values = ', '.join(f'NEW.{quote_identifier(col)}' for col in SEARCH_COLUMNS)
+    old_values = ', '.join(f'OLD.{quote_identifier(col)}' for col in SEARCH_COLUMNS)
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE {SEARCH_INDEX} USING fts5({columns}, content='vehicle_model',
+            content_rowid='model_id', tokenize='unicode61 remove_diacritics 2')
+    ''')
+    cursor.execute(f"INSERT INTO {SEARCH_INDEX} ({SEARCH_INDEX}) VALUES ('rebuild')")
+
+    # External-content indexes are told the old values to remove and the new values to add
+    insert = f'INSERT INTO {SEARCH_INDEX} (rowid, {columns}) VALUES (NEW.model_id, {new_values});'
+    delete = f"INSERT INTO {SEARCH_INDEX} ({SEARCH_INDEX}, rowid, {columns}) VALUES ('delete', OLD.model_id, {old_values});"
+    cursor.execute(f'CREATE TRIGGER {SEARCH_INDEX}_insert AFTER INSERT ON vehicle_model BEGIN {insert} END')
+    cursor.execute(f'CREATE TRIGGER {SEARCH_INDEX}_delete AFTER DELETE ON vehicle_model BEGIN {delete} END')
+    cursor.execute(f'''
+        CREATE TRIGGER {SEARCH_INDEX}_update AFTER UPDATE OF model_id, {columns} ON vehicle_model
+        BEGIN {delete} {insert} END
+    ''')
+
+    cursor.execute('SELECT COUNT(*) FROM vehicle_model')
+    logging.info(f'Rebuilt search index {SEARCH_INDEX} over {cursor.fetchone()[0]} models')
+    conn.commit()
+
+
+def search_terms(text):
+    """Splits search text into lowercase words, dropping punctuation the index does not store."""
+    words = ''.join(ch if ch.isalnum() else ' ' for ch in text.lower()).split()
+    if not words:
+        raise ValueError('Enter a name to search for')
+    return words
+
+
+def ranked_models(cursor, text):
+    """Returns [model_id] of the models whose names contain every word of text, best match first.
+
+    Each word also matches longer words it starts, so 'mod 3' finds 'Model 3'. The index ranks
+    by BM25; without it, the names are scanned and models come back in model_id order.
+    """
+    words = search_terms(text)
+    if search_index_built(cursor):
+        query = ' '.join(f'"{word}"*' for word in words)
+        cursor.execute(f'SELECT rowid FROM {SEARCH_INDEX} WHERE {SEARCH_INDEX} MATCH ? ORDER BY rank, rowid', (query,))
+    else:
+        names = " || ' ' || ".join(f"COALESCE({quote_identifier(col)}, '')" for col in SEARCH_COLUMNS)
+        conditions = ' AND '.join(f"({names}) LIKE ? ESCAPE '\\'" for _ in words)
+        escaped = ['%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%' for word in words]
+        cursor.execute(f'SELECT model_id FROM vehicle_model WHERE {conditions} ORDER BY model_id', escaped)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def fetch_entries(cursor, table_name, key_column, keys):
+    """Returns the table's entries with the given keys as {column: value} dicts, in the order of keys."""
+    columns = [col for col, _ in table_columns(cursor, table_name)]
+    select_list = ', '.join(quote_identifier(col) for col in columns)
+    key = quote_identifier(key_column)
+    cursor.execute(f'SELECT {select_list} FROM {table_name} WHERE {key} IN (SELECT value FROM json_each(?))',
+                   (json.dumps(keys),))
+    position = columns.index(key_column)
+    entries = {row[position]: dict(zip(columns, row)) for row in cursor.fetchall()}
+    return columns, [entries[k] for k in keys if k in entries]
+
+
+def search_names(cursor, table_name, text, limit=SEARCH_PAGE_ROWS, after=None):
+    """Returns one page of the entries whose Vehicle Name or Model_full contain every word of text.
+
+    Entries come in rank order and, within a model, in storage order. Pass the returned
+    next_after back as after to get the following page; it is None on the last page.
+    """
+    if table_name not in NAME_SEARCH_TABLES:
+        raise ValueError(f'{table_name} cannot be searched by name')
+    limit = max(1, min(int(limit), MAX_SEARCH_PAGE_ROWS))
+    models = ranked_models(cursor, text)
+
+    # Walk the ranked models from the one the previous page stopped in, seeking on model_id
+    start, last_rowid = 0, 0
+    if after is not None:
+        model_id, last_rowid = after
+        start = models.index(model_id) if model_id in models else len(models)
+    found = []
+    for model_id in models[start:]:
+        cursor.execute('SELECT rowid, Surrogate_Key FROM vehicle_fact WHERE model_id = ? AND rowid > ? '
+                       'ORDER BY rowid LIMIT ?', (model_id, last_rowid, limit + 1 - len(found)))
+        found.extend((model_id, rowid, key) for rowid, key in cursor.fetchall())
+        if len(found) > limit:
+            break
+        last_rowid = 0
+
+    page = found[:limit]
+    columns, rows = fetch_entries(cursor, table_name, 'Surrogate_Key', [key for _, _, key in page])
+    return {
+        'columns': columns,
+        'rows': rows,
+        'next_after': [page[-1][0], page[-1][1]] if len(found) > limit else None,
+    }
+
+
+def search_vins(cursor, table_name, prefix, limit=SEARCH_PAGE_ROWS, after=None):
+    """Returns one page of the entries whose VIN-NR starts with prefix, in VIN order.
+
+    The prefix becomes a range on VIN-NR's primary key index, so each page is one index seek.
+    Pass the returned next_after back as after to get the following page.
+    """
+    if table_name not in VIN_SEARCH_TABLES:
+        raise ValueError(f'{table_name} cannot be searched by VIN')
+    prefix = prefix.strip().upper()
+    if not prefix:
+        raise ValueError('Enter the start of a VIN to search for')
+    limit = max(1, min(int(limit), MAX_SEARCH_PAGE_ROWS))
+
+    # Every string starting with prefix sorts before prefix with its last character incremented
+    conditions, params = ['"VIN-NR" >= ?', '"VIN-NR" < ?'], [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+    if after is not None:
+        conditions.append('"VIN-NR" > ?')
+        params.append(after)
+    columns = [col for col, _ in table_columns(cursor, table_name)]
+    select_list = ', '.join(quote_identifier(col) for col in columns)
+    cursor.execute(f'SELECT {select_list} FROM {table_name} WHERE {" AND ".join(conditions)} '
+                   f'ORDER BY "VIN-NR" LIMIT ?', params + [limit])
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return {
+        'columns': columns,
+        'rows': rows,
+        'next_after': rows[-1]['VIN-NR'] if len(rows) == limit else None,
+    }
@@ -0,0 +1,17 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+PACKAGE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIRECTORY)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """A working directory holding copies of the sample feed and decoder, as the scripts expect."""
+    for filename in ('vins.csv', 'VIN_decoder.csv'):
+        shutil.copy(os.path.join(PACKAGE_DIRECTORY, filename), tmp_path / filename)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
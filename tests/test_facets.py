@@ -0,0 +1,60 @@
+import sqlite3
+
+import pandas as pd
+
+import reset_dbs
+from facets import FACET_TABLES, FACET_VALUE_LIMIT, load_facets, rebuild_facets
+from vin_decoder import VinDecoder
+
+
+def write_feed_with_new_vins(count, output_file):
+    """Writes vins.csv plus count new VINs that decode, made by renumbering matched ones."""
+    vin_data = pd.read_csv('vins.csv')
+    merged_df, _ = VinDecoder.load().decode_frame(vin_data)
+    matched = vin_data[vin_data['VIN-NR'].isin(merged_df['VIN-NR'])].reset_index(drop=True)
+    new_vins = matched.iloc[[i % len(matched) for i in range(count)]].copy()
+    # The decoder keys on the first eight characters and the tenth, so the serial can change freely
+    new_vins['VIN-NR'] = [vin[:11] + f'{900000 + i:06d}' for i, vin in enumerate(new_vins['VIN-NR'])]
+    pd.concat([vin_data, new_vins], ignore_index=True).to_csv(output_file, index=False)
+
+
+def facet_state(conn):
+    """Returns the value lists and the catalogue rows of the listed columns."""
+    cursor = conn.cursor()
+    cursor.execute('SELECT * FROM facet_columns WHERE complete ORDER BY table_name, column_name')
+    listed = cursor.fetchall()
+    return {table_name: load_facets(cursor, table_name) for table_name in FACET_TABLES}, listed
+
+
+def assert_facets_match_rebuild(database_path):
+    conn = sqlite3.connect(database_path)
+    maintained = facet_state(conn)
+    rebuild_facets(conn)
+    assert maintained == facet_state(conn)
+    conn.close()
+
+
+def test_incremental_ingest_keeps_facets_as_a_rebuild_would(workdir):
+    reset_dbs.bulk_load(['vins.csv'])
+    conn = sqlite3.connect('data.db')
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM vehicle_fact')
+    merged_rows = cursor.fetchone()[0]
+    conn.close()
+
+    # Enough new VINs to push Surrogate_Key past the limit, which unlists it
+    write_feed_with_new_vins(FACET_VALUE_LIMIT + 200 - merged_rows, 'bigger.csv')
+    reset_dbs.incremental_ingest('bigger.csv')
+    conn = sqlite3.connect('data.db')
+    facets, _ = facet_state(conn)
+    conn.close()
+    assert facets['merged_nonadmin']['Surrogate_Key'] is None
+    assert_facets_match_rebuild('data.db')
+
+    # Removing them again brings those columns back under the limit
+    reset_dbs.incremental_ingest('vins.csv')
+    conn = sqlite3.connect('data.db')
+    facets, _ = facet_state(conn)
+    conn.close()
+    assert len(facets['merged_nonadmin']['Surrogate_Key']) == merged_rows
+    assert_facets_match_rebuild('data.db')
@@ -0,0 +1,12 @@
+from benchmark import measure_startup
+
+
+def test_make_ui_starts_within_budget_without_heavy_imports():
+    results, problems = measure_startup(repeats=3)
+    assert results
+    assert problems == []
+
+
+def test_startup_check_reports_an_overrun():
+    _, problems = measure_startup(repeats=1, budget_seconds=0)
+    assert any('budget' in problem for problem in problems)
@@ -0,0 +1,63 @@
+import http.client
+import json
+import socket
+import sqlite3
+import threading
+
+import pytest
+
+import reset_dbs
+import vehicle_service
+
+
+@pytest.fixture
+def server(workdir):
+    reset_dbs.bulk_load(['vins.csv'])
+    server = vehicle_service.make_server(str(workdir / 'data.db'), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get(server, path):
+    conn = http.client.HTTPConnection(*server.server_address, timeout=10)
+    conn.request('GET', path)
+    return conn, conn.getresponse()
+
+
+def test_error_after_stream_started_ends_the_connection(server):
+    def failing_rows(table_name, filters=None, batch_size=None):
+        yield [(None,) * len(server.store.columns(table_name))]
+        raise sqlite3.OperationalError('disk I/O error')
+
+    server.store.iter_rows = failing_rows
+    with socket.create_connection(server.server_address, timeout=5) as sock:
+        sock.sendall(b'GET /tables/merged_nonadmin/export?format=ndjson HTTP/1.1\r\nHost: test\r\n\r\n')
+        received = b''
+        while True:
+            data = sock.recv(65536)  # Times out if the server keeps the connection open
+            if not data:
+                break
+            received += data
+
+    # One 200 and its first chunk, then the connection closes without the closing chunk or a JSON error
+    assert received.startswith(b'HTTP/1.1 200')
+    assert received.count(b'HTTP/1.1') == 1
+    assert not received.endswith(b'0\r\n\r\n')
+
+
+def test_unexpected_error_before_stream_is_a_500(server):
+    def broken_columns(table_name):
+        raise RuntimeError('broken')
+
+    server.store.columns = broken_columns
+    conn, response = get(server, '/tables/merged_nonadmin/columns')
+    assert response.status == 500
+    assert json.loads(response.read()) == {'error': 'Internal server error'}
+
+    # The connection is still usable for the next request
+    conn.request('GET', '/tables')
+    assert json.loads(conn.getresponse().read()) == {'tables': ['merged_nonadmin']}
+    conn.close()
@@ -0,0 +1,184 @@
+import argparse
+import csv
+import io
+import json
+import logging
+import sqlite3
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from vehicle_store import DEFAULT_PAGE_ROWS, GUEST_HIDDEN_COLUMNS, VehicleStore
+
+# Tables served unless others are named; merged_nonadmin is the one without VIN-NR
+DEFAULT_SERVED_TABLES = ['merged_nonadmin']
+
+# Query parameters with a meaning of their own; every other parameter is an equality filter
+RESERVED_PARAMETERS = {'limit', 'after', 'format', 'group', 'filter_column', 'filter_value', 'column', 'prefix'}
+
+STREAM_FORMATS = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+
+
+class VehicleRequestHandler(BaseHTTPRequestHandler):
+    """Answers read-only JSON requests against the vehicle store.
+
+    GET /tables                              served table names
+    GET /tables/<table>/columns              column names
+    GET /tables/<table>/rows?col=value&limit=&after=
+                                             one page of matching rows, keyset-paginated
+    GET /tables/<table>/rows/<key>           one entry by its key
+    GET /tables/<table>/counts?group=col[&filter_column=&filter_value=][&col=value]
+                                             row counts per value of a column among matching rows
+    GET /tables/<table>/values?column=col[&prefix=&limit=]
+                                             distinct values starting with a prefix
+    GET /tables/<table>/export?format=csv|ndjson&col=value
+                                             every matching row, streamed in chunks
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.stream_started = False
+        try:
+            self.route()
+        except Exception as e:
+            if self.stream_started:
+                # The chunked 200 is already out, so the error cannot be sent; end the connection
+                # without the closing chunk so the client sees the body is incomplete
+                logging.error(f'Stream failed for {self.path}: {type(e).__name__}: {e}')
+                self.close_connection = True
+            elif isinstance(e, ValueError):
+                self.send_json({'error': str(e)}, 400)
+            elif isinstance(e, sqlite3.Error):
+                logging.error(f'Query failed for {self.path}: {str(e)}')
+                self.send_json({'error': str(e)}, 500)
+            else:
+                logging.exception(f'Request failed for {self.path}')
+                self.send_json({'error': 'Internal server error'}, 500)
+        finally:
+            # Each request runs on its own thread, so its connection is not reused
+            self.server.store.connections.release()
+
+    def route(self):
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        params = dict(parse_qsl(url.query))
+        store = self.server.store
+
+        if parts == ['tables']:
+            return self.send_json({'tables': self.server.tables})
+        if len(parts) < 3 or parts[0] != 'tables':
+            return self.send_json({'error': 'Not found'}, 404)
+        table_name, action = parts[1], parts[2]
+        if table_name not in self.server.tables:
+            return self.send_json({'error': f'Table {table_name} is not served'}, 404)
+
+        filters = {name: value for name, value in params.items() if name not in RESERVED_PARAMETERS}
+        if action == 'columns':
+            return self.send_json({'columns': store.columns(table_name)})
+        if action == 'rows' and len(parts) == 4:
+            entry = store.lookup(table_name, parts[3])
+            return self.send_json(entry if entry is not None else {'error': 'Entry not found'}, 200 if entry else 404)
+        if action == 'rows':
+            return self.send_json(store.query(table_name, filters, params.get('limit', DEFAULT_PAGE_ROWS),
+                                              params.get('after')))
+        if action == 'counts':
+            if params.get('filter_column'):
+                filters[params['filter_column']] = params.get('filter_value')
+            counts = store.counts(table_name, params.get('group', ''), filters)
+            return self.send_json({'counts': [{'value': value, 'count': count} for value, count in counts]})
+        if action == 'values':
+            values = store.search_values(table_name, params.get('column', ''), params.get('prefix', ''),
+                                         int(params.get('limit', 50)))
+            return self.send_json({'values': values})
+        if action == 'export':
+            return self.stream_rows(table_name, filters, params.get('format', 'csv'))
+        return self.send_json({'error': 'Not found'}, 404)
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream_rows(self, table_name, filters, fmt):
+        """Streams matching rows with chunked transfer encoding, one chunk per fetched batch."""
+        if fmt not in STREAM_FORMATS:
+            raise ValueError(f'Unsupported format {fmt} (use {", ".join(STREAM_FORMATS)})')
+        store = self.server.store
+        columns = store.columns(table_name)
+        batches = store.iter_rows(table_name, filters)
+        first_batch = next(batches, [])  # Raises for a bad filter before the response has started
+
+        self.stream_started = True
+        self.send_response(200)
+        self.send_header('Content-Type', STREAM_FORMATS[fmt])
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        if fmt == 'csv':
+            self.write_chunk(self.csv_text([columns]))
+        if first_batch:
+            self.write_chunk(self.format_rows(first_batch, columns, fmt))
+        for rows in batches:
+            self.write_chunk(self.format_rows(rows, columns, fmt))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def format_rows(self, rows, columns, fmt):
+        if fmt == 'csv':
+            return self.csv_text(rows)
+        return ''.join(json.dumps(dict(zip(columns, row)), default=str) + '\n' for row in rows)
+
+    def csv_text(self, rows):
+        output = io.StringIO()
+        csv.writer(output).writerows(rows)
+        return output.getvalue()
+
+    def write_chunk(self, text):
+        data = text.encode('utf-8')
+        if data:
+            self.wfile.write(f'{len(data):X}\r\n'.encode('ascii') + data + b'\r\n')
+
+    def log_message(self, format, *args):
+        logging.info(f'{self.address_string()} {format % args}')
+
+
+def make_server(database_path='data.db', host='127.0.0.1', port=8642, tables=DEFAULT_SERVED_TABLES):
+    """Creates a threaded HTTP server answering from a read-only vehicle store that cannot read VIN-NR."""
+    exposed = [table for table in tables if table in GUEST_HIDDEN_COLUMNS]
+    if exposed:
+        raise ValueError(f'Cannot serve {", ".join(exposed)}: guest connections cannot read VIN-NR')
+    server = ThreadingHTTPServer((host, port), VehicleRequestHandler)
+    server.daemon_threads = True
+    server.store = VehicleStore(database_path, read_only=True, hidden_columns=GUEST_HIDDEN_COLUMNS)
+    server.tables = list(tables)
+    return server
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serve read-only JSON queries over the vehicle tables.')
+    parser.add_argument('--database', default='data.db', help='database to serve (default data.db)')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8642, help='port to listen on (default 8642)')
+    parser.add_argument('--tables', nargs='+', default=DEFAULT_SERVED_TABLES,
+                        help='tables to serve (default merged_nonadmin); tables with VIN-NR, such as '
+                             'merged_admin and unmerged_vins, cannot be served')
+    args = parser.parse_args()
+    exposed = [table for table in args.tables if table in GUEST_HIDDEN_COLUMNS]
+    if exposed:
+        parser.error(f'Cannot serve {", ".join(exposed)}: guest connections cannot read VIN-NR')
+    return args
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename='service.log', level=logging.INFO, format='%(asctime)s [%(levelname)s] - %(message)s')
+    args = parse_args()
+    server = make_server(args.database, args.host, args.port, args.tables)
+    print(f'Serving {", ".join(server.tables)} from {args.database} on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
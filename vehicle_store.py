@@ -0,0 +1,361 @@
+import sqlite3
+
+from connections import ConnectionManager
+from export_engine import EXPORT_BATCH_ROWS, export_query
+from facets import FACET_VALUE_LIMIT, facets_available, load_facets, search_column_values
+from key_allocator import reserve_surrogate_keys
+from query_builder import filter_clause, quote_identifier, select_query, table_columns
+from rollups import grouped_counts
+from search import SEARCH_PAGE_ROWS, search_names, search_vins
+
+# Tables the store serves and the column each one's entries are looked up by
+TABLE_KEYS = {
+    'merged_admin': 'VIN-NR',
+    'merged_nonadmin': 'Surrogate_Key',
+    'unmerged_vins': 'VIN-NR',
+}
+
+# Column each table's pages are keyed on; the merged tables are views and have no rowid of their own
+PAGE_KEYS = {
+    'merged_admin': 'Surrogate_Key',
+    'merged_nonadmin': 'Surrogate_Key',
+    'unmerged_vins': 'rowid',
+}
+
+# Columns a guest session may never read, whichever table or view it queries them through.
+# merged_admin is listed for databases that have not been moved to vehicle_fact yet.
+GUEST_HIDDEN_COLUMNS = {
+    'vehicle_fact': ['VIN-NR'],
+    'merged_admin': ['VIN-NR'],
+    'unmerged_vins': ['VIN-NR'],
+}
+
+# Rows per page returned by query() unless the caller asks for fewer
+DEFAULT_PAGE_ROWS = 100
+MAX_PAGE_ROWS = 1000
+
+# Fixed statements for adding, updating and removing entries. Each keeps one SQL text, so the
+# connection's statement cache prepares it once and reuses it for every later edit. merged_admin
+# is a view whose triggers write vehicle_model and vehicle_fact, and merged_nonadmin entries are
+# only ever written through merged_admin.
+ENTRY_STATEMENTS = {
+    'insert_merged_admin': '''INSERT INTO merged_admin ("VIN-NR", "Vehicle Name", Make, Model_full, Vehicle_Manufacturer,
+        Technology, Model_Year, Date_Added, Date_Updated, VIN_Key, Vehicle_Category,
+        Vehicle_Use_Case, Vehicle_Class, Zip, Surrogate_Key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'insert_unmerged_vins': '''INSERT INTO unmerged_vins ("VIN-NR", "MAKE-OF-CAR", "MODEL-Short", "MODEL-YEAR", key1, key2, Surrogate_Key)
+        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+    'update_merged_admin': '''UPDATE merged_admin SET "Vehicle Name"=?, Make=?, Model_full=?, Vehicle_Manufacturer=?,
+        Technology=?, Model_Year=?, Date_Added=?, Date_Updated=?, VIN_Key=?, Vehicle_Category=?,
+        Vehicle_Use_Case=?, Vehicle_Class=?, Zip=?, Surrogate_Key=? WHERE "VIN-NR"=?''',
+    'update_unmerged_vins': '''UPDATE unmerged_vins SET "MAKE-OF-CAR" = ?, "MODEL-Short" = ?, "MODEL-YEAR" = ?,
+        key1 = ?, key2 = ?, Surrogate_Key = ? WHERE "VIN-NR" = ?''',
+    'delete_merged_admin': "DELETE FROM merged_admin WHERE [VIN-NR]=?",
+    'delete_merged_admin_by_key': "DELETE FROM merged_admin WHERE Surrogate_Key=?",
+    'delete_unmerged_vins': "DELETE FROM unmerged_vins WHERE \"VIN-NR\"=?",
+}
+
+
+def keyset_condition(sort_column, page_key, token, ascending):
+    """Returns the condition and parameters selecting the rows that follow token in page order.
+
+    Pages are ordered by page_key, or by (sort_column, page_key) with token a (value, key) pair.
+    SQLite sorts NULLs first, so an ascending walk meets the NULL values before all others and a
+    descending walk meets them last.
+    """
+    op = '>' if ascending else '<'
+    if sort_column is None:
+        return f'{page_key} {op} ?', [int(token)]
+    value, key = token
+    if value is None:
+        if ascending:
+            return f'(({sort_column} IS NULL AND {page_key} > ?) OR {sort_column} IS NOT NULL)', [key]
+        return f'({sort_column} IS NULL AND {page_key} < ?)', [key]
+    condition = f'{sort_column} {op} ? OR ({sort_column} = ? AND {page_key} {op} ?)'
+    if not ascending:
+        condition += f' OR {sort_column} IS NULL'
+    return f'({condition})', [value, value, key]
+
+
+def add_entry_to_merged_admin(cursor, entry_data):
+    """Adds a new entry to the merged_admin table."""
+    sql = ENTRY_STATEMENTS['insert_merged_admin']
+    cursor.execute(sql, entry_data)
+
+
+def add_entry_to_unmerged_vins(cursor, entry_data):
+    """Adds a new entry to the unmerged_vins table; the caller commits."""
+    sql = ENTRY_STATEMENTS['insert_unmerged_vins']
+    cursor.execute(sql, entry_data)
+
+
+def remove_from_merged_admin(cursor, vin_nr):
+    """Removes an entry from the merged_admin table."""
+    sql = ENTRY_STATEMENTS['delete_merged_admin']
+    cursor.execute(sql, (vin_nr,))
+
+
+def remove_from_merged_nonadmin(cursor, surrogate_key):
+    """Removes the merged_admin entry behind a merged_nonadmin entry."""
+    sql = ENTRY_STATEMENTS['delete_merged_admin_by_key']
+    cursor.execute(sql, (surrogate_key,))
+
+
+def remove_from_unmerged_vins(cursor, vin_nr):
+    """Removes an entry from the unmerged_vins table; the caller commits."""
+    sql = ENTRY_STATEMENTS['delete_unmerged_vins']
+    cursor.execute(sql, (vin_nr,))
+
+
+def update_merged_admin(cursor, vin_nr, updated_data):
+    """Updates an entry in the merged_admin table."""
+    sql = ENTRY_STATEMENTS['update_merged_admin']
+    cursor.execute(sql, updated_data + (vin_nr,))
+
+
+def update_unmerged_vins(cursor, vin_nr, updated_data):
+    """Updates an entry in the unmerged_vins table; the caller commits."""
+    if len(updated_data) != 6:
+        raise ValueError("Incorrect number of data items supplied for updating unmerged_vins.")
+
+    sql = ENTRY_STATEMENTS['update_unmerged_vins']
+    cursor.execute(sql, updated_data + (vin_nr,))
+
+
+class VehicleStore:
+    """Query and edit API over data.db, independent of any user interface.
+
+    Each thread gets its own connection from the store's ConnectionManager, so many threads can
+    read at once (the database is in WAL mode) while one writes. Methods raise ValueError for an
+    unknown table or column and let sqlite3 errors propagate to the caller. After each committed
+    write, every function in change_listeners is called with the table name and the Surrogate_Keys
+    of the entries written, or None when the entries are not known.
+    """
+
+    def __init__(self, database_path, read_only=False, connections=None, hidden_columns=None):
+        self.connections = connections or ConnectionManager(database_path, read_only=read_only,
+                                                            hidden_columns=hidden_columns)
+        self.change_listeners = []
+
+    def cursor(self):
+        """Returns a cursor on the calling thread's connection."""
+        return self.connections.connect().cursor()
+
+    def check_table(self, table_name):
+        if table_name not in TABLE_KEYS:
+            raise ValueError(f'Unknown table {table_name}')
+
+    def notify_changes(self, table_name, keys=None):
+        """Tells the change listeners which entries of a table were written; None means any of them."""
+        for listener in self.change_listeners:
+            listener(table_name, keys)
+
+    def entry_key(self, cursor, table_name, vin):
+        """Returns the Surrogate_Key of the entry for a VIN, or None if there is none."""
+        cursor.execute(f'SELECT Surrogate_Key FROM {table_name} WHERE "VIN-NR" = ?', (vin,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def columns(self, table_name):
+        """Returns the column names of a table in order."""
+        self.check_table(table_name)
+        return [col for col, _ in table_columns(self.cursor(), table_name)]
+
+    def lookup(self, table_name, key):
+        """Returns the entry with the given key as {column: value}, or None if there is none."""
+        self.check_table(table_name)
+        cursor = self.cursor()
+        key_column = quote_identifier(TABLE_KEYS[table_name])
+        cursor.execute(f'SELECT * FROM {table_name} WHERE {key_column} = ?', (key,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip((description[0] for description in cursor.description), row))
+
+    def query(self, table_name, filters=None, limit=DEFAULT_PAGE_ROWS, after=None, before=None, order_by=None,
+              descending=False):
+        """Returns one page of entries matching the filters (see query_builder.filter_condition).
+
+        Pages are keyed on rowid (Surrogate_Key for the merged views), so each page is a range seek
+        however deep it is. Pass the returned next_after back as after to get the following page
+        and previous_before as before to get the one preceding it; each is None when there are no
+        rows in that direction. order_by sorts on a column, with the page key breaking ties; the
+        page tokens are then [value, key] pairs, and the seek is only a range seek on an indexed
+        column.
+        """
+        self.check_table(table_name)
+        if after is not None and before is not None:
+            raise ValueError('Pass after or before, not both')
+        cursor = self.cursor()
+        limit = max(1, min(int(limit), MAX_PAGE_ROWS))
+        where_clause, params = filter_clause(cursor, table_name, filters)
+        columns = [col for col, _ in table_columns(cursor, table_name)]
+        if order_by is not None and order_by not in columns:
+            raise ValueError(f'Unknown column {order_by} in {table_name}')
+
+        # Earlier pages are read walking backwards from before, then put back in page order
+        page_key = PAGE_KEYS[table_name]
+        sort_column = quote_identifier(order_by) if order_by is not None else None
+        forward = before is None
+        ascending = forward != bool(descending)
+        token = after if forward else before
+        if token is not None:
+            condition, token_params = keyset_condition(sort_column, page_key, token, ascending)
+            where_clause += f' AND {condition}'
+            params += token_params
+        direction = 'ASC' if ascending else 'DESC'
+        order_clause = f'{page_key} {direction}' if sort_column is None else \
+            f'{sort_column} {direction}, {page_key} {direction}'
+
+        select_list = ', '.join(quote_identifier(col) for col in columns)
+        cursor.execute(f'SELECT {page_key}, {select_list} FROM {table_name} WHERE {where_clause} '
+                       f'ORDER BY {order_clause} LIMIT ?', params + [limit])
+        rows = cursor.fetchall()
+        if not forward:
+            rows.reverse()
+
+        def page_token(row):
+            return row[0] if order_by is None else [row[columns.index(order_by) + 1], row[0]]
+
+        # A full page may have rows beyond it; a page read from a token has rows behind it
+        full = len(rows) == limit
+        more_after = full if forward else token is not None
+        more_before = token is not None if forward else full
+        return {
+            'columns': columns,
+            'rows': [dict(zip(columns, row[1:])) for row in rows],
+            'next_after': page_token(rows[-1]) if rows and more_after else None,
+            'previous_before': page_token(rows[0]) if rows and more_before else None,
+        }
+
+    def iter_rows(self, table_name, filters=None, batch_size=EXPORT_BATCH_ROWS):
+        """Yields the entries matching the filters as lists of row tuples, batch_size rows at a time."""
+        self.check_table(table_name)
+        cursor = self.cursor()
+        cursor.execute(*select_query(cursor, table_name, filters))
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    def counts(self, table_name, group_column, filters=None):
+        """Returns [(value, count)] of group_column over the entries matching the filters."""
+        self.check_table(table_name)
+        return grouped_counts(self.cursor(), table_name, group_column, filters)
+
+    def column_values(self, table_name):
+        """Returns {column: [distinct values]}; columns with too many values to list map to None."""
+        self.check_table(table_name)
+        cursor = self.cursor()
+
+        # Serve the values from the facet catalogue when it has been built
+        if facets_available(cursor, table_name):
+            return load_facets(cursor, table_name)
+
+        unique_values = {}
+        for col, _ in table_columns(cursor, table_name):
+            cursor.execute(f"SELECT DISTINCT {quote_identifier(col)} FROM {table_name} "
+                           f"WHERE {quote_identifier(col)} IS NOT NULL LIMIT ?", (FACET_VALUE_LIMIT + 1,))
+            values = [row[0] for row in cursor.fetchall()]
+            unique_values[col] = values if len(values) <= FACET_VALUE_LIMIT else None
+        return unique_values
+
+    def search_values(self, table_name, column, prefix='', limit=50):
+        """Returns up to limit distinct values of a column that start with prefix."""
+        self.check_table(table_name)
+        return search_column_values(self.cursor(), table_name, column, prefix, limit)
+
+    def search_vins(self, table_name, prefix, limit=SEARCH_PAGE_ROWS, after=None):
+        """Returns one page of the entries whose VIN-NR starts with prefix; see search.search_vins."""
+        self.check_table(table_name)
+        return search_vins(self.cursor(), table_name, prefix, limit, after)
+
+    def search_names(self, table_name, text, limit=SEARCH_PAGE_ROWS, after=None):
+        """Returns one page of the entries whose names contain every word of text; see search.search_names."""
+        self.check_table(table_name)
+        return search_names(self.cursor(), table_name, text, limit, after)
+
+    def export(self, table_name, filters, path, progress=None, count_total=False):
+        """Streams the entries matching the filters to a CSV, compressed CSV or Parquet file."""
+        self.check_table(table_name)
+        return export_query(self.cursor(), table_name, filters, path, progress=progress, count_total=count_total)
+
+    def add_entry(self, table_name, entry_data):
+        """Adds an entry and returns its surrogate key.
+
+        entry_data holds the table's columns in add-dialog order: for the merged tables, VIN-NR
+        and then the decoded columns through Zip; for unmerged_vins, its columns through
+        Surrogate_Key, which is reserved from the key sequence when left blank.
+        """
+        self.check_table(table_name)
+        cursor = self.cursor()
+        entry_data = tuple(entry_data)
+        try:
+            if table_name == 'merged_admin':
+                # merged_nonadmin is a view of merged_admin, so the entry appears there too
+                surrogate_key = reserve_surrogate_keys(cursor)
+                add_entry_to_merged_admin(cursor, entry_data + (surrogate_key,))
+            elif table_name == 'merged_nonadmin':
+                raise ValueError('merged_nonadmin entries are added through merged_admin')
+            else:
+                surrogate_key = entry_data[-1]
+                if not surrogate_key:
+                    surrogate_key = reserve_surrogate_keys(cursor)
+                    entry_data = entry_data[:-1] + (surrogate_key,)
+                add_entry_to_unmerged_vins(cursor, entry_data)
+            cursor.connection.commit()
+        except (sqlite3.Error, ValueError):
+            cursor.connection.rollback()
+            raise
+        self.notify_changes(table_name, [surrogate_key])
+        return surrogate_key
+
+    def update_entry(self, table_name, vin, updated_data):
+        """Updates the entry for a VIN from its columns after VIN-NR, in table order.
+
+        Updating merged_admin also updates what merged_nonadmin shows for the entry.
+        """
+        self.check_table(table_name)
+        cursor = self.cursor()
+        updated_data = tuple(updated_data)
+        # The update may move the entry to another Surrogate_Key; listeners hear about both
+        if self.change_listeners and table_name != 'merged_nonadmin':
+            keys = [self.entry_key(cursor, table_name, vin), updated_data[-1]]
+        else:
+            keys = None
+        try:
+            if table_name == 'merged_admin':
+                update_merged_admin(cursor, vin, updated_data)
+            elif table_name == 'unmerged_vins':
+                update_unmerged_vins(cursor, vin, updated_data)
+            else:
+                raise ValueError('merged_nonadmin entries are updated through merged_admin')
+            cursor.connection.commit()
+        except (sqlite3.Error, ValueError):
+            cursor.connection.rollback()
+            raise
+        self.notify_changes(table_name, keys)
+
+    def remove_entry(self, table_name, key):
+        """Removes the entry with the given key; merged_admin and merged_nonadmin remove the same vehicle."""
+        self.check_table(table_name)
+        cursor = self.cursor()
+        if table_name == 'merged_nonadmin':
+            keys = [key]
+        else:
+            keys = [self.entry_key(cursor, table_name, key)] if self.change_listeners else None
+        try:
+            if table_name == 'merged_admin':
+                remove_from_merged_admin(cursor, key)
+            elif table_name == 'merged_nonadmin':
+                remove_from_merged_nonadmin(cursor, key)
+            else:
+                remove_from_unmerged_vins(cursor, key)
+            cursor.connection.commit()
+        except sqlite3.Error:
+            cursor.connection.rollback()
+            raise
+        self.notify_changes(table_name, keys)
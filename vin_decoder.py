@@ -0,0 +1,157 @@
+import hashlib
+import logging
+import os
+import pickle
+
+import pandas as pd
+
+# Default locations of the decoder CSV and of the compiled index cache
+DECODER_PATH = 'VIN_decoder.csv'
+CACHE_DIRECTORY = '.vin_decoder_cache'
+
+# Bump this whenever the pickled layout of VinDecoder changes
+INDEX_FORMAT_VERSION = 1
+
+# Decoder columns and the names they are stored under in the merged_admin table
+ADMIN_COLUMN_NAMES = {
+    'Vehicle Name': 'Vehicle Name',
+    'Make': 'Make',
+    'Model-full': 'Model_full',
+    'Vehicle Manufacturer': 'Vehicle_Manufacturer',
+    'Technology': 'Technology',
+    'Model Year': 'Model_Year',
+    'Date Added': 'Date_Added',
+    'Date Updated': 'Date_Updated',
+    'VIN_Key': 'VIN_Key',
+    'Vehicle Category': 'Vehicle_Category',
+    'Vehicle Use Case': 'Vehicle_Use_Case',
+    'Vehicle Class': 'Vehicle_Class',
+}
+
+
+def vin_lookup_key(vin):
+    """Returns the decoder key for a VIN: the 8-char prefix plus the model-year code."""
+    vin = str(vin)
+    if len(vin) < 10:
+        return None
+    return vin[:8] + vin[9]
+
+
+def file_content_hash(path):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class VinDecoder:
+    """Compiled lookup from (VIN prefix, model-year code) to a VIN_decoder.csv row."""
+
+    def __init__(self, keys, rows, content_hash=None):
+        self.keys = keys  # pd.Index of unique prefix + year-code keys
+        self.rows = rows  # decoder rows, positionally aligned with keys
+        self.content_hash = content_hash
+
+    @classmethod
+    def compile(cls, decoder_path=DECODER_PATH, content_hash=None):
+        """Parses the decoder CSV into a VinDecoder."""
+        vin_decoder = pd.read_csv(decoder_path, encoding='latin1')
+        keys = vin_decoder.iloc[:, 0].astype(str).str[:8] + vin_decoder.iloc[:, 1].astype(str)
+
+        # Keep the first row for a repeated key, as the merge + drop_duplicates did
+        first = ~keys.duplicated(keep='first')
+        rows = vin_decoder[first].reset_index(drop=True)
+        return cls(pd.Index(keys[first].tolist()), rows, content_hash)
+
+    @classmethod
+    def load(cls, decoder_path=DECODER_PATH, cache_directory=CACHE_DIRECTORY):
+        """Loads the compiled decoder from the cache, compiling and saving it on a miss."""
+        content_hash = file_content_hash(decoder_path)
+        cache_path = os.path.join(cache_directory, f'vin_decoder_{content_hash}.pkl')
+
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    cached = pickle.load(f)
+                if cached.get('version') == INDEX_FORMAT_VERSION:
+                    return cls(cached['keys'], cached['rows'], content_hash)
+            except Exception as e:
+                logging.warning(f'Ignoring unreadable decoder cache {cache_path}: {e}')
+
+        decoder = cls.compile(decoder_path, content_hash)
+        try:
+            os.makedirs(cache_directory, exist_ok=True)
+            with open(cache_path, 'wb') as f:
+                pickle.dump({'version': INDEX_FORMAT_VERSION, 'keys': decoder.keys, 'rows': decoder.rows}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            logging.info(f'Saved compiled VIN decoder to {cache_path}')
+        except OSError as e:
+            logging.warning(f'Could not save decoder cache {cache_path}: {e}')
+        return decoder
+
+    def __len__(self):
+        return len(self.keys)
+
+    def memory_usage(self):
+        """Returns the approximate number of bytes held by the decoder."""
+        return int(self.rows.memory_usage(index=True, deep=True).sum() + self.keys.memory_usage(deep=True))
+
+    def decode(self, vin):
+        """Returns the decoder row for a single VIN as a dict, or None if it does not decode."""
+        key = vin_lookup_key(vin)
+        if key is None:
+            return None
+        try:
+            position = self.keys.get_loc(key)
+        except KeyError:
+            return None
+        return self.rows.iloc[position].to_dict()
+
+    def decode_admin_fields(self, vin):
+        """Returns the decoded merged_admin column values for a VIN, or None."""
+        row = self.decode(vin)
+        if row is None:
+            return None
+        return {admin_name: row[decoder_name] for decoder_name, admin_name in ADMIN_COLUMN_NAMES.items()}
+
+    def admin_entries(self):
+        """Returns {key: tuple of merged_admin column values, in ADMIN_COLUMN_NAMES order} for every entry.
+
+        Values are plain Python objects as SQLite returns them: missing cells are None and whole
+        numbers are ints, so entries compare equal to the same values read back from data.db.
+        """
+        columns = []
+        for decoder_name in ADMIN_COLUMN_NAMES:
+            column = self.rows[decoder_name]
+            if column.dtype.kind == 'f' and (column.dropna() % 1 == 0).all():
+                column = column.astype('Int64')  # Whole numbers read as floats because a cell is missing
+            values = column.astype(object)
+            columns.append(values.where(pd.notna(values), None).tolist())
+        return dict(zip(self.keys, zip(*columns)))
+
+    def lookup_positions(self, vins):
+        """Returns the decoder row position for each VIN in a batch, -1 where it does not decode."""
+        vins = pd.Series(vins, dtype=object).astype(str)
+        keys = vins.str[:8] + vins.str[9]
+        return self.keys.get_indexer(keys)
+
+    def decode_frame(self, vin_data):
+        """Splits a VIN DataFrame into merged and unmerged frames, keyed on its first column.
+
+        The merged frame holds the VIN columns followed by the decoder columns; the
+        unmerged frame keeps the key1/key2 columns, as the pandas merge used to.
+        """
+        vins = vin_data.iloc[:, 0].astype(str)
+        vin_data = vin_data.assign(key1=vins.str[:8], key2=vins.str[9])
+
+        positions = self.lookup_positions(vins)
+        matched = positions >= 0
+
+        merged_df = vin_data[matched].drop(columns=['key1', 'key2']).reset_index(drop=True)
+        decoded = self.rows.take(positions[matched]).reset_index(drop=True)
+        merged_df = pd.concat([merged_df, decoded], axis=1)
+
+        unmerged_df = vin_data[~matched]
+        return merged_df, unmerged_df